@@ -0,0 +1,166 @@
+import re
+import asyncio
+import asyncssh
+from ssh import parse_command_output
+from ssh_cli import single_command_result
+
+# Thông báo lỗi giống ssh.describe_connection_error để hai engine trả về cùng nội dung
+AUTH_ERROR_MESSAGE = "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
+TIMEOUT_ERROR_MESSAGE = "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi."
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]|\x1b[()][A-Za-z0-9]')
+READ_CHUNK_SIZE = 65536
+
+# Cách nhận dạng prompt và các lệnh tắt phân trang theo kiểu thiết bị
+DEVICE_PROFILES = {
+    'cisco_ios': {'prompt': r'[\w.\-@()/:]+[>#]\s*$', 'setup': ('terminal length 0', 'terminal width 511')},
+    'cisco_xe': {'prompt': r'[\w.\-@()/:]+[>#]\s*$', 'setup': ('terminal length 0', 'terminal width 511')},
+    'cisco_xr': {'prompt': r'[\w.\-@()/:]+[>#]\s*$', 'setup': ('terminal length 0', 'terminal width 511')},
+    'juniper_junos': {'prompt': r'[\w.\-@()/:]+[>#%]\s*$', 'setup': ('set cli screen-length 0', 'set cli screen-width 0')},
+    'alcatel_sros': {'prompt': r'[\w.\-@()/:*!]+[>#$]\s*$', 'setup': ('environment no more',)},
+    'nokia_sros': {'prompt': r'[\w.\-@()/:*!]+[>#$]\s*$', 'setup': ('environment no more',)},
+}
+DEFAULT_PROFILE = {'prompt': r'[\w.\-@()/:]+[>#$%]\s*$', 'setup': ('terminal length 0',)}
+# Các kiểu thiết bị Netmiko tương đương
+DEVICE_TYPE_ALIASES = {'juniper': 'juniper_junos', 'cisco_nxos': 'cisco_ios', 'nokia_sros': 'alcatel_sros'}
+
+
+def device_profile(device_type):
+    return DEVICE_PROFILES.get(DEVICE_TYPE_ALIASES.get(device_type, device_type), DEFAULT_PROFILE)
+
+
+class AsyncCliSession:
+    """Một phiên CLI tương tác (shell có PTY) trên kết nối asyncssh: nhận dạng prompt, tắt phân trang, gửi lệnh."""
+
+    def __init__(self, process, device_type):
+        self.process = process
+        self.profile = device_profile(device_type)
+        self.prompt_pattern = re.compile(self.profile['prompt'])
+        self.prompt = None
+
+    async def _read_until_prompt(self, timeout):
+        buffer = ''
+
+        async def read():
+            nonlocal buffer
+            while True:
+                chunk = await self.process.stdout.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    raise ConnectionError("Thiết bị đã đóng phiên SSH.")
+                buffer += chunk.replace('\r', '')
+                # Chỉ cần kiểm tra dòng cuối cùng (prompt luôn nằm ở cuối output)
+                last_line = ANSI_ESCAPE.sub('', buffer[buffer.rfind('\n') + 1:])
+                if self.prompt is None:
+                    if self.prompt_pattern.search(last_line):
+                        return
+                elif last_line.strip() == self.prompt:
+                    return
+
+        await asyncio.wait_for(read(), timeout)
+        return ANSI_ESCAPE.sub('', buffer)
+
+    async def prepare(self, timeout):
+        """Chờ prompt đầu tiên, ghi nhận chính xác prompt của thiết bị và tắt phân trang."""
+        await self._read_until_prompt(timeout)
+        self.process.stdin.write('\n')
+        output = await self._read_until_prompt(timeout)
+        self.prompt = output.rstrip('\n').rsplit('\n', 1)[-1].strip()
+        for command in self.profile['setup']:
+            await self.send_command(command, timeout)
+
+    async def send_command(self, command, read_timeout):
+        """Gửi một lệnh và trả về output (đã bỏ dòng lặp lại lệnh và dòng prompt cuối)."""
+        self.process.stdin.write(command + '\n')
+        lines = (await self._read_until_prompt(read_timeout)).split('\n')
+        if lines and lines[0].strip().endswith(command):
+            lines = lines[1:]
+        return '\n'.join(lines[:-1]).strip('\n')
+
+
+async def ssh_run_commands_async(device_type, hostname, username, password, commands, use_textfsm=False, port=22, timeout=10, read_timeout=120):
+    """
+    Phiên bản asyncio của ssh.ssh_run_commands (cùng tham số và định dạng kết quả {'success', 'results', 'error'}).
+    Một phiên SSH chỉ tốn một coroutine thay vì một thread, nên một tiến trình có thể giữ hàng trăm phiên cùng lúc.
+    """
+    results = {}
+    error_message = None
+
+    try:
+        async with asyncssh.connect(
+            hostname, port=port, username=username, password=password,
+            known_hosts=None, connect_timeout=timeout, login_timeout=timeout,
+            client_keys=None, agent_path=None
+        ) as conn:
+            process = await conn.create_process(
+                term_type='vt100', term_size=(511, 24), encoding='utf-8', errors='replace'
+            )
+            session = AsyncCliSession(process, device_type)
+            await session.prepare(timeout)
+            for index, spec in enumerate(commands):
+                try:
+                    output = await session.send_command(spec['command'], read_timeout)
+                except asyncio.TimeoutError:
+                    # Output của lệnh bị timeout có thể còn tới sau, các lệnh tiếp theo trên phiên này sẽ không đọc đúng
+                    results[spec['key']] = {'success': False, 'output': None, 'parsed_output': None,
+                                            'error': f"Đã xảy ra lỗi không mong muốn: Lệnh không trả về prompt sau {read_timeout} giây."}
+                    for skipped in commands[index + 1:]:
+                        results[skipped['key']] = {'success': False, 'output': None, 'parsed_output': None,
+                                                   'error': "Không chạy do lệnh trước đó bị timeout."}
+                    break
+                parsed_output, parse_error = None, None
+                if use_textfsm:
+                    parsed_output, parse_error = parse_command_output(output, device_type, spec['command'], spec.get('textfsm_template'))
+                results[spec['key']] = {
+                    'success': True,
+                    'output': output.strip() if output else None,
+                    'parsed_output': parsed_output,
+                    'error': parse_error
+                }
+            process.stdin.write('exit\n')
+
+    except asyncssh.PermissionDenied:
+        error_message = AUTH_ERROR_MESSAGE
+    except (asyncio.TimeoutError, TimeoutError):
+        error_message = TIMEOUT_ERROR_MESSAGE
+    except Exception as e:
+        # Các lỗi chung khác (ví dụ: lỗi kết nối...)
+        error_message = f"Đã xảy ra lỗi không mong muốn: {e}"
+
+    return {
+        'success': error_message is None and all(result['success'] for result in results.values()),
+        'results': results,
+        'error': error_message
+    }
+
+
+async def run_on_hosts_async(hosts, commands, on_result, use_textfsm=False, timeout=10, read_timeout=120, workers=200):
+    """
+    Chạy các câu lệnh trên nhiều thiết bị trong một event loop, tối đa `workers` phiên SSH đồng thời.
+    on_result(dict) được gọi với kết quả từng thiết bị (thêm key 'host') ngay khi thiết bị đó xong,
+    theo định dạng của ssh.run_on_hosts.
+    """
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def run_one(host):
+        async with semaphore:
+            batch_result = await ssh_run_commands_async(
+                device_type=host['device_type'],
+                hostname=host['hostname'],
+                username=host['username'],
+                password=host['password'],
+                commands=commands,
+                use_textfsm=use_textfsm,
+                port=host.get('port', 22),
+                timeout=timeout,
+                read_timeout=read_timeout
+            )
+        result = single_command_result(batch_result, commands[0]['key']) if len(commands) == 1 else batch_result
+        return {'host': host['hostname'], **result}
+
+    for future in asyncio.as_completed([run_one(host) for host in hosts]):
+        on_result(await future)
+
+
+def ssh_run_commands_with_asyncssh(*args, **kwargs):
+    """Gọi đồng bộ ssh_run_commands_async (cho một thiết bị)."""
+    return asyncio.run(ssh_run_commands_async(*args, **kwargs))
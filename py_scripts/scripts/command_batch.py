@@ -0,0 +1,55 @@
+import os
+import json
+
+
+def load_command_specs(commands=None, commands_json=None, default_template=None):
+    """
+    Chuẩn hóa danh sách câu lệnh cần chạy trên cùng một phiên SSH.
+
+    Args:
+        commands (list, optional): Các câu lệnh truyền bằng nhiều tham số --command.
+        commands_json (str, optional): Chuỗi JSON hoặc đường dẫn file JSON: mảng các câu lệnh (chuỗi) hoặc đối tượng
+                                       {"command": "...", "textfsm_template": "...", "key": "..."}.
+        default_template (str, optional): Template TextFSM dùng cho các câu lệnh không khai báo template riêng
+                                          (chỉ áp dụng khi chỉ có một câu lệnh, giữ tương thích với --textfsm-template).
+
+    Returns:
+        list: Danh sách dictionary {'key', 'command', 'textfsm_template'} theo thứ tự chạy.
+              key mặc định là chính câu lệnh; key trùng được thêm hậu tố '#2', '#3', ...
+
+    Raises:
+        ValueError: Nếu JSON không hợp lệ hoặc thiếu câu lệnh.
+    """
+    entries = list(commands or [])
+    if commands_json:
+        if os.path.isfile(commands_json):
+            with open(commands_json, 'r', encoding='utf-8') as file:
+                loaded = json.load(file)
+        else:
+            try:
+                loaded = json.loads(commands_json)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Danh sách câu lệnh không phải JSON hợp lệ: {e}")
+        if not isinstance(loaded, list):
+            raise ValueError("Danh sách câu lệnh phải là một mảng JSON.")
+        entries.extend(loaded)
+
+    specs = []
+    used_keys = {}
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'command': entry}
+        if not isinstance(entry, dict) or not str(entry.get('command') or '').strip():
+            raise ValueError(f"Mục câu lệnh không hợp lệ: {entry}")
+        command = entry['command'].strip()
+        key = str(entry.get('key') or command)
+        used_keys[key] = used_keys.get(key, 0) + 1
+        if used_keys[key] > 1:
+            key = f"{key}#{used_keys[key]}"
+        specs.append({'key': key, 'command': command, 'textfsm_template': entry.get('textfsm_template') or entry.get('template')})
+
+    if not specs:
+        raise ValueError("Cần ít nhất một câu lệnh (--command hoặc --commands-json).")
+    if default_template and len(specs) == 1 and not specs[0]['textfsm_template']:
+        specs[0]['textfsm_template'] = default_template
+    return specs
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+from netmiko import ConnectHandler
+from netmiko.exceptions import NetmikoBaseException, SSHException
+from ssh import device_params_for, describe_connection_error
+from textfsm_registry import SCRIPT_DIR, parse_with_template
+
+WORKFLOW_TEMPLATES_DIR = os.path.join(SCRIPT_DIR, "textfsm_template")
+
+# Bộ đếm được đọc cho mỗi port (tên field trong template là chữ hoa)
+COUNTER_FIELDS = ('in_octets', 'out_octets', 'in_packets', 'out_packets', 'in_errors', 'out_errors', 'in_discards', 'out_discards')
+# Độ rộng bộ đếm được thử khi giá trị giảm (IOS cũ dùng bộ đếm 32 bit, Junos/SR OS dùng 64 bit)
+COUNTER_WIDTHS = (32, 64)
+
+DEFAULT_POLL_INTERVAL = 10
+# Số khoảng đo gần nhất giữ trong vòng đệm để tính tốc độ trung bình
+DEFAULT_WINDOW = 30
+
+# Lệnh đọc bộ đếm của một port ({port}) và template tương ứng theo kiểu thiết bị
+COUNTER_COMMANDS = {
+    'juniper_junos': ('show interfaces {port} extensive', os.path.join(WORKFLOW_TEMPLATES_DIR, "juniper_show_interface_counters.textfsm")),
+    'alcatel_sros': ('show port {port} detail', os.path.join(WORKFLOW_TEMPLATES_DIR, "nokia_show_port_counters.textfsm")),
+    'cisco_ios': ('show interfaces {port}', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_interface_counters.textfsm")),
+    'cisco_xe': ('show interfaces {port}', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_interface_counters.textfsm")),
+    'cisco_xr': ('show interfaces {port}', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_interface_counters.textfsm")),
+}
+DEVICE_TYPE_ALIASES = {'juniper': 'juniper_junos', 'nokia': 'alcatel_sros'}
+# Lỗi làm hỏng phiên SSH: đóng phiên và kết nối lại ở lượt sau
+SESSION_ERRORS = (NetmikoBaseException, SSHException, OSError, EOFError)
+
+
+def counter_profile(device_type):
+    """Câu lệnh và template đọc bộ đếm theo kiểu thiết bị, hoặc ValueError nếu chưa hỗ trợ."""
+    profile = COUNTER_COMMANDS.get(DEVICE_TYPE_ALIASES.get(device_type, device_type))
+    if profile is None:
+        raise ValueError(f"Chưa hỗ trợ đọc bộ đếm interface cho kiểu thiết bị '{device_type}'.")
+    return profile
+
+
+def to_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def counter_delta(previous, current):
+    """
+    Mức tăng của bộ đếm giữa hai lần đọc.
+    Giá trị giảm được coi là tràn (wrap) ở độ rộng nhỏ nhất chứa được giá trị trước, nếu mức tăng suy ra
+    nhỏ hơn nửa dải của bộ đếm; ngược lại là bộ đếm bị xóa (clear counters, khởi động lại) và mức tăng
+    là giá trị hiện tại.
+
+    Returns:
+        tuple: (mức tăng, sự kiện: None, 'wrap32', 'wrap64' hoặc 'reset').
+    """
+    if current >= previous:
+        return current - previous, None
+    for bits in COUNTER_WIDTHS:
+        limit = 1 << bits
+        if previous < limit:
+            delta = limit - previous + current
+            if delta < limit // 2:
+                return delta, f"wrap{bits}"
+            break
+    return current, 'reset'
+
+
+class CounterRing:
+    """
+    Vòng đệm (ring buffer) các khoảng đo gần nhất của một port: mức tăng của từng bộ đếm và độ dài mỗi khoảng.
+    Tổng của cửa sổ được cộng khoảng mới và trừ khoảng bị ghi đè, nên mỗi lần đọc chỉ tốn O(số bộ đếm).
+    """
+
+    def __init__(self, capacity=DEFAULT_WINDOW):
+        self.capacity = max(1, capacity)
+        self.deltas = [None] * self.capacity
+        self.durations = [0.0] * self.capacity
+        self.head = 0
+        self.size = 0
+        self.window_deltas = [0] * len(COUNTER_FIELDS)
+        self.window_duration = 0.0
+        self.last_counters = None
+        self.last_time = None
+
+    def add(self, counters, moment):
+        """
+        Thêm một lần đọc bộ đếm.
+
+        Args:
+            counters (tuple): Giá trị theo thứ tự COUNTER_FIELDS (None nếu thiết bị không có bộ đếm đó).
+            moment (float): Thời điểm đọc theo time.monotonic().
+
+        Returns:
+            dict: {'interval', 'deltas', 'events'} của khoảng vừa đo, hoặc None ở lần đọc đầu tiên (mới có mốc).
+        """
+        previous, previous_time = self.last_counters, self.last_time
+        self.last_counters, self.last_time = counters, moment
+        if previous is None or moment <= previous_time:
+            return None
+
+        duration = moment - previous_time
+        deltas, events = [], {}
+        for name, old, new in zip(COUNTER_FIELDS, previous, counters):
+            if old is None or new is None:
+                deltas.append(None)
+                continue
+            delta, event = counter_delta(old, new)
+            deltas.append(delta)
+            if event:
+                events[name] = event
+
+        if self.size == self.capacity:
+            # Vòng đệm đầy: trừ khoảng cũ nhất (sắp bị ghi đè) khỏi tổng của cửa sổ
+            for index, value in enumerate(self.deltas[self.head]):
+                if value is not None:
+                    self.window_deltas[index] -= value
+            self.window_duration -= self.durations[self.head]
+        else:
+            self.size += 1
+        self.deltas[self.head] = deltas
+        self.durations[self.head] = duration
+        for index, value in enumerate(deltas):
+            if value is not None:
+                self.window_deltas[index] += value
+        self.window_duration += duration
+        self.head = (self.head + 1) % self.capacity
+        return {'interval': duration, 'deltas': dict(zip(COUNTER_FIELDS, deltas)), 'events': events}
+
+    def window_rates(self):
+        """Tốc độ trung bình mỗi giây của từng bộ đếm trên các khoảng trong vòng đệm."""
+        if self.window_duration <= 0:
+            return {}
+        return {name: value / self.window_duration for name, value in zip(COUNTER_FIELDS, self.window_deltas)}
+
+
+def per_second(value, duration, scale=1):
+    return None if value is None else round(value * scale / duration, 1)
+
+
+def rate_record(host, port, sample, ring):
+    """Bản ghi gọn của một khoảng đo: tốc độ bit/gói mỗi giây, số lỗi/drop tăng thêm và trung bình trên cửa sổ."""
+    deltas, duration = sample['deltas'], sample['interval']
+    window = ring.window_rates()
+    record = {
+        'ts': round(time.time(), 3),
+        'host': host,
+        'port': port,
+        'interval': round(duration, 3),
+        'in_bps': per_second(deltas['in_octets'], duration, 8),
+        'out_bps': per_second(deltas['out_octets'], duration, 8),
+        'in_pps': per_second(deltas['in_packets'], duration),
+        'out_pps': per_second(deltas['out_packets'], duration),
+        'in_errors': deltas['in_errors'],
+        'out_errors': deltas['out_errors'],
+        'in_discards': deltas['in_discards'],
+        'out_discards': deltas['out_discards'],
+        'avg_in_bps': per_second(window.get('in_octets'), 1, 8),
+        'avg_out_bps': per_second(window.get('out_octets'), 1, 8),
+        'window': round(ring.window_duration, 1),
+    }
+    if sample['events']:
+        record['events'] = sample['events']
+    # Bỏ các bộ đếm thiết bị không có để bản ghi gọn
+    return {key: value for key, value in record.items() if value is not None}
+
+
+class CounterPoller:
+    """
+    Giữ một phiên SSH tới thiết bị và đọc bộ đếm của các port qua phiên đó ở mỗi lượt.
+    Mất kết nối thì phiên được mở lại ở lượt sau; vòng đệm của các port được giữ nguyên nên khoảng đo
+    đầu tiên sau khi kết nối lại trải qua cả thời gian mất kết nối.
+    """
+
+    def __init__(self, device_type, host, username, password, ports, port=22, timeout=10, read_timeout=60, window=DEFAULT_WINDOW):
+        device_type = DEVICE_TYPE_ALIASES.get(device_type, device_type)
+        self.command, self.template_path = counter_profile(device_type)
+        self.params = device_params_for(device_type, host, username, password, port, timeout)
+        self.host = host
+        self.ports = list(ports)
+        self.read_timeout = read_timeout
+        self.rings = {name: CounterRing(window) for name in self.ports}
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.disconnect()
+            except Exception:
+                pass
+            self.connection = None
+
+    def read_counters(self, port):
+        """
+        Returns:
+            tuple: (bộ đếm theo COUNTER_FIELDS, thời điểm đọc).
+        Raises:
+            ValueError: Nếu output không chứa bộ đếm của port.
+        """
+        command = self.command.format(port=port)
+        started = time.monotonic()
+        output = self.connection.send_command(command, read_timeout=self.read_timeout)
+        # Lấy thời điểm giữa lúc gửi lệnh và lúc nhận xong output làm thời điểm đọc
+        moment = (started + time.monotonic()) / 2
+        rows = parse_with_template(output, self.template_path)
+        if not rows:
+            raise ValueError(f"Không đọc được bộ đếm của port '{port}' từ output lệnh '{command}'.")
+        return tuple(to_int(rows[0].get(name.upper())) for name in COUNTER_FIELDS), moment
+
+    def poll(self):
+        """
+        Một lượt đọc bộ đếm của tất cả port.
+        Yields:
+            dict: Bản ghi tốc độ của từng port (lượt đầu chỉ lấy mốc nên không có), hoặc bản ghi lỗi.
+        Raises:
+            Lỗi kết nối/phiên SSH (phiên đã được đóng để lượt sau mở lại).
+        """
+        try:
+            if self.connection is None:
+                self.connection = ConnectHandler(**self.params)
+            for name in self.ports:
+                try:
+                    counters, moment = self.read_counters(name)
+                except ValueError as e:
+                    yield {'ts': round(time.time(), 3), 'host': self.host, 'port': name, 'error': str(e)}
+                    continue
+                ring = self.rings[name]
+                sample = ring.add(counters, moment)
+                if sample is not None:
+                    yield rate_record(self.host, name, sample, ring)
+        except SESSION_ERRORS:
+            self.close()
+            raise
+
+
+def run_polling(poller, interval=DEFAULT_POLL_INTERVAL, count=0, summary=None):
+    """
+    Đọc bộ đếm theo lịch cố định (lượt sau cách lượt trước `interval` giây, không trôi theo thời gian chạy lệnh;
+    lượt chạy quá lâu thì bỏ các mốc đã lỡ), in mỗi bản ghi một dòng JSON (NDJSON).
+
+    Args:
+        count (int): Số lần tính tốc độ cho mỗi port (lượt đầu chỉ lấy mốc); 0 là chạy tới khi bị dừng.
+        summary (dict): Tổng kết số lượt đọc, số bản ghi tốc độ và số lỗi, được cập nhật sau mỗi lượt
+            (vẫn dùng được khi vòng lặp bị dừng giữa chừng).
+
+    Returns:
+        dict: summary.
+    """
+    if summary is None:
+        summary = {'polls': 0, 'samples': 0, 'errors': 0}
+    next_poll = time.monotonic()
+    while not count or summary['polls'] <= count:
+        try:
+            for record in poller.poll():
+                summary['errors' if 'error' in record else 'samples'] += 1
+                print(json.dumps(record, ensure_ascii=False), flush=True)
+        except SESSION_ERRORS as e:
+            summary['errors'] += 1
+            print(json.dumps({'ts': round(time.time(), 3), 'host': poller.host, 'error': describe_connection_error(e)}, ensure_ascii=False), flush=True)
+        summary['polls'] += 1
+        if count and summary['polls'] > count:
+            break
+
+        next_poll += interval
+        now = time.monotonic()
+        if next_poll < now:
+            next_poll += (now - next_poll) // interval * interval + interval
+        time.sleep(next_poll - now)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đọc định kỳ bộ đếm interface qua một phiên SSH, tính tốc độ và số lỗi tăng thêm của từng port (xuất NDJSON).")
+    parser.add_argument('--device_type', type=str, required=True, help=f"Kiểu thiết bị Netmiko ({', '.join(COUNTER_COMMANDS)}).")
+    parser.add_argument('--ip', type=str, required=True, help='Địa chỉ IP hoặc hostname của router.')
+    parser.add_argument('--user', type=str, required=True, help='Tên người dùng SSH.')
+    parser.add_argument('--password', type=str, required=True, help='Mật khẩu SSH.')
+    parser.add_argument('--port', type=int, default=22, help='Cổng SSH (mặc định: 22).')
+    parser.add_argument('--interfaces', nargs='+', required=True, help='Các port cần theo dõi, ví dụ: xe-0/0/1 1/1/1 Te0/0/1.')
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL, help=f'Số giây giữa hai lượt đọc (mặc định: {DEFAULT_POLL_INTERVAL}).')
+    parser.add_argument('--count', type=int, default=0, help='Số lần tính tốc độ cho mỗi port rồi thoát (mặc định: 0, chạy tới khi bị dừng).')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help=f'Số khoảng đo gần nhất dùng để tính tốc độ trung bình (mặc định: {DEFAULT_WINDOW}).')
+    parser.add_argument('--timeout', type=int, default=10, help='Thời gian chờ kết nối/xác thực SSH (giây).')
+    parser.add_argument('--read-timeout', type=int, default=60, help='Thời gian chờ tối đa output của mỗi lệnh (giây).')
+    args = parser.parse_args()
+
+    if args.interval <= 0:
+        parser.error("--interval phải lớn hơn 0.")
+    try:
+        poller = CounterPoller(args.device_type, args.ip, args.user, args.password, args.interfaces, args.port,
+                               args.timeout, args.read_timeout, args.window)
+    except ValueError as e:
+        print(json.dumps({'done': True, 'success': False, 'error': str(e)}, ensure_ascii=False))
+        sys.exit(1)
+
+    # Dừng bằng SIGTERM (n8n hủy execution) vẫn đóng phiên SSH và in dòng tổng kết
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    summary = {'polls': 0, 'samples': 0, 'errors': 0}
+    try:
+        run_polling(poller, args.interval, args.count, summary)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        poller.close()
+    print(json.dumps({'done': True, 'success': True, **summary, 'error': None}, ensure_ascii=False))
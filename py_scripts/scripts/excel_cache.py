@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+import tempfile
+
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Thư mục cache mặc định cho các sheet Excel đã đọc (không dùng thư mục tạm dùng chung: file cache được nạp bằng pickle)
+DEFAULT_CACHE_DIR = os.path.join(SCRIPT_DIR, "output", "route_excel_cache")
+# File cache không được dùng lâu hơn thời gian này (giây) hoặc làm thư mục vượt quá dung lượng này thì bị xóa
+DEFAULT_MAX_CACHE_AGE = 7 * 24 * 3600
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Tăng khi thay đổi cách đọc/lưu sheet để bỏ qua cache cũ
+CACHE_FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path):
+    """Tính SHA-256 nội dung file theo từng khối."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _atomic_write(path, data):
+    # Ghi ra file tạm rồi đổi tên để tiến trình khác không bao giờ đọc phải file ghi dở
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ExcelSheetCache:
+    """
+    Cache các sheet Excel đã đọc bằng pandas dưới dạng DataFrame pickle (các cột numpy, nạp lại rất nhanh).
+    Key cache là SHA-256 nội dung file + tên sheet; mtime/kích thước của file nguồn được lưu kèm để
+    không phải tính lại hash khi file không thay đổi.
+    Vì pickle.load chạy được mã tùy ý, thư mục cache phải thuộc người dùng hiện tại và không cho người khác ghi.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Raises:
+            PermissionError: Nếu thư mục cache thuộc người khác hoặc nhóm/người khác ghi được.
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        stat = os.stat(cache_dir)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError(f"Thư mục cache '{cache_dir}' phải thuộc người dùng hiện tại và không cho người khác ghi.")
+
+    def _meta_path(self, path):
+        path_key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{path_key}.meta.json")
+
+    def _data_path(self, content_hash, sheet_name):
+        sheet_key = hashlib.sha1(repr(sheet_name).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{content_hash}-{sheet_key}-v{CACHE_FORMAT_VERSION}.pkl")
+
+    def source_hash(self, path):
+        """
+        Trả về SHA-256 của file nguồn. Dùng lại hash đã lưu nếu mtime và kích thước không đổi,
+        ngược lại tính lại và cập nhật file meta.
+        """
+        stat = os.stat(path)
+        meta_path = self._meta_path(path)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get('mtime_ns') == stat.st_mtime_ns and meta.get('size') == stat.st_size:
+                return meta['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        content_hash = file_sha256(path)
+        meta = {'path': os.path.abspath(path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': content_hash}
+        _atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+        return content_hash
+
+    def read_excel(self, path, sheet_name=None):
+        """
+        Đọc một sheet (mặc định sheet đầu tiên) giống pd.read_excel, dùng bản cache nếu nội dung file không đổi.
+        Returns:
+            tuple: (DataFrame, True nếu lấy từ cache)
+        """
+        data_path = self._data_path(self.source_hash(path), sheet_name)
+        try:
+            with open(data_path, 'rb') as file:
+                df = pickle.load(file)
+            # Cập nhật mtime để prune giữ lại các sheet vẫn đang được dùng
+            os.utime(data_path)
+            return df, True
+        except Exception:
+            # Chưa có cache, hoặc file cache hỏng/không tương thích: đọc lại từ Excel và ghi đè
+            pass
+
+        df = pd.read_excel(path, sheet_name=sheet_name if sheet_name else 0)
+        _atomic_write(data_path, pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+        return df, False
+
+    def prune(self, max_age=DEFAULT_MAX_CACHE_AGE, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        """Xóa các file cache không được dùng quá max_age giây, rồi xóa file cũ nhất tới khi tổng dung lượng <= max_bytes."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > max_age:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,119 @@
+import math
+import os
+
+import openpyxl
+
+try:
+    import xlsxwriter # Ghi Excel ở chế độ constant_memory (mỗi lần chỉ giữ một hàng trong bộ nhớ)
+except ImportError:
+    xlsxwriter = None
+
+from json_stream import DEFAULT_BATCH_SIZE
+
+
+def _is_empty_row(values):
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in values)
+
+
+def iter_excel_rows(path, sheet_name=None):
+    """
+    Đọc các hàng của một sheet Excel dạng luồng bằng openpyxl read_only (không nạp toàn bộ workbook).
+    Hàng đầu tiên là tiêu đề cột; mỗi hàng dữ liệu được trả về dưới dạng dictionary {tiêu đề: giá trị}.
+    Giống pd.read_excel: các hàng trống ở giữa được giữ lại, các hàng trống ở cuối sheet bị bỏ qua.
+
+    Args:
+        path (str): Đường dẫn file Excel.
+        sheet_name (str, optional): Tên sheet; mặc định là sheet đầu tiên.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            return
+        headers = [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header_row)]
+
+        pending_empty = 0 # Số hàng trống liên tiếp chưa biết có nằm ở cuối sheet hay không
+        for values in rows:
+            if _is_empty_row(values):
+                pending_empty += 1
+                continue
+            for _ in range(pending_empty):
+                yield dict.fromkeys(headers)
+            pending_empty = 0
+            row = dict(zip(headers, values))
+            for header in headers[len(values):]:
+                row[header] = None
+            yield row
+    finally:
+        workbook.close()
+
+
+def iter_excel_batches(path, sheet_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Gom các hàng Excel đọc dạng luồng thành từng lô (list) để kiểm tra dữ liệu theo cột."""
+    batch = []
+    for row in iter_excel_rows(path, sheet_name):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ExcelRowWriter:
+    """
+    Ghi file Excel từng hàng một mà không giữ cả sheet trong bộ nhớ.
+    Dùng xlsxwriter (constant_memory) nếu có, nếu không dùng openpyxl ở chế độ write_only.
+    """
+
+    def __init__(self, path, headers, sheet_title="Sheet1"):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.path = path
+        self.row_count = 0
+        if xlsxwriter is not None:
+            self._workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+            self._sheet = self._workbook.add_worksheet(sheet_title[:31])
+            self._next_row = 0
+        else:
+            self._workbook = openpyxl.Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet(sheet_title[:31])
+        self._append(list(headers))
+
+    @staticmethod
+    def _cell_value(value):
+        # Ô trống cho NaN/inf (xlsxwriter không ghi được) và cho kiểu dữ liệu phức tạp thì ghi dạng chuỗi
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        if isinstance(value, (list, tuple, dict, set)):
+            return str(value)
+        return value
+
+    def _append(self, values):
+        values = [self._cell_value(value) for value in values]
+        if xlsxwriter is not None:
+            self._sheet.write_row(self._next_row, 0, values)
+            self._next_row += 1
+        else:
+            self._sheet.append(values)
+
+    def append(self, values):
+        """Ghi một hàng dữ liệu (list giá trị theo thứ tự tiêu đề)."""
+        self._append(values)
+        self.row_count += 1
+
+    def close(self):
+        if xlsxwriter is not None:
+            self._workbook.close()
+        else:
+            self._workbook.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,446 @@
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from textfsm_registry import SCRIPT_DIR
+
+DEFAULT_SNAPSHOT_DB = os.path.join(SCRIPT_DIR, "output", "fleet_snapshot.db")
+# Số snapshot giữ lại cho mỗi (thiết bị, loại dữ liệu)
+DEFAULT_KEEP_SNAPSHOTS = 24
+
+CUSTOM_TEMPLATES_DIR = os.path.join(SCRIPT_DIR, "templates")
+WORKFLOW_TEMPLATES_DIR = os.path.join(SCRIPT_DIR, "textfsm_template")
+
+# Vendor trong bảng router (MySQL) -> device_type Netmiko, giống node phân loại lệnh của workflow n8n
+VENDOR_DEVICE_TYPES = {'nokia': 'alcatel_sros', 'juniper': 'juniper_junos', 'cisco': 'cisco_xr'}
+
+# Loại dữ liệu -> device_type -> câu lệnh và template (cùng lệnh/template mà workflow dùng khi hỏi trực tiếp)
+SNAPSHOT_COMMANDS = {
+    'inventory': {
+        'juniper_junos': ('show chassis hardware', os.path.join(CUSTOM_TEMPLATES_DIR, "juniper_junos_show_chassis_hardware.textfsm")),
+        'cisco_ios': ('show inventory', os.path.join(CUSTOM_TEMPLATES_DIR, "cisco_ios_show_inventory.textfsm")),
+        'cisco_xe': ('show inventory', os.path.join(CUSTOM_TEMPLATES_DIR, "cisco_ios_show_inventory.textfsm")),
+        'cisco_xr': ('show inventory', os.path.join(CUSTOM_TEMPLATES_DIR, "cisco_ios_show_inventory.textfsm")),
+    },
+    'optics': {
+        'juniper_junos': ('show interfaces diagnostics optics', os.path.join(WORKFLOW_TEMPLATES_DIR, "juniper_show_optical.textfsm")),
+        'cisco_ios': ('show interfaces transceiver', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_optical.textfsm")),
+        'cisco_xe': ('show interfaces transceiver', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_optical.textfsm")),
+        'cisco_xr': ('show interfaces transceiver', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_optical.textfsm")),
+        'alcatel_sros': ('show port detail', os.path.join(WORKFLOW_TEMPLATES_DIR, "nokia_show_optical.textfsm")),
+    },
+    'alarms': {
+        'juniper_junos': ('show system alarms', os.path.join(WORKFLOW_TEMPLATES_DIR, "juniper_show_system_alarm.textfsm")),
+        'cisco_ios': ('show facility-alarm status', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_facility_alarm_status.textfsm")),
+        'cisco_xe': ('show facility-alarm status', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_facility_alarm_status.textfsm")),
+        'cisco_xr': ('show facility-alarm status', os.path.join(WORKFLOW_TEMPLATES_DIR, "cisco_show_facility_alarm_status.textfsm")),
+        'alcatel_sros': ('show system alarms', os.path.join(WORKFLOW_TEMPLATES_DIR, "nokia_show_system_alarm.textfsm")),
+    },
+}
+SNAPSHOT_CATEGORIES = tuple(SNAPSHOT_COMMANDS)
+
+# Cột trong file export bảng router (MySQL) hoặc CSV thay thế
+FLEET_FIELD_ALIASES = {
+    'name': ('Router_name', 'router_name', 'name'),
+    'hostname': ('IP', 'ip', 'host', 'hostname'),
+    'vendor': ('Vendor', 'vendor'),
+    'device_type': ('device_type', 'device-type'),
+    'province': ('Province', 'province'),
+    'site_id': ('Site_ID', 'site_id'),
+    'router_type': ('Router_type', 'router_type'),
+    'username': ('user', 'username'),
+    'password': ('password',),
+    'port': ('port',),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    name TEXT PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    port INTEGER NOT NULL DEFAULT 22,
+    device_type TEXT,
+    vendor TEXT,
+    province TEXT,
+    site_id TEXT,
+    router_type TEXT,
+    last_collected_at REAL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    category TEXT NOT NULL,
+    command TEXT NOT NULL,
+    collected_at REAL NOT NULL,
+    success INTEGER NOT NULL,
+    error TEXT,
+    raw_output TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_device_category ON snapshots (device, category, collected_at);
+CREATE TABLE IF NOT EXISTS latest (
+    device TEXT NOT NULL,
+    category TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    PRIMARY KEY (device, category)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    snapshot_id INTEGER NOT NULL,
+    device TEXT NOT NULL,
+    category TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS fields_snapshot ON fields (snapshot_id, row_index);
+CREATE INDEX IF NOT EXISTS fields_device ON fields (device, category, field);
+CREATE INDEX IF NOT EXISTS fields_value ON fields (category, field, value);
+"""
+
+
+def load_fleet(path, username=None, password=None, port=22):
+    """
+    Đọc danh sách router từ file export bảng router (CSV hoặc JSON, các cột Router_name, IP, Vendor, ...).
+    device_type lấy từ cột device_type nếu có, nếu không thì suy ra từ Vendor.
+
+    Returns:
+        list: Dictionary với 'name', 'hostname', 'device_type', 'username', 'password', 'port' và thông tin site.
+    """
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            entries = list(csv.DictReader(file))
+        else:
+            entries = json.load(file)
+            if not isinstance(entries, list):
+                raise ValueError("File JSON phải là một mảng các router.")
+
+    devices = []
+    for entry in entries:
+        device = {}
+        for field, aliases in FLEET_FIELD_ALIASES.items():
+            for alias in aliases:
+                value = entry.get(alias)
+                if value not in (None, ''):
+                    device[field] = value.strip() if isinstance(value, str) else value
+                    break
+        if 'hostname' not in device:
+            raise ValueError(f"Thiếu địa chỉ IP trong mục: {entry}")
+        device.setdefault('name', device['hostname'])
+        if 'device_type' not in device:
+            device['device_type'] = VENDOR_DEVICE_TYPES.get(str(device.get('vendor', '')).lower())
+        device.setdefault('username', username)
+        device.setdefault('password', password)
+        device['port'] = int(device.get('port', port))
+        devices.append(device)
+    return devices
+
+
+def snapshot_specs(device_type, categories=SNAPSHOT_CATEGORIES):
+    """Các câu lệnh {'key', 'command', 'textfsm_template'} cần chạy cho một kiểu thiết bị (key là loại dữ liệu)."""
+    specs = []
+    for category in categories:
+        entry = SNAPSHOT_COMMANDS[category].get(device_type)
+        if entry:
+            specs.append({'key': category, 'command': entry[0], 'textfsm_template': entry[1]})
+    return specs
+
+
+class SnapshotStore:
+    """
+    Kho snapshot SQLite (chế độ WAL: chatbot đọc được trong lúc collector đang ghi).
+    - snapshots: mỗi lần chạy một lệnh trên một thiết bị (kèm output thô và lỗi nếu có).
+    - fields: từng trường của từng bản ghi TextFSM (tên trường viết thường), có index theo thiết bị và theo giá trị.
+    - latest: snapshot thành công mới nhất của mỗi (thiết bị, loại dữ liệu).
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_DB):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def save_device(self, device, collected_at=None, error=None):
+        # Thông tin trạm không có (ví dụ khi chạy lại từ find_device) thì giữ giá trị đã lưu
+        self.conn.execute(
+            "INSERT INTO devices (name, hostname, port, device_type, vendor, province, site_id, router_type, last_collected_at, last_error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET hostname=excluded.hostname, port=excluded.port, device_type=excluded.device_type, vendor=excluded.vendor, "
+            "province=COALESCE(excluded.province, province), site_id=COALESCE(excluded.site_id, site_id), "
+            "router_type=COALESCE(excluded.router_type, router_type), "
+            "last_collected_at=COALESCE(excluded.last_collected_at, last_collected_at), last_error=excluded.last_error",
+            (device['name'], device['hostname'], device.get('port', 22), device.get('device_type'), device.get('vendor'), device.get('province'),
+             device.get('site_id'), device.get('router_type'), collected_at, error)
+        )
+
+    def save_snapshot(self, device_name, category, command, result, collected_at, keep=DEFAULT_KEEP_SNAPSHOTS):
+        """Lưu kết quả một lệnh (định dạng của ssh_run_commands) và cập nhật snapshot mới nhất nếu thành công."""
+        parsed_output = result.get('parsed_output')
+        success = bool(result['success']) and isinstance(parsed_output, list)
+        cursor = self.conn.execute(
+            "INSERT INTO snapshots (device, category, command, collected_at, success, error, raw_output) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (device_name, category, command, collected_at, int(success), result.get('error'), result.get('output'))
+        )
+        snapshot_id = cursor.lastrowid
+        if success:
+            self.conn.executemany(
+                "INSERT INTO fields (snapshot_id, device, category, row_index, field, value) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (snapshot_id, device_name, category, row_index, field.lower(),
+                     value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+                    for row_index, row in enumerate(parsed_output)
+                    for field, value in row.items()
+                ]
+            )
+            self.conn.execute(
+                "INSERT INTO latest (device, category, snapshot_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(device, category) DO UPDATE SET snapshot_id=excluded.snapshot_id",
+                (device_name, category, snapshot_id)
+            )
+        self._prune(device_name, category, keep)
+        return snapshot_id
+
+    def _prune(self, device_name, category, keep):
+        old_ids = [row[0] for row in self.conn.execute(
+            "SELECT id FROM snapshots WHERE device = ? AND category = ? AND id NOT IN (SELECT snapshot_id FROM latest) "
+            "ORDER BY collected_at DESC LIMIT -1 OFFSET ?",
+            (device_name, category, max(0, keep - 1))
+        )]
+        if old_ids:
+            placeholders = ','.join('?' * len(old_ids))
+            self.conn.execute(f"DELETE FROM fields WHERE snapshot_id IN ({placeholders})", old_ids)
+            self.conn.execute(f"DELETE FROM snapshots WHERE id IN ({placeholders})", old_ids)
+
+    def commit(self):
+        self.conn.commit()
+
+    def _rows(self, snapshot_id, row_filter=None):
+        query = "SELECT row_index, field, value FROM fields WHERE snapshot_id = ?"
+        params = [snapshot_id]
+        if row_filter:
+            field, operator, value = row_filter
+            query += (f" AND row_index IN (SELECT row_index FROM fields WHERE snapshot_id = ? AND field = ? AND "
+                      f"{comparison_sql(operator)})")
+            params += [snapshot_id, field.lower(), value]
+        rows = {}
+        for row_index, field, value in self.conn.execute(query + " ORDER BY row_index", params):
+            rows.setdefault(row_index, {})[field] = value
+        return list(rows.values())
+
+    def latest(self, category, device=None, row_filter=None):
+        """
+        Snapshot mới nhất của một loại dữ liệu, cho một thiết bị hoặc tất cả thiết bị.
+
+        Args:
+            row_filter (tuple, optional): (field, operator, value) chỉ lấy bản ghi có trường thỏa điều kiện
+                                          (operator: =, !=, <, <=, >, >= so sánh số; ~ là LIKE).
+
+        Yields:
+            dict: {'device', 'category', 'command', 'collected_at', 'age', 'parsed_output'}.
+        """
+        query = ("SELECT s.id, s.device, s.command, s.collected_at FROM latest l JOIN snapshots s ON s.id = l.snapshot_id "
+                 "WHERE l.category = ?")
+        params = [category]
+        if device:
+            query += " AND l.device = ?"
+            params.append(device)
+        if row_filter:
+            field, operator, value = row_filter
+            # Chỉ các thiết bị có ít nhất một bản ghi thỏa điều kiện (dùng index theo giá trị)
+            query += (f" AND s.id IN (SELECT snapshot_id FROM fields WHERE category = ? AND field = ? AND "
+                      f"{comparison_sql(operator)})")
+            params += [category, field.lower(), value]
+        now = time.time()
+        for snapshot_id, device_name, command, collected_at in self.conn.execute(query + " ORDER BY s.device", params).fetchall():
+            yield {
+                'device': device_name,
+                'category': category,
+                'command': command,
+                'collected_at': collected_at,
+                'age': round(now - collected_at, 1),
+                'parsed_output': self._rows(snapshot_id, row_filter),
+            }
+
+    def find_device(self, name_or_ip):
+        """Thiết bị theo tên (ưu tiên) hoặc IP; None nếu chưa có trong kho."""
+        row = self.conn.execute(
+            "SELECT name, hostname, port, device_type, vendor FROM devices WHERE name = ? OR hostname = ? ORDER BY name = ? DESC LIMIT 1",
+            (name_or_ip, name_or_ip, name_or_ip)
+        ).fetchone()
+        return dict(zip(('name', 'hostname', 'port', 'device_type', 'vendor'), row)) if row else None
+
+
+def comparison_sql(operator):
+    """Điều kiện SQL cho giá trị trường (giá trị lưu dạng chuỗi; so sánh lớn/nhỏ ép sang số)."""
+    if operator == '~':
+        return "value LIKE ?"
+    if operator in ('=', '!='):
+        return f"value {operator} ?"
+    if operator in ('<', '<=', '>', '>='):
+        return f"CAST(value AS REAL) {operator} CAST(? AS REAL)"
+    raise ValueError(f"Toán tử không hợp lệ: '{operator}' (=, !=, <, <=, >, >=, ~).")
+
+
+def collect_device(device, categories, timeout=10, read_timeout=120):
+    """Chạy các lệnh snapshot của một thiết bị trên cùng một phiên SSH."""
+    # Import khi cần: tra cứu snapshot không phải nạp Netmiko
+    from ssh import run_host_commands
+
+    specs = snapshot_specs(device['device_type'], categories)
+    if not specs:
+        return specs, {'success': False, 'results': {}, 'error': f"Không có lệnh snapshot cho kiểu thiết bị '{device['device_type']}'."}
+    return specs, run_host_commands(device, specs, use_textfsm=True, timeout=timeout, read_timeout=read_timeout)
+
+
+def collect_fleet(store, devices, categories=SNAPSHOT_CATEGORIES, timeout=10, read_timeout=120, workers=16, keep=DEFAULT_KEEP_SNAPSHOTS, optics_store=None):
+    """
+    Thu thập snapshot của cả danh sách router, tối đa `workers` phiên SSH đồng thời.
+    Kết quả được ghi vào store ngay khi từng thiết bị xong (chỉ thread chính ghi SQLite).
+    Nếu có optics_store (optics_store.OpticsStore), các lần đo optics được ghi thêm vào time-series.
+
+    Yields:
+        dict: Tóm tắt từng thiết bị {'device', 'success', 'categories', 'error'}.
+    """
+    if optics_store is not None:
+        from optics_store import normalize_optics_rows
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(devices)))) as pool:
+        futures = {pool.submit(collect_device, device, categories, timeout, read_timeout): device for device in devices}
+        for future in as_completed(futures):
+            device = futures[future]
+            collected_at = time.time()
+            try:
+                specs, batch_result = future.result()
+            except Exception as e:
+                specs, batch_result = [], {'success': False, 'results': {}, 'error': f"Đã xảy ra lỗi không mong muốn: {e}"}
+            saved = {}
+            for spec in specs:
+                result = batch_result['results'].get(spec['key'])
+                if result is None:
+                    continue
+                store.save_snapshot(device['name'], spec['key'], spec['command'], result, collected_at, keep)
+                saved[spec['key']] = result['success'] and isinstance(result.get('parsed_output'), list)
+                if optics_store is not None and spec['key'] == 'optics' and saved['optics']:
+                    optics_store.append(device['name'], normalize_optics_rows(result['parsed_output']), collected_at)
+            store.save_device(device, collected_at if saved else None, batch_result['error'])
+            store.commit()
+            yield {'device': device['name'], 'success': bool(saved) and all(saved.values()), 'categories': saved, 'error': batch_result['error']}
+
+
+def parse_row_filter(expression):
+    """'rx_power_dbm<-20' -> ('rx_power_dbm', '<', '-20')."""
+    for operator in ('<=', '>=', '!=', '<', '>', '=', '~'):
+        field, separator, value = expression.partition(operator)
+        if separator and field.strip():
+            return field.strip(), operator, value.strip()
+    raise argparse.ArgumentTypeError(f"Điều kiện không hợp lệ: '{expression}' (ví dụ: rx_power_dbm<-20, severity=Major, description~%SFP%).")
+
+
+def run_collect(args):
+    try:
+        devices = load_fleet(args.fleet, args.user, args.password, args.port)
+    except (OSError, ValueError) as e:
+        print(json.dumps({'success': False, 'error': f"Không đọc được danh sách router: {e}"}, ensure_ascii=False))
+        return 1
+    missing = [device['name'] for device in devices if not device['device_type'] or not device['username'] or not device['password']]
+    if missing:
+        print(json.dumps({'success': False, 'error': f"Thiếu device_type/user/password cho: {', '.join(missing)}"}, ensure_ascii=False))
+        return 1
+
+    optics = None
+    if args.optics_store:
+        # Import khi cần: numpy chỉ cần khi lưu time-series optics
+        from optics_store import OpticsStore
+        optics = OpticsStore(args.optics_store)
+
+    store = SnapshotStore(args.db)
+    try:
+        while True:
+            started = time.monotonic()
+            failed = 0
+            # Mỗi dòng một thiết bị (NDJSON), dòng cuối là tổng kết của lượt thu thập
+            for summary in collect_fleet(store, devices, args.category or SNAPSHOT_CATEGORIES, args.timeout, args.read_timeout, args.workers, args.keep, optics):
+                failed += not summary['success']
+                print(json.dumps(summary, ensure_ascii=False), flush=True)
+            elapsed = time.monotonic() - started
+            print(json.dumps({'done': True, 'devices': len(devices), 'failed': failed, 'elapsed': round(elapsed, 1)}, ensure_ascii=False), flush=True)
+            if not args.interval:
+                return 0 if failed == 0 else 1
+            time.sleep(max(0, args.interval - elapsed))
+    finally:
+        store.close()
+
+
+def run_query(args):
+    store = SnapshotStore(args.db)
+    try:
+        device = None
+        if args.device:
+            known = store.find_device(args.device)
+            device = known['name'] if known else args.device
+        results = list(store.latest(args.category, device, args.where))
+        stale = args.max_age is not None and (not results or any(result['age'] > args.max_age for result in results))
+
+        if device and (args.live or stale):
+            # Snapshot không có hoặc đã cũ: chạy trực tiếp trên thiết bị rồi cập nhật kho
+            known = store.find_device(device)
+            if not known or not args.user or not args.password:
+                print(json.dumps({'success': False, 'error': "Cần thiết bị đã có trong kho và --user/--password để chạy trực tiếp."}, ensure_ascii=False))
+                return 1
+            known.update(username=args.user, password=args.password)
+            for summary in collect_fleet(store, [known], [args.category], args.timeout, args.read_timeout, 1):
+                if not summary['success']:
+                    print(json.dumps({'success': False, 'source': 'live', 'error': summary['error'] or "Chạy lệnh trực tiếp thất bại."}, ensure_ascii=False))
+                    return 1
+            results = list(store.latest(args.category, device, args.where))
+            source = 'live'
+        else:
+            source = 'snapshot'
+
+        print(json.dumps({'success': True, 'source': source, 'results': results, 'error': None}, ensure_ascii=False, indent=2))
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    # Tham số chung, đặt được trước hoặc sau collect/query
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', type=str, default=DEFAULT_SNAPSHOT_DB, help=f'File SQLite chứa snapshot (mặc định: {DEFAULT_SNAPSHOT_DB}).')
+    common.add_argument('--user', type=str, default=None, help='Tên người dùng SSH (nếu file danh sách không có cột user).')
+    common.add_argument('--password', type=str, default=None, help='Mật khẩu SSH (nếu file danh sách không có cột password).')
+    common.add_argument('--port', type=int, default=22, help='Cổng SSH nếu file danh sách không có cột port (mặc định: 22).')
+    common.add_argument('--timeout', type=int, default=10, help='Thời gian chờ kết nối/xác thực SSH (giây).')
+    common.add_argument('--read-timeout', type=int, default=120, help='Thời gian chờ tối đa output của mỗi lệnh (giây).')
+
+    parser = argparse.ArgumentParser(description="Thu thập định kỳ inventory/optics/alarms của các router vào kho SQLite và tra cứu nhanh từ snapshot.")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    collect_parser = subparsers.add_parser('collect', parents=[common], help='Chạy các lệnh snapshot trên danh sách router và lưu kết quả.')
+    collect_parser.add_argument('--fleet', type=str, required=True, help='File CSV/JSON export bảng router (Router_name, IP, Vendor, ...).')
+    collect_parser.add_argument('--category', choices=SNAPSHOT_CATEGORIES, action='append', default=None, help='Loại dữ liệu cần thu thập (lặp lại được; mặc định: tất cả).')
+    collect_parser.add_argument('--workers', type=int, default=16, help='Số router chạy đồng thời tối đa (mặc định: 16).')
+    collect_parser.add_argument('--keep', type=int, default=DEFAULT_KEEP_SNAPSHOTS, help=f'Số snapshot giữ lại cho mỗi router và loại dữ liệu (mặc định: {DEFAULT_KEEP_SNAPSHOTS}).')
+    collect_parser.add_argument('--optics-store', type=str, default=None, help='Thư mục kho time-series optics (optics_store.py) để ghi thêm các lần đo Rx/Tx.')
+    collect_parser.add_argument('--interval', type=int, default=None, help='Lặp lại sau mỗi số giây này (mặc định: chạy một lượt rồi thoát, để n8n/cron lập lịch).')
+
+    query_parser = subparsers.add_parser('query', parents=[common], help='Tra cứu snapshot mới nhất.')
+    query_parser.add_argument('--category', choices=SNAPSHOT_CATEGORIES, required=True, help='Loại dữ liệu.')
+    query_parser.add_argument('--device', type=str, default=None, help='Tên router hoặc IP (mặc định: tất cả router).')
+    query_parser.add_argument('--where', type=parse_row_filter, default=None, help='Chỉ lấy bản ghi thỏa điều kiện, ví dụ: rx_power_dbm<-20, severity=Major, description~%%SFP%%.')
+    query_parser.add_argument('--max-age', type=int, default=None, help='Snapshot cũ hơn số giây này thì chạy trực tiếp trên thiết bị (cần --device, --user, --password).')
+    query_parser.add_argument('--live', action='store_true', help='Luôn chạy trực tiếp trên thiết bị và cập nhật snapshot (cần --device, --user, --password).')
+
+    args = parser.parse_args()
+    try:
+        sys.exit(run_collect(args) if args.action == 'collect' else run_query(args))
+    except sqlite3.Error as e:
+        print(json.dumps({'success': False, 'error': f"Lỗi kho snapshot: {e}"}, ensure_ascii=False))
+        sys.exit(1)
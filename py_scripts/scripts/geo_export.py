@@ -0,0 +1,309 @@
+import os
+import json
+import sqlite3
+import struct
+
+# Mã EPSG cho hệ tọa độ WGS84 (kinh độ, vĩ độ) dùng cho mọi định dạng xuất
+WGS84_SRS_ID = 4326
+WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+    'AUTHORITY["EPSG","4326"]]'
+)
+
+# Mã kiểu hình học theo chuẩn WKB
+WKB_GEOMETRY_TYPES = {'Point': 1, 'LineString': 2, 'MultiLineString': 5}
+GPKG_GEOMETRY_TYPES = {'Point': 'POINT', 'LineString': 'LINESTRING', 'MultiLineString': 'MULTILINESTRING'}
+
+# Số feature ghi vào GeoPackage trong một lần executemany
+GPKG_BATCH_SIZE = 1000
+
+
+def _iter_positions(geometry):
+    """Duyệt tất cả các cặp tọa độ (lon, lat) của một geometry dạng GeoJSON."""
+    if geometry['type'] == 'Point':
+        yield geometry['coordinates']
+    elif geometry['type'] == 'LineString':
+        yield from geometry['coordinates']
+    elif geometry['type'] == 'MultiLineString':
+        for line in geometry['coordinates']:
+            yield from line
+
+
+def geometry_to_wkb(geometry):
+    """Chuyển geometry dạng GeoJSON (Point, LineString, MultiLineString) sang WKB little-endian (2D)."""
+    geometry_type = geometry['type']
+    if geometry_type not in WKB_GEOMETRY_TYPES:
+        raise ValueError(f"Kiểu hình học '{geometry_type}' không được hỗ trợ.")
+
+    def line_wkb(coords):
+        parts = [struct.pack('<BII', 1, WKB_GEOMETRY_TYPES['LineString'], len(coords))]
+        parts.extend(struct.pack('<dd', float(c[0]), float(c[1])) for c in coords)
+        return b''.join(parts)
+
+    if geometry_type == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        return struct.pack('<BIdd', 1, WKB_GEOMETRY_TYPES['Point'], float(lon), float(lat))
+    if geometry_type == 'LineString':
+        return line_wkb(geometry['coordinates'])
+    lines = geometry['coordinates']
+    return struct.pack('<BII', 1, WKB_GEOMETRY_TYPES['MultiLineString'], len(lines)) + b''.join(line_wkb(line) for line in lines)
+
+
+def geometry_bounds(geometry):
+    """Trả về (min_lon, max_lon, min_lat, max_lat) của geometry."""
+    positions = list(_iter_positions(geometry))
+    lons = [float(p[0]) for p in positions]
+    lats = [float(p[1]) for p in positions]
+    return min(lons), max(lons), min(lats), max(lats)
+
+
+class GeoPackageWriter:
+    """
+    Ghi feature vào file GeoPackage (SQLite) chỉ dùng thư viện chuẩn.
+    Bảng dữ liệu được tạo khi có feature đầu tiên, cột mới được thêm khi xuất hiện thuộc tính mới.
+    """
+
+    def __init__(self, path, layer_name, geometry_type):
+        if os.path.exists(path):
+            os.remove(path) # GeoPackage luôn được tạo mới cho mỗi lần chạy
+        self.path = path
+        self.layer_name = layer_name
+        self.geometry_type = geometry_type
+        self.columns = []
+        self.pending_rows = []
+        self.bounds = None
+        self.layer_created = False
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA application_id = 1196444487") # 'GPKG'
+        self.conn.execute("PRAGMA user_version = 10300")
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self._create_metadata_tables()
+
+    def _create_metadata_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            CREATE TABLE gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+            CREATE TABLE gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+        """)
+        self.conn.executemany(
+            "INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+                ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+                ("WGS 84 geodetic", WGS84_SRS_ID, "EPSG", WGS84_SRS_ID, WGS84_WKT, None),
+            ]
+        )
+
+    def _create_layer(self, properties):
+        self.conn.execute(
+            f'CREATE TABLE "{self.layer_name}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom {GPKG_GEOMETRY_TYPES[self.geometry_type]})'
+        )
+        self.conn.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, ?)",
+            (self.layer_name, self.layer_name, WGS84_SRS_ID)
+        )
+        self.conn.execute(
+            "INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+            (self.layer_name, GPKG_GEOMETRY_TYPES[self.geometry_type], WGS84_SRS_ID)
+        )
+        self._add_columns(properties)
+
+    def _add_columns(self, properties):
+        for key, value in properties.items():
+            if key in self.columns:
+                continue
+            if isinstance(value, bool) or isinstance(value, int):
+                column_type = 'INTEGER'
+            elif isinstance(value, float):
+                column_type = 'REAL'
+            else:
+                column_type = 'TEXT'
+            self.conn.execute(f'ALTER TABLE "{self.layer_name}" ADD COLUMN "{key}" {column_type}')
+            self.columns.append(key)
+
+    def _geometry_blob(self, geometry, bounds):
+        # Header GeoPackage: magic 'GP', version 0, flags (envelope XY + little-endian), srs_id, envelope
+        header = struct.pack('<2sBBi4d', b'GP', 0, 0b00000011, WGS84_SRS_ID, *bounds)
+        return header + geometry_to_wkb(geometry)
+
+    def write(self, geometry, properties):
+        if not self.layer_created:
+            self._create_layer(properties)
+            self.layer_created = True
+        elif any(key not in self.columns for key in properties):
+            self._flush()
+            self._add_columns(properties)
+
+        bounds = geometry_bounds(geometry)
+        if self.bounds is None:
+            self.bounds = list(bounds)
+        else:
+            self.bounds = [min(self.bounds[0], bounds[0]), max(self.bounds[1], bounds[1]),
+                           min(self.bounds[2], bounds[2]), max(self.bounds[3], bounds[3])]
+
+        self.pending_rows.append((self._geometry_blob(geometry, bounds), properties))
+        if len(self.pending_rows) >= GPKG_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending_rows:
+            return
+        column_names = ''.join(f', "{column}"' for column in self.columns)
+        placeholders = ', '.join('?' for _ in range(len(self.columns) + 1))
+        self.conn.executemany(
+            f'INSERT INTO "{self.layer_name}" (geom{column_names}) VALUES ({placeholders})',
+            ([blob] + [properties.get(column) for column in self.columns] for blob, properties in self.pending_rows)
+        )
+        self.pending_rows = []
+
+    def close(self):
+        self._flush()
+        if self.bounds:
+            self.conn.execute(
+                "UPDATE gpkg_contents SET min_x = ?, max_x = ?, min_y = ?, max_y = ? WHERE table_name = ?",
+                (*self.bounds, self.layer_name)
+            )
+        self.conn.commit()
+        self.conn.close()
+
+
+class FlatGeobufWriter:
+    """
+    Ghi feature vào file FlatGeobuf thông qua thư viện fiona (GDAL).
+    Schema được suy ra từ feature đầu tiên; các thuộc tính xuất hiện sau đó không có trong schema sẽ bị bỏ qua.
+    """
+
+    def __init__(self, path, layer_name, geometry_type):
+        try:
+            import fiona
+        except ImportError:
+            raise ImportError("Xuất FlatGeobuf cần thư viện 'fiona' (pip install fiona).")
+        self.fiona = fiona
+        self.path = path
+        self.layer_name = layer_name
+        self.geometry_type = geometry_type
+        self.sink = None
+        self.columns = []
+
+    def write(self, geometry, properties):
+        if self.sink is None:
+            schema_properties = {}
+            for key, value in properties.items():
+                if isinstance(value, bool) or isinstance(value, int):
+                    schema_properties[key] = 'int'
+                elif isinstance(value, float):
+                    schema_properties[key] = 'float'
+                else:
+                    schema_properties[key] = 'str'
+            self.columns = list(schema_properties)
+            self.sink = self.fiona.open(
+                self.path, 'w', driver='FlatGeobuf', layer=self.layer_name, crs='EPSG:4326',
+                schema={'geometry': self.geometry_type, 'properties': schema_properties}
+            )
+        self.sink.write({
+            'geometry': geometry,
+            'properties': {column: properties.get(column) for column in self.columns}
+        })
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+
+class GeoJSONSeqWriter:
+    """Ghi feature ra GeoJSON dạng dòng (newline-delimited), mỗi dòng một Feature."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, geometry, properties):
+        feature = {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+        self.file.write(json.dumps(feature, ensure_ascii=False))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class GeoExporter:
+    """
+    Xuất cùng một luồng feature ra nhiều định dạng (GeoJSON dòng, GeoPackage, FlatGeobuf) trong một lần duyệt.
+    Các cấp thư mục KML (FolderName, SecondFolderName, ThirdFolderName) được ghi thành thuộc tính.
+
+    Ví dụ:
+        with GeoExporter(geojson_path='sites.geojsonl', gpkg_path='sites.gpkg', geometry_type='Point') as exporter:
+            exporter.write({'type': 'Point', 'coordinates': [lon, lat]}, {'SiteName': 'A', 'FolderName': 'HCM'})
+    """
+
+    def __init__(self, geojson_path=None, gpkg_path=None, fgb_path=None, layer_name='features', geometry_type='Point'):
+        self.writers = []
+        self.paths = {}
+        self.feature_count = 0
+        try:
+            for key, path in (('geojson', geojson_path), ('gpkg', gpkg_path), ('fgb', fgb_path)):
+                if not path:
+                    continue
+                output_dir = os.path.dirname(path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                if key == 'geojson':
+                    self.writers.append(GeoJSONSeqWriter(path))
+                elif key == 'gpkg':
+                    self.writers.append(GeoPackageWriter(path, layer_name, geometry_type))
+                else:
+                    self.writers.append(FlatGeobufWriter(path, layer_name, geometry_type))
+                self.paths[key] = path
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def enabled(self):
+        return bool(self.writers)
+
+    def write(self, geometry, properties):
+        """Ghi một feature (geometry dạng GeoJSON, properties là dictionary) ra tất cả định dạng đã chọn."""
+        for writer in self.writers:
+            writer.write(geometry, properties)
+        self.feature_count += 1
+
+    def close(self):
+        """Đóng tất cả file đầu ra và trả về dictionary {định dạng: đường dẫn}."""
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def folder_properties(data_item):
+    """Chuyển các cấp thư mục KML của một hàng thành thuộc tính (ô trống/NaN thành chuỗi rỗng)."""
+    properties = {}
+    for key in ('FolderName', 'SecondFolderName', 'ThirdFolderName'):
+        value = data_item.get(key)
+        properties[key] = '' if value is None or value != value else str(value).strip()
+    return properties
+
+
+def add_export_arguments(parser):
+    """Thêm các tham số dòng lệnh cho xuất GeoJSON/GeoPackage/FlatGeobuf vào argparse parser."""
+    parser.add_argument('--output-geojson', type=str, default=None, help='Đường dẫn file GeoJSON dạng dòng (.geojsonl) đầu ra (tùy chọn).')
+    parser.add_argument('--output-gpkg', type=str, default=None, help='Đường dẫn file GeoPackage (.gpkg) đầu ra (tùy chọn).')
+    parser.add_argument('--output-fgb', type=str, default=None, help='Đường dẫn file FlatGeobuf (.fgb) đầu ra (tùy chọn, cần thư viện fiona).')
@@ -0,0 +1,105 @@
+import json
+
+try:
+    import ijson # Parser JSON tăng dần, không cần nạp toàn bộ file vào bộ nhớ
+except ImportError:
+    ijson = None
+
+# Số hàng trong mỗi lô khi đọc dữ liệu dạng luồng
+DEFAULT_BATCH_SIZE = 5000
+
+INVALID_STRUCTURE_MESSAGE = "Cấu trúc JSON không hợp lệ. Mong đợi một mảng hoặc một đối tượng có key 'rawData'."
+
+
+class InputFormatError(ValueError):
+    """Lỗi cú pháp hoặc cấu trúc của file JSON đầu vào (phát sinh trong lúc đọc dạng luồng)."""
+
+
+def _iter_rows_ijson(file):
+    """
+    Đọc các hàng từ file JSON (mở ở chế độ nhị phân) bằng ijson, chỉ giữ một hàng trong bộ nhớ tại một thời điểm.
+    Hỗ trợ 2 cấu trúc giống các script tạo KML:
+        - [{"rawData": [hàng, hàng, ...], ...}]  -> trả về các hàng trong rawData của phần tử đầu tiên
+        - [hàng, hàng, ...]                       -> trả về từng phần tử của mảng
+    """
+    events = ijson.parse(file, use_float=True)
+    first_event = next(events, None)
+    if first_event is None or first_event[1] != 'start_array':
+        raise InputFormatError(INVALID_STRUCTURE_MESSAGE)
+
+    mode = None # None: chưa biết cấu trúc, 'rawData' hoặc 'list'
+    builder = None
+    depth = 0
+
+    for prefix, event, value in events:
+        if mode == 'rawData':
+            if builder is None:
+                if prefix == 'item.rawData' and event == 'end_array':
+                    return # Chỉ dùng rawData của phần tử đầu tiên, phần còn lại của file được bỏ qua
+                if prefix != 'item.rawData.item':
+                    continue
+                builder = ijson.ObjectBuilder()
+        else:
+            if builder is None:
+                if prefix == '' and event == 'end_array':
+                    return
+                builder = ijson.ObjectBuilder()
+            if mode is None and depth == 1 and prefix == 'item' and event == 'map_key' and value == 'rawData':
+                # Phần tử đầu tiên là đối tượng bao rawData: chuyển sang đọc từng hàng bên trong
+                mode = 'rawData'
+                builder = None
+                depth = 0
+                continue
+
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            yield builder.value
+            builder = None
+            if mode is None:
+                mode = 'list'
+
+
+def iter_input_rows(path):
+    """
+    Trả về (generator) các hàng dữ liệu của file JSON đầu vào theo dạng luồng.
+    Dùng ijson nếu đã cài đặt; nếu không, đọc toàn bộ file bằng json.load như trước.
+
+    Raises:
+        FileNotFoundError: Nếu file không tồn tại.
+        InputFormatError: Nếu file không phải JSON hợp lệ hoặc sai cấu trúc (có thể phát sinh giữa chừng khi đang đọc).
+    """
+    if ijson is None:
+        with open(path, 'r', encoding='utf-8') as file:
+            try:
+                loaded_data = json.load(file)
+            except json.JSONDecodeError as e:
+                raise InputFormatError(str(e))
+        if isinstance(loaded_data, list) and len(loaded_data) > 0 and isinstance(loaded_data[0], dict) and "rawData" in loaded_data[0]:
+            yield from loaded_data[0]["rawData"]
+        elif isinstance(loaded_data, list):
+            yield from loaded_data
+        else:
+            raise InputFormatError(INVALID_STRUCTURE_MESSAGE)
+        return
+
+    with open(path, 'rb') as file:
+        try:
+            yield from _iter_rows_ijson(file)
+        except ijson.JSONError as e:
+            raise InputFormatError(str(e))
+
+
+def iter_row_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Gom các hàng đọc dạng luồng thành từng lô (list) để kiểm tra dữ liệu theo cột."""
+    batch = []
+    for row in iter_input_rows(path):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
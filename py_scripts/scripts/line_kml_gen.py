@@ -2,6 +2,10 @@ import sys
 import json
 import os
 import argparse
+import math
+from geo_export import GeoExporter, add_export_arguments, folder_properties
+from row_validation import LINE_COLUMNS, validate_batches, new_report, format_report
+from json_stream import iter_row_batches, InputFormatError
 
 # Hàm tạo một placemark cho một đoạn thẳng
 def create_single_line_placemark(coord1, coord2, line_name, description, line_color, line_width):
@@ -37,82 +41,158 @@ def create_single_line_placemark(coord1, coord2, line_name, description, line_co
 
     return style_kml, placemark_kml
 
+# Hàm tính khoảng cách đường chim bay (km) giữa hai tọa độ (kinh độ, vĩ độ) theo công thức Haversine
+def haversine_km(coord1, coord2):
+    lon1, lat1, lon2, lat2 = map(math.radians, (coord1[0], coord1[1], coord2[0], coord2[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0088 * 2 * math.asin(math.sqrt(a))
+
+# Hàm tạo một placemark MultiGeometry gộp tất cả các đoạn của một ring
+def create_ring_placemark(ring_name, segments, line_color, line_width):
+    """
+    Args:
+        ring_name (str): Tên placemark của ring.
+        segments (list): Danh sách tuple (coord1, coord2, line_name, distance_km) theo thứ tự trong dữ liệu.
+        line_color (str): Màu KML (AABBGGRR) dùng chung cho ring.
+        line_width (int): Độ rộng đường dùng chung cho ring.
+    Returns:
+        tuple: (style_kml, placemark_kml)
+    """
+    style_id = f"ringStyle_{ring_name.replace(' ', '_').replace('.', '')}_{line_color}_{line_width}"
+    style_kml = f"""
+    <Style id="{style_id}">
+      <LineStyle>
+        <color>{line_color}</color>
+        <width>{line_width}</width>
+      </LineStyle>
+    </Style>"""
+
+    total_distance_km = sum(segment[3] for segment in segments)
+    description_rows = "".join(
+        f"<tr><td>{i+1}</td><td>{line_name}</td><td>{distance_km:.2f}</td></tr>"
+        for i, (_, _, line_name, distance_km) in enumerate(segments)
+    )
+    description_kml = (
+        f"<description><![CDATA[<table><tr><th>#</th><th>Đoạn</th><th>Khoảng cách (km)</th></tr>{description_rows}</table>"
+        f"Tổng khoảng cách: {total_distance_km:.2f} km]]></description>"
+    )
+
+    extended_data = [
+        f'<Data name="SegmentCount"><value>{len(segments)}</value></Data>',
+        f'<Data name="TotalDistanceKm"><value>{total_distance_km:.3f}</value></Data>'
+    ]
+    line_strings = []
+    for i, (coord1, coord2, line_name, distance_km) in enumerate(segments):
+        extended_data.append(f'<Data name="Segment{i+1}"><value>{line_name} ({distance_km:.2f} km)</value></Data>')
+        line_strings.append(f"""
+        <LineString>
+          <coordinates>
+            {coord1[0]},{coord1[1]},0
+            {coord2[0]},{coord2[1]},0
+          </coordinates>
+        </LineString>""")
+
+    placemark_kml = f"""
+    <Placemark>
+      <name>{ring_name}</name>
+      {description_kml}
+      <styleUrl>#{style_id}</styleUrl>
+      <ExtendedData>
+        {"".join(extended_data)}
+      </ExtendedData>
+      <MultiGeometry>{"".join(line_strings)}
+      </MultiGeometry>
+    </Placemark>"""
+
+    return style_kml, placemark_kml
+
 # Hàm chính để tạo nội dung KML từ danh sách dữ liệu
-def generate_kml_from_lines(items_to_process, doc_name="Dữ liệu tuyến KML"):
+def generate_kml_from_lines(items_to_process, doc_name="Dữ liệu tuyến KML", exporter=None, merge_rings=False):
     """
     Tạo nội dung KML từ một danh sách các đối tượng tuyến.
     Args:
-        items_to_process (list): Danh sách các dictionary chứa thông tin tuyến.
+        items_to_process (list): Danh sách các dictionary chứa thông tin tuyến đã qua validate_table (LINE_COLUMNS).
         doc_name (str): Tên của Document trong KML.
+        exporter (GeoExporter, optional): Đối tượng xuất GeoJSON/GeoPackage/FlatGeobuf, ghi cùng lúc với KML.
+        merge_rings (bool): Gộp các đoạn cùng thư mục, màu và độ rộng thành một placemark MultiGeometry cho mỗi ring.
     Returns:
         str: Chuỗi nội dung KML hoặc None nếu không có dữ liệu hợp lệ.
     """
     all_styles = []
     # Cấu trúc cây để hỗ trợ nhiều cấp thư mục, tương tự site_kml_tmp.py
     grouped_placemarks = {'placemarks': [], 'subfolders': {}}
+    # Khi gộp ring: key là (thư mục, màu, độ rộng), value chứa node thư mục đích và danh sách đoạn
+    rings = {}
     has_valid_data = False
 
-    for i, item in enumerate(items_to_process):
-        data_item = item.get('json', item) # Tương thích với cấu trúc n8n
+    for data_item in items_to_process:
+        # Dữ liệu đã được kiểm tra và ép kiểu theo cột bởi row_validation
+        lon1 = data_item["Longitude1"]
+        lat1 = data_item["Latitude1"]
+        lon2 = data_item["Longitude2"]
+        lat2 = data_item["Latitude2"]
+        line_name = data_item["LineName"]
+        folder_name = data_item["FolderName"]
+        second_folder_name = data_item["SecondFolderName"]
+        third_folder_name = data_item["ThirdFolderName"] # Thêm thư mục cấp 3
+        description = data_item["Description"]
+        line_color = data_item["Color"]
+        line_width = data_item["Width"]
 
-        try:
-            required_keys = ["Longitude1", "Latitude1", "Longitude2", "Latitude2", "LineName", "Color", "Width"]
-            if not all(key in data_item for key in required_keys):
-                sys.stderr.write(f"Cảnh báo: Thiếu khóa bắt buộc trong hàng {i+1}. Bỏ qua. Dữ liệu: {json.dumps(data_item)}\n")
-                continue
-
-            lon1 = float(data_item["Longitude1"])
-            lat1 = float(data_item["Latitude1"])
-            lon2 = float(data_item["Longitude2"])
-            lat2 = float(data_item["Latitude2"])
-            line_name = str(data_item["LineName"])
-            folder_name = str(data_item.get("FolderName", "")).strip()
-            second_folder_name = str(data_item.get("SecondFolderName", "")).strip()
-            third_folder_name = str(data_item.get("ThirdFolderName", "")).strip() # Thêm thư mục cấp 3
-            description = str(data_item.get("Description", "")).strip()
-            line_color = str(data_item["Color"])
-            line_width = int(data_item["Width"])
-
-            coord1 = (lon1, lat1)
-            coord2 = (lon2, lat2)
-            
+        coord1 = (lon1, lat1)
+        coord2 = (lon2, lat2)
+        
+        if not merge_rings:
             style_kml, placemark_kml = create_single_line_placemark(
                 coord1, coord2, line_name, description, line_color, line_width
             )
-            
             all_styles.append(style_kml)
-            
-            # Logic nhóm cho 3 cấp thư mục (tái sử dụng từ site_kml_tmp.py)
-            current_level_node = grouped_placemarks
-
-            if folder_name:
-                if folder_name not in current_level_node['subfolders']:
-                    current_level_node['subfolders'][folder_name] = {'placemarks': [], 'subfolders': {}}
-                current_level_node = current_level_node['subfolders'][folder_name]
-
-                if second_folder_name:
-                    if second_folder_name not in current_level_node['subfolders']:
-                        current_level_node['subfolders'][second_folder_name] = {'placemarks': [], 'subfolders': {}}
-                    current_level_node = current_level_node['subfolders'][second_folder_name]
-
-                    if third_folder_name:
-                        if third_folder_name not in current_level_node['subfolders']:
-                            current_level_node['subfolders'][third_folder_name] = {'placemarks': [], 'subfolders': {}}
-                        current_level_node = current_level_node['subfolders'][third_folder_name]
-            
+        
+        # Logic nhóm cho 3 cấp thư mục (tái sử dụng từ site_kml_tmp.py)
+        current_level_node = grouped_placemarks
+
+        if folder_name:
+            if folder_name not in current_level_node['subfolders']:
+                current_level_node['subfolders'][folder_name] = {'placemarks': [], 'subfolders': {}}
+            current_level_node = current_level_node['subfolders'][folder_name]
+
+            if second_folder_name:
+                if second_folder_name not in current_level_node['subfolders']:
+                    current_level_node['subfolders'][second_folder_name] = {'placemarks': [], 'subfolders': {}}
+                current_level_node = current_level_node['subfolders'][second_folder_name]
+
+                if third_folder_name:
+                    if third_folder_name not in current_level_node['subfolders']:
+                        current_level_node['subfolders'][third_folder_name] = {'placemarks': [], 'subfolders': {}}
+                    current_level_node = current_level_node['subfolders'][third_folder_name]
+        
+        if merge_rings:
+            ring_key = (folder_name, second_folder_name, third_folder_name, line_color, line_width)
+            if ring_key not in rings:
+                rings[ring_key] = {'node': current_level_node, 'segments': []}
+            rings[ring_key]['segments'].append((coord1, coord2, line_name, haversine_km(coord1, coord2)))
+        else:
             current_level_node['placemarks'].append(placemark_kml)
-            
-            has_valid_data = True
 
-        except ValueError as e:
-            sys.stderr.write(f"Cảnh báo: Lỗi chuyển đổi dữ liệu số (hàng {i+1}). Chi tiết: {e}. Dữ liệu: {json.dumps(data_item)}\n")
-        except Exception as e:
-            sys.stderr.write(f"Cảnh báo: Lỗi không xác định khi xử lý hàng {i+1}: {e}. Dữ liệu: {json.dumps(data_item)}\n")
+        if exporter and exporter.enabled:
+            exporter.write(
+                {'type': 'LineString', 'coordinates': [list(coord1), list(coord2)]},
+                {'LineName': line_name, 'Description': description, 'Color': line_color, 'Width': line_width, **folder_properties(data_item)}
+            )
+        
+        has_valid_data = True
 
     if not has_valid_data:
         sys.stderr.write("Lỗi: Không có dữ liệu hợp lệ để tạo KML.\n")
         return None
 
+    for (folder_name, second_folder_name, third_folder_name, line_color, line_width), ring in rings.items():
+        # Tên ring là tên thư mục sâu nhất, hoặc tên đoạn đầu tiên nếu tuyến nằm ở gốc
+        ring_name = third_folder_name or second_folder_name or folder_name or ring['segments'][0][2]
+        style_kml, placemark_kml = create_ring_placemark(ring_name, ring['segments'], line_color, line_width)
+        all_styles.append(style_kml)
+        ring['node']['placemarks'].append(placemark_kml)
+
     unique_styles = sorted(list(set(all_styles)))
     styles_combined = "".join(unique_styles)
 
@@ -168,23 +248,39 @@ if __name__ == "__main__":
         required=True,
         help='Đường dẫn đầy đủ để lưu file KML đầu ra.'
     )
+    parser.add_argument(
+        '--merge-rings',
+        action='store_true',
+        help='Gộp các đoạn của cùng một ring (cùng thư mục, màu và độ rộng) thành một placemark MultiGeometry.'
+    )
+    add_export_arguments(parser)
     args = parser.parse_args()
 
-    items_to_process = []
-    try:
-        with open(args.input_file, 'r', encoding='utf-8') as file:
-            loaded_data = json.load(file)
-            if isinstance(loaded_data, list) and len(loaded_data) > 0 and "rawData" in loaded_data[0]:
-                items_to_process = loaded_data[0]["rawData"]
-            elif isinstance(loaded_data, list):
-                items_to_process = loaded_data
-            else:
-                raise ValueError("Cấu trúc JSON không hợp lệ. Mong đợi một mảng hoặc một đối tượng có key 'rawData'.")
-    except FileNotFoundError:
+    if not os.path.isfile(args.input_file):
         result = {"status": "error", "message": f"Lỗi: File đầu vào '{args.input_file}' không tồn tại."}
         print(json.dumps(result))
         sys.exit(1)
-    except json.JSONDecodeError as e:
+
+    try:
+        exporter = GeoExporter(
+            geojson_path=args.output_geojson, gpkg_path=args.output_gpkg, fgb_path=args.output_fgb,
+            layer_name="lines", geometry_type="LineString"
+        )
+    except Exception as e:
+        result = {"status": "error", "message": f"Lỗi khi mở file xuất GeoJSON/GeoPackage/FlatGeobuf: {e}"}
+        print(json.dumps(result))
+        sys.exit(1)
+
+    # Đọc file JSON dạng luồng theo từng lô, kiểm tra/chuẩn hóa từng lô theo cột và tạo KML ngay khi có dữ liệu
+    report = new_report()
+    clean_records = (record for _, _, record in validate_batches(
+        iter_row_batches(args.input_file), LINE_COLUMNS, report
+    ))
+
+    try:
+        with exporter:
+            kml_content = generate_kml_from_lines(clean_records, exporter=exporter, merge_rings=args.merge_rings)
+    except InputFormatError as e:
         result = {"status": "error", "message": f"Lỗi parse JSON trong file '{args.input_file}': {e}"}
         print(json.dumps(result))
         sys.exit(1)
@@ -193,13 +289,14 @@ if __name__ == "__main__":
         print(json.dumps(result))
         sys.exit(1)
 
-    if not items_to_process:
+    if report['invalid_rows'] or report['defaults_applied']:
+        sys.stderr.write(f"Cảnh báo: {format_report(report)}\n")
+
+    if report['total_rows'] == 0:
         result = {"status": "error", "message": "Không có dữ liệu hợp lệ trong file JSON đầu vào để tạo KML."}
         print(json.dumps(result))
         sys.exit(1)
 
-    kml_content = generate_kml_from_lines(items_to_process)
-
     if kml_content:
         try:
             output_dir = os.path.dirname(args.output_file)
@@ -207,7 +304,9 @@ if __name__ == "__main__":
                 os.makedirs(output_dir, exist_ok=True)
             with open(args.output_file, 'w', encoding='utf-8') as f:
                 f.write(kml_content)
-            result = {"status": "success", "kml_file_path": args.output_file, "message": f"Tạo file KML thành công từ {len(items_to_process)} đối tượng."}
+            result = {"status": "success", "kml_file_path": args.output_file, "message": f"Tạo file KML thành công từ {report['valid_rows']}/{report['total_rows']} đối tượng."}
+            if exporter.paths:
+                result["export_files"] = exporter.paths
             print(json.dumps(result))
         except IOError as e:
             result = {"status": "error", "message": f"Không thể ghi vào file KML '{args.output_file}': {e}"}
@@ -0,0 +1,394 @@
+import os
+import re
+import sys
+import json
+import mmap
+import heapq
+import bisect
+import hashlib
+import argparse
+import calendar
+from array import array
+from datetime import datetime, timedelta
+
+INDEX_SUFFIX = '.lidx'
+# Tăng khi thay đổi định dạng file index để các index cũ được tạo lại
+INDEX_VERSION = 1
+# Các file cạnh file log (index, file tải dở, trạng thái tải) không được đưa vào tìm kiếm
+SKIPPED_SUFFIXES = (INDEX_SUFFIX, '.part', '.state.json', '.tmp')
+FINGERPRINT_SIZE = 1024
+READ_BLOCK_SIZE = 1 << 20
+# Mức độ của dòng không nhận ra severity (luôn bị loại khi lọc theo --severity)
+SEVERITY_UNKNOWN = 8
+
+SEVERITY_NAMES = {
+    'emergency': 0, 'emerg': 0, 'alert': 1, 'critical': 2, 'crit': 2, 'error': 3, 'err': 3,
+    'warning': 4, 'warn': 4, 'notice': 5, 'informational': 6, 'info': 6, 'debug': 7,
+}
+MONTHS = {name.encode(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+# Timestamp ở đầu dòng: ISO (2024-05-01T10:00:00) hoặc kiểu syslog (May  1 10:00:00 / May 1 2024 10:00:00.123)
+TIMESTAMP = re.compile(rb'(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}|[A-Z][a-z]{2}\s+\d{1,2}\s+(?:\d{4}\s+)?\d{2}:\d{2}):(\d{2})')
+ISO_MINUTE = re.compile(rb'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})')
+SYSLOG_MINUTE = re.compile(rb'([A-Z][a-z]{2})\s+(\d{1,2})\s+(?:(\d{4})\s+)?(\d{2}):(\d{2})')
+TIMESTAMP_SEARCH_WIDTH = 64
+# Severity: mã Cisco %FACILITY-N-MNEMONIC, PRI syslog <N> ở đầu dòng, hoặc mức cảnh báo kiểu Nokia SR OS
+CISCO_SEVERITY = re.compile(rb'%[A-Z0-9_]+(?:-[A-Z0-9_]+)*-([0-7])-[A-Z0-9_]+')
+SYSLOG_PRI = re.compile(rb'^<(\d{1,3})>')
+SROS_SEVERITY = re.compile(rb'\b(CRITICAL|MAJOR|MINOR|WARNING|INDETERMINATE|CLEARED|INFO)\b')
+SROS_SEVERITY_LEVELS = {b'CRITICAL': 2, b'MAJOR': 3, b'MINOR': 4, b'WARNING': 4, b'INDETERMINATE': 5, b'CLEARED': 6, b'INFO': 6}
+
+
+class LineParser:
+    """Tách timestamp (giây, giờ địa phương của thiết bị, không đổi múi giờ) và severity của từng dòng log."""
+
+    def __init__(self, reference_time):
+        # Log kiểu syslog không có năm: lấy theo thời điểm sửa file, lùi một năm nếu ngày rơi vào tương lai
+        self.reference = reference_time
+        # Phần timestamp tới phút -> giây: nhiều dòng liên tiếp trong cùng một phút
+        self.minutes = {}
+
+    def _parse_minute(self, text):
+        match = ISO_MINUTE.match(text)
+        if match:
+            year, month, day, hour, minute = map(int, match.groups())
+        else:
+            match = SYSLOG_MINUTE.match(text)
+            month = MONTHS.get(match.group(1))
+            if month is None:
+                return None
+            day, hour, minute = int(match.group(2)), int(match.group(4)), int(match.group(5))
+            if match.group(3):
+                year = int(match.group(3))
+            else:
+                year = self.reference.year
+                if (month, day) > (self.reference.month, self.reference.day + 1):
+                    year -= 1
+        try:
+            return calendar.timegm((year, month, day, hour, minute, 0))
+        except ValueError:
+            return None
+
+    def timestamp(self, line):
+        match = TIMESTAMP.search(line, 0, TIMESTAMP_SEARCH_WIDTH)
+        if not match:
+            return None
+        minute_text, seconds = match.groups()
+        base = self.minutes.get(minute_text, -1)
+        if base == -1:
+            if len(self.minutes) > 100000:
+                self.minutes.clear()
+            base = self.minutes[minute_text] = self._parse_minute(minute_text)
+        return None if base is None else base + int(seconds)
+
+    @staticmethod
+    def severity(line):
+        match = CISCO_SEVERITY.search(line)
+        if match:
+            return int(match.group(1))
+        match = SYSLOG_PRI.match(line)
+        if match:
+            return int(match.group(1)) % 8
+        match = SROS_SEVERITY.search(line)
+        if match:
+            return SROS_SEVERITY_LEVELS[match.group(1)]
+        return None
+
+
+class LogIndex:
+    """
+    Index của một file log đã tải về, lưu cạnh file log ('<file>.lidx'): vị trí byte, timestamp và severity của từng dòng.
+    - Index được tạo ở lần đọc đầu tiên; file log chỉ được ghi thêm (get_log_file tải tiếp) thì chỉ index phần mới.
+    - File log và index được mmap, truy vấn không đọc toàn bộ file vào bộ nhớ.
+    Dòng không có timestamp/severity (dòng tiếp nối) dùng lại giá trị của dòng trước.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self._log_file = self._log_map = self._index_map = None
+        self.header = None
+        self.offsets = self.timestamps = self.severities = None
+
+    # ----- tạo / cập nhật index -----
+
+    def _fingerprint(self):
+        with open(self.path, 'rb') as file:
+            return hashlib.md5(file.read(FINGERPRINT_SIZE)).hexdigest()
+
+    def _read_header(self):
+        try:
+            with open(self.index_path, 'rb') as file:
+                return json.loads(file.readline())
+        except (OSError, ValueError):
+            return None
+
+    def _scan(self, start, reference_time, offsets, timestamps, severities, last_timestamp, last_severity):
+        """Index các dòng hoàn chỉnh từ vị trí start; trả về (số byte đã index, timestamp, severity của dòng cuối)."""
+        parser = LineParser(reference_time)
+        position = start
+        pending = b''
+        with open(self.path, 'rb') as file:
+            file.seek(start)
+            for block in iter(lambda: file.read(READ_BLOCK_SIZE), b''):
+                lines = (pending + block).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    timestamp = parser.timestamp(line)
+                    if timestamp is not None:
+                        last_timestamp = timestamp
+                        last_severity = parser.severity(line)
+                        if last_severity is None:
+                            last_severity = SEVERITY_UNKNOWN
+                    offsets.append(position)
+                    timestamps.append(last_timestamp)
+                    severities.append(last_severity)
+                    position += len(line) + 1
+        # Dòng cuối chưa kết thúc (file đang được ghi) sẽ được index ở lần sau
+        return position, last_timestamp, last_severity
+
+    def build(self, force=False):
+        """Tạo hoặc cập nhật index nếu file log đã thay đổi. Returns: True nếu index được ghi lại."""
+        stat = os.stat(self.path)
+        fingerprint = self._fingerprint()
+        header = None if force else self._read_header()
+        if (header and header['version'] == INDEX_VERSION and header['fingerprint'] == fingerprint
+                and header['source_size'] == stat.st_size and header['source_mtime_ns'] == stat.st_mtime_ns):
+            return False
+
+        offsets, timestamps, severities = array('Q'), array('q'), array('B')
+        start, last_timestamp, last_severity = 0, 0, SEVERITY_UNKNOWN
+        appended = (header and header['version'] == INDEX_VERSION and header['fingerprint'] == fingerprint
+                    and header['indexed_bytes'] <= stat.st_size)
+        if appended and header['lines']:
+            # File chỉ được ghi thêm: giữ index cũ, chỉ đọc phần mới
+            self.open()
+            offsets.frombytes(self.offsets.tobytes())
+            timestamps.frombytes(self.timestamps.tobytes())
+            severities.frombytes(self.severities.tobytes())
+            self.close()
+        if appended:
+            start = header['indexed_bytes']
+            if timestamps:
+                last_timestamp, last_severity = timestamps[-1], severities[-1]
+
+        reference_time = datetime.fromtimestamp(stat.st_mtime)
+        indexed_bytes, _, _ = self._scan(start, reference_time, offsets, timestamps, severities, last_timestamp, last_severity)
+        is_sorted = all(timestamps[i] <= timestamps[i + 1] for i in range(len(timestamps) - 1))
+
+        header = {
+            'version': INDEX_VERSION, 'fingerprint': fingerprint, 'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns, 'indexed_bytes': indexed_bytes, 'lines': len(offsets), 'sorted': is_sorted,
+        }
+        header_bytes = json.dumps(header).encode() + b'\n'
+        # Đệm để các mảng số nằm ở vị trí chia hết cho 8
+        header_bytes += b' ' * (-len(header_bytes) % 8)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(header_bytes)
+            offsets.tofile(file)
+            timestamps.tofile(file)
+            severities.tofile(file)
+        os.replace(tmp_path, self.index_path)
+        return True
+
+    # ----- đọc index -----
+
+    def open(self):
+        """mmap file index và file log (không sao chép dữ liệu vào bộ nhớ)."""
+        with open(self.index_path, 'rb') as file:
+            self.header = json.loads(file.readline())
+            data_start = file.tell()
+            data_start += -data_start % 8
+            self._index_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.header['lines'] else None
+        count = self.header['lines']
+        if self._index_map is None:
+            self.offsets = self.timestamps = self.severities = []
+        else:
+            view = memoryview(self._index_map)
+            self.offsets = view[data_start:data_start + 8 * count].cast('Q')
+            self.timestamps = view[data_start + 8 * count:data_start + 16 * count].cast('q')
+            self.severities = view[data_start + 16 * count:data_start + 17 * count].cast('B')
+
+        self._log_file = open(self.path, 'rb')
+        size = os.fstat(self._log_file.fileno()).st_size
+        self._log_map = mmap.mmap(self._log_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        return self
+
+    def close(self):
+        for view in (self.offsets, self.timestamps, self.severities):
+            if isinstance(view, memoryview):
+                view.release()
+        self.offsets = self.timestamps = self.severities = None
+        for handle in (self._index_map, self._log_map if isinstance(self._log_map, mmap.mmap) else None, self._log_file):
+            if handle is not None:
+                handle.close()
+        self._index_map = self._log_map = self._log_file = None
+
+    def __enter__(self):
+        self.build()
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _line_end(self, line_number):
+        if line_number + 1 < len(self.offsets):
+            return self.offsets[line_number + 1] - 1
+        return self.header['indexed_bytes'] - 1
+
+    def line_text(self, line_number):
+        return self._log_map[self.offsets[line_number]:self._line_end(line_number)].decode('utf-8', errors='replace').rstrip('\r')
+
+    def _time_range(self, since, until):
+        """Khoảng số dòng [first, last) có thể nằm trong khoảng thời gian (tìm nhị phân nếu timestamp tăng dần)."""
+        count = len(self.offsets)
+        if not self.header['sorted'] or (since is None and until is None):
+            return 0, count
+        first = bisect.bisect_left(self.timestamps, since) if since is not None else 0
+        last = bisect.bisect_right(self.timestamps, until) if until is not None else count
+        return first, last
+
+    def query(self, since=None, until=None, max_severity=None, pattern=None):
+        """
+        Yield số thứ tự (từ 0) các dòng khớp mọi điều kiện, theo thứ tự trong file.
+
+        Args:
+            since, until (int, optional): Khoảng thời gian (giây, giống timestamp trong index), tính cả hai đầu.
+            max_severity (int, optional): Chỉ lấy dòng có severity <= giá trị này (0 = emergency ... 7 = debug).
+            pattern (re.Pattern, optional): Regex trên bytes, chạy trực tiếp trên vùng mmap.
+        """
+        first, last = self._time_range(since, until)
+        if first >= last:
+            return
+
+        def accepted(line_number):
+            timestamp = self.timestamps[line_number]
+            if since is not None and timestamp < since:
+                return False
+            if until is not None and timestamp > until:
+                return False
+            return max_severity is None or self.severities[line_number] <= max_severity
+
+        if pattern is None:
+            for line_number in range(first, last):
+                if accepted(line_number):
+                    yield line_number
+            return
+
+        position, end = self.offsets[first], self._line_end(last - 1) + 1
+        while position < end:
+            match = pattern.search(self._log_map, position, end)
+            if not match:
+                return
+            line_number = bisect.bisect_right(self.offsets, match.start()) - 1
+            if accepted(line_number):
+                yield line_number
+            # Mỗi dòng chỉ trả một lần: tìm tiếp từ dòng sau
+            position = self._line_end(line_number) + 1
+
+
+def iter_log_files(paths):
+    """Các file log từ danh sách file/thư mục (bỏ qua file index, file tải dở, file trạng thái)."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_path = os.path.join(path, name)
+                if os.path.isfile(full_path) and not name.endswith(SKIPPED_SUFFIXES):
+                    yield full_path
+        elif os.path.isfile(path):
+            yield path
+
+
+def format_timestamp(timestamp):
+    return datetime(1970, 1, 1) + timedelta(seconds=timestamp) if timestamp else None
+
+
+def search_logs(paths, since=None, until=None, max_severity=None, pattern=None, ignore_case=False, rebuild=False):
+    """
+    Tìm trong log của nhiều thiết bị, gộp kết quả theo thời gian (mỗi file được đọc tuần tự, không nạp toàn bộ).
+
+    Yields:
+        dict: {'file', 'line', 'timestamp', 'severity', 'text'} cho từng dòng khớp.
+    """
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    regex = re.compile(pattern.encode('utf-8'), flags) if pattern else None
+    since_ts = calendar.timegm(since.timetuple()) if since else None
+    until_ts = calendar.timegm(until.timetuple()) if until else None
+
+    indexes = []
+    for path in iter_log_files(paths):
+        index = LogIndex(path)
+        index.build(force=rebuild)
+        indexes.append(index.open())
+
+    def matches(index):
+        for line_number in index.query(since_ts, until_ts, max_severity, regex):
+            timestamp = index.timestamps[line_number]
+            severity = index.severities[line_number]
+            yield timestamp, {
+                'file': index.path,
+                'line': line_number + 1,
+                'timestamp': format_timestamp(timestamp).isoformat() if timestamp else None,
+                'severity': severity if severity != SEVERITY_UNKNOWN else None,
+                'text': index.line_text(line_number),
+            }
+
+    try:
+        for _, record in heapq.merge(*(matches(index) for index in indexes), key=lambda item: item[0]):
+            yield record
+    finally:
+        for index in indexes:
+            index.close()
+
+
+def parse_time(value, now=None):
+    """Thời điểm từ chuỗi ISO ('2024-05-01 10:00', '2024-05-01T10:00:00') hoặc khoảng lùi ('15m', '2h', '1d')."""
+    relative = re.fullmatch(r'(\d+)([smhd])', value.strip())
+    if relative:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[relative.group(2)]
+        return (now or datetime.now()) - timedelta(**{unit: int(relative.group(1))})
+    return datetime.fromisoformat(value.strip())
+
+
+def parse_severity(value):
+    value = value.strip().lower()
+    if value.isdigit() and int(value) <= 7:
+        return int(value)
+    if value in SEVERITY_NAMES:
+        return SEVERITY_NAMES[value]
+    raise argparse.ArgumentTypeError(f"Severity không hợp lệ: '{value}' (0-7 hoặc {', '.join(SEVERITY_NAMES)}).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tìm kiếm trong các file log đã tải về (get_log_file) theo thời gian, severity và regex, dùng index mmap.")
+    parser.add_argument('paths', nargs='+', help='File log hoặc thư mục chứa file log (ví dụ: --local-save-path của get_log_file).')
+    parser.add_argument('--since', type=str, default=None, help="Từ thời điểm (ISO, ví dụ '2024-05-01 10:00', hoặc lùi lại: 15m, 2h, 1d).")
+    parser.add_argument('--until', type=str, default=None, help='Đến thời điểm (cùng định dạng --since).')
+    parser.add_argument('--severity', type=parse_severity, default=None, help='Chỉ lấy dòng có severity từ mức này trở lên (0-7 hoặc tên: error, warning, ...).')
+    parser.add_argument('--grep', type=str, default=None, help='Regex cần tìm trong dòng log.')
+    parser.add_argument('-i', '--ignore-case', action='store_true', help='Không phân biệt hoa thường khi tìm --grep.')
+    parser.add_argument('--limit', type=int, default=None, help='Số dòng kết quả tối đa.')
+    parser.add_argument('--rebuild', action='store_true', help='Tạo lại index từ đầu.')
+    args = parser.parse_args()
+
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+        if args.grep:
+            re.compile(args.grep)
+    except (ValueError, re.error) as e:
+        parser.error(str(e))
+
+    count = 0
+    try:
+        # Mỗi dòng một kết quả JSON (NDJSON), dòng cuối là tổng kết
+        for record in search_logs(args.paths, since, until, args.severity, args.grep, args.ignore_case, args.rebuild):
+            if args.limit is not None and count >= args.limit:
+                break
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+            count += 1
+    except OSError as e:
+        print(json.dumps({'done': True, 'success': False, 'matches': count, 'error': f"Lỗi đọc file log: {e}"}, ensure_ascii=False))
+        sys.exit(1)
+    print(json.dumps({'done': True, 'success': True, 'matches': count, 'error': None}, ensure_ascii=False))
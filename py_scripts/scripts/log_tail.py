@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+# Thư mục lưu vị trí đã đọc của từng file log (theo host, cổng, file)
+DEFAULT_TAIL_STATE_DIR = os.path.join(tempfile.gettempdir(), "log_tail_state")
+# Số dòng trả về ở lần đọc đầu tiên (chưa có vị trí đã lưu)
+DEFAULT_TAIL_LINES = 200
+# Giới hạn số byte đọc trong một lần (phần mới lớn hơn thì chỉ lấy phần cuối và báo 'gap')
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+# Số byte đầu file dùng làm dấu vân tay để nhận biết file log đã bị xoay vòng
+FINGERPRINT_SIZE = 1024
+# Số dòng cuối cùng đã thấy được lưu làm mốc khi đọc qua CLI
+MARKER_LINES = 3
+
+# Lệnh CLI lấy các dòng log cuối theo kiểu thiết bị; {filter} là bộ lọc chạy trên thiết bị
+TAIL_COMMANDS = {
+    'juniper_junos': {'command': 'show log {log}{filter} | last {lines}', 'filter': ' | match "{pattern}"'},
+    'cisco_xe': {'command': 'show logging last {lines}{filter}', 'filter': ' | include {pattern}'},
+    # IOS không có 'last': thiết bị trả cả log buffer (kèm phần đầu 'Syslog logging: ...'), phần mới vẫn được tách theo mốc
+    'cisco_ios': {'command': 'show logging{filter}', 'filter': ' | include {pattern}', 'full_buffer': True},
+}
+DEVICE_TYPE_ALIASES = {'juniper': 'juniper_junos'}
+# Timestamp ở đầu dòng log (kiểu syslog 'Oct 19 10:00:00', có thể kèm năm/số thứ tự phía trước, hoặc ISO)
+LOG_TIMESTAMP = re.compile(r'[A-Z][a-z]{2}\s+\d{1,2}\s+(?:\d{4}\s+)?\d{2}:\d{2}:\d{2}|\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}')
+TIMESTAMP_SEARCH_WIDTH = 64
+
+
+class TailStateStore:
+    """
+    Lưu vị trí đã đọc của từng (host, cổng, file log) trên đĩa, mỗi file log một file JSON.
+    locked() giữ khóa file (flock) để hai lần đọc đồng thời cùng một log không trả trùng phần mới.
+    """
+
+    def __init__(self, state_dir=DEFAULT_TAIL_STATE_DIR):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+
+    @staticmethod
+    def key(host, port, log_name, method, pattern=None):
+        """Mỗi bộ lọc có vị trí riêng: lần đọc với bộ lọc khác không làm mất các dòng mới của bộ lọc này."""
+        raw_key = json.dumps([host, int(port), log_name, method, pattern])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.state_dir, key + suffix)
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, state):
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump({**state, 'updated_at': time.time()}, file, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    def reset(self, key):
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    @contextmanager
+    def locked(self, key):
+        with open(self._path(key, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def tail_result(lines, **fields):
+    """Kết quả của tail_log: chỉ các dòng mới (đã lọc), kèm thông tin vị trí."""
+    return {
+        'success': True,
+        'output': '\n'.join(lines),
+        'new_lines': len(lines),
+        'error': None,
+        **fields
+    }
+
+
+def filter_lines(lines, pattern):
+    if not pattern:
+        return lines
+    regex = re.compile(pattern)
+    return [line for line in lines if regex.search(line)]
+
+
+def tail_via_sftp(sftp, remote_path, state, pattern=None, lines=DEFAULT_TAIL_LINES, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Đọc phần được ghi thêm của file log từ vị trí byte đã lưu (SFTP seek), chỉ lấy tới dòng hoàn chỉnh cuối cùng.
+    - Lần đầu (chưa có state): trả `lines` dòng cuối.
+    - File nhỏ hơn vị trí đã lưu hoặc phần đầu file khác trước: file đã bị xoay vòng, đọc lại từ đầu ('rotated').
+    - Phần mới lớn hơn max_bytes: chỉ đọc max_bytes cuối ('gap').
+    pattern được lọc tại chỗ sau khi tải (SFTP không chạy lệnh trên thiết bị).
+
+    Returns:
+        tuple: (kết quả, state mới).
+    """
+    size = sftp.stat(remote_path).st_size
+    with sftp.open(remote_path, 'rb') as remote_file:
+        head = remote_file.read(min(FINGERPRINT_SIZE, size))
+        fingerprint = hashlib.md5(head).hexdigest()
+        first_read = state is None
+        rotated = False
+        offset = 0
+        if not first_read:
+            offset = state['offset']
+            same_file = (
+                size >= offset
+                and len(head) >= state['fingerprint_size']
+                and hashlib.md5(head[:state['fingerprint_size']]).hexdigest() == state['fingerprint']
+            )
+            if not same_file:
+                rotated, offset = True, 0
+
+        # Lần đầu chỉ cần `lines` dòng cuối: đọc một đoạn cuối đủ lớn (ước lượng dòng log <= 512 byte)
+        window = min(max_bytes, max(lines, 1) * 512) if first_read else max_bytes
+        start = max(offset, size - window)
+        gap = not first_read and start > offset
+        remote_file.seek(start)
+        remote_file.prefetch(size - start)
+        data = remote_file.read(size - start)
+
+    # Dòng cuối chưa có ký tự xuống dòng (thiết bị đang ghi) để lần sau đọc
+    complete = data[:data.rfind(b'\n') + 1]
+    text_lines = complete.decode('utf-8', errors='replace').splitlines()
+    if start > offset:
+        # Bắt đầu đọc giữa chừng: bỏ dòng đầu có thể bị cắt
+        text_lines = text_lines[1:]
+    if first_read:
+        text_lines = text_lines[-lines:] if lines else []
+
+    new_state = {
+        'offset': start + len(complete),
+        'fingerprint': fingerprint,
+        'fingerprint_size': len(head),
+        'size': size
+    }
+    return tail_result(filter_lines(text_lines, pattern), offset=new_state['offset'], file_size=size,
+                       rotated=rotated, gap=gap, first_read=first_read), new_state
+
+
+def tail_profile(device_type):
+    profile = TAIL_COMMANDS.get(DEVICE_TYPE_ALIASES.get(device_type, device_type))
+    if profile is None:
+        raise ValueError(f"tail_log qua CLI chưa hỗ trợ kiểu thiết bị '{device_type}', hãy dùng --tail-method sftp.")
+    return profile
+
+
+def tail_command(device_type, log_name, pattern=None, lines=DEFAULT_TAIL_LINES):
+    """Câu lệnh CLI lấy `lines` dòng log cuối (có bộ lọc chạy trên thiết bị), hoặc ValueError nếu không hỗ trợ."""
+    profile = tail_profile(device_type)
+    if pattern and '"' in pattern:
+        raise ValueError("Bộ lọc không được chứa dấu nháy kép.")
+    log_filter = profile['filter'].format(pattern=pattern) if pattern else ''
+    return profile['command'].format(log=log_name or 'messages', lines=lines, filter=log_filter)
+
+
+def strip_log_header(output_lines):
+    """
+    Bỏ phần đầu của output 'show logging' (Syslog logging:, Console logging:, ..., Log Buffer (N bytes):)
+    trước dòng log có timestamp đầu tiên. Không thấy dòng có timestamp thì bỏ tới hết dòng 'Log Buffer'.
+    """
+    for index, line in enumerate(output_lines):
+        if LOG_TIMESTAMP.search(line[:TIMESTAMP_SEARCH_WIDTH]):
+            return output_lines[index:]
+    for index, line in enumerate(output_lines):
+        if line.lstrip().startswith('Log Buffer'):
+            return output_lines[index + 1:]
+    return output_lines
+
+
+def split_new_lines(output_lines, marker):
+    """
+    Tách các dòng mới sau mốc (các dòng cuối đã thấy lần trước).
+    Returns:
+        tuple: (dòng mới, True nếu không tìm thấy mốc, tức có thể đã bỏ sót dòng).
+    """
+    if not marker:
+        return output_lines, False
+    stripped = [line.strip() for line in output_lines]
+    size = len(marker)
+    for end in range(len(stripped), size - 1, -1):
+        if stripped[end - size:end] == marker:
+            return output_lines[end:], False
+    return output_lines, True
+
+
+def tail_via_cli(net_connect, device_type, log_name, state, pattern=None, lines=DEFAULT_TAIL_LINES, read_timeout=120):
+    """
+    Lấy các dòng log cuối bằng lệnh CLI (`show log ... | last N`, bộ lọc `| match`/`| include` chạy trên thiết bị)
+    rồi chỉ trả các dòng sau mốc đã lưu. Không thấy mốc (log ghi nhiều hơn `lines` dòng từ lần trước) thì trả
+    `lines` dòng cuối và báo 'gap'. Thiết bị không có 'last' (IOS) trả cả log buffer: phần đầu được bỏ và lần đầu
+    cũng chỉ lấy `lines` dòng cuối.
+
+    Returns:
+        tuple: (kết quả, state mới).
+    """
+    command = tail_command(device_type, log_name, pattern, lines)
+    output = net_connect.send_command(command, read_timeout=read_timeout)
+    output_lines = [line for line in output.splitlines() if line.strip()]
+    if tail_profile(device_type).get('full_buffer'):
+        output_lines = strip_log_header(output_lines)
+
+    first_read = state is None
+    new_lines, gap = split_new_lines(output_lines, None if first_read else state['marker'])
+    if first_read or gap:
+        new_lines = new_lines[-lines:] if lines else []
+    marker = [line.strip() for line in output_lines[-MARKER_LINES:]] if output_lines else (state or {}).get('marker', [])
+    return tail_result(new_lines, command=command, gap=gap, first_read=first_read), {'marker': marker}
+
+
+def tail_log_file(store, host, port, log_name, method, read_tail, pattern=None, reset=False):
+    """
+    Đọc phần mới của một file log với vị trí lưu trong store (giữ khóa trong lúc đọc và lưu vị trí).
+
+    Args:
+        read_tail (callable): read_tail(state) -> (kết quả, state mới), ví dụ tail_via_sftp/tail_via_cli đã gắn tham số.
+        reset (bool): Bỏ vị trí đã lưu, đọc lại như lần đầu.
+    """
+    key = store.key(host, port, log_name, method, pattern)
+    with store.locked(key):
+        if reset:
+            store.reset(key)
+        result, new_state = read_tail(store.load(key))
+        store.save(key, new_state)
+    return result
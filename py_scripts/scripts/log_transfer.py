@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import socket
+import hashlib
+import paramiko
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Kích thước mỗi lần đọc/ghi khi tải file (SFTP vẫn gửi song song nhiều request nhỏ nhờ prefetch)
+DEFAULT_CHUNK_SIZE = 1 << 20
+# Số byte cuối của file tải dở được so với file trên thiết bị trước khi tải tiếp
+RESUME_CHECK_SIZE = 64 * 1024
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.state.json'
+
+# Lệnh CLI tính MD5 của file trên thiết bị (chạy qua kênh exec SSH); thiết bị khác chỉ so sánh kích thước/mtime
+REMOTE_MD5_COMMANDS = {
+    'juniper_junos': 'file checksum md5 {path}',
+    'cisco_ios': 'verify /md5 {path}',
+    'cisco_xe': 'verify /md5 {path}',
+}
+MD5_PATTERN = re.compile(r'\b[0-9a-fA-F]{32}\b')
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(DEFAULT_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_sftp(host, username, password, port=22, timeout=60, compress=True):
+    """Mở kết nối SSH (bật nén nếu compress=True) và phiên SFTP. Returns: (SSHClient, SFTPClient)."""
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        host, port=port, username=username, password=password,
+        timeout=timeout, auth_timeout=timeout, banner_timeout=timeout,
+        compress=compress, look_for_keys=False, allow_agent=False
+    )
+    return client, client.open_sftp()
+
+
+def remote_md5(client, device_type, remote_path, timeout=60):
+    """MD5 của file trên thiết bị qua lệnh CLI; None nếu kiểu thiết bị không hỗ trợ hoặc không đọc được kết quả."""
+    template = REMOTE_MD5_COMMANDS.get(device_type)
+    if not template:
+        return None
+    _, stdout, _ = client.exec_command(template.format(path=remote_path), timeout=timeout)
+    match = MD5_PATTERN.search(stdout.read().decode('utf-8', errors='replace'))
+    return match.group(0).lower() if match else None
+
+
+def load_state(local_path):
+    try:
+        with open(local_path + STATE_SUFFIX, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(local_path, state):
+    tmp_path = local_path + STATE_SUFFIX + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+    os.replace(tmp_path, local_path + STATE_SUFFIX)
+
+
+def resume_offset(sftp, remote_path, part_path, remote_size):
+    """
+    Vị trí tải tiếp từ file tải dở: chỉ tải tiếp khi phần cuối của file tải dở trùng với cùng đoạn trên thiết bị
+    (file log chỉ được ghi thêm vào cuối); file đã bị xoay vòng/ghi đè thì tải lại từ đầu.
+    """
+    try:
+        part_size = os.path.getsize(part_path)
+    except OSError:
+        return 0
+    if part_size == 0 or part_size > remote_size:
+        return 0
+    check_size = min(RESUME_CHECK_SIZE, part_size)
+    with open(part_path, 'rb') as local_file:
+        local_file.seek(part_size - check_size)
+        local_tail = local_file.read(check_size)
+    with sftp.open(remote_path, 'rb') as remote_file:
+        remote_file.seek(part_size - check_size)
+        remote_tail = remote_file.read(check_size)
+    return part_size if local_tail == remote_tail else 0
+
+
+def fetch_remote_file(host, username, password, remote_path, local_path, device_type=None, port=22, timeout=60,
+                      chunk_size=DEFAULT_CHUNK_SIZE, verify_md5=False, compress=True):
+    """
+    Tải một file từ thiết bị qua SFTP, có thể tải tiếp và bỏ qua file không đổi.
+    - Kích thước/mtime (và MD5 trên thiết bị nếu verify_md5) được so với lần tải trước (file .state.json);
+      file không đổi thì không tải lại.
+    - Dữ liệu ghi vào '<local_path>.part' theo từng khối; lần chạy sau tải tiếp từ file này nếu bị ngắt giữa chừng.
+    - Tải xong mới đổi tên thành local_path, kiểm tra kích thước và MD5 (nếu lấy được MD5 trên thiết bị).
+
+    Returns:
+        dict: {'success', 'output', 'error', 'file_size', 'skipped', 'resumed_from', 'md5'}.
+    """
+    result = {'success': False, 'output': '', 'error': None, 'file_size': None, 'skipped': False, 'resumed_from': 0, 'md5': None}
+    client, sftp = open_sftp(host, username, password, port, timeout, compress)
+    try:
+        attributes = sftp.stat(remote_path)
+        remote_size, remote_mtime = attributes.st_size, attributes.st_mtime
+        result['file_size'] = remote_size
+        expected_md5 = remote_md5(client, device_type, remote_path, timeout) if verify_md5 else None
+
+        state = load_state(local_path)
+        unchanged = (
+            os.path.exists(local_path)
+            and state.get('remote_path') == remote_path
+            and state.get('size') == remote_size
+            and os.path.getsize(local_path) == remote_size
+            and (state.get('md5') == expected_md5 if expected_md5 else state.get('mtime') == remote_mtime)
+        )
+        if unchanged:
+            result.update(success=True, skipped=True, md5=state.get('md5'),
+                          output=f"File {remote_path} không thay đổi so với lần tải trước ({local_path}), bỏ qua.")
+            return result
+
+        local_dir = os.path.dirname(os.path.abspath(local_path))
+        os.makedirs(local_dir, exist_ok=True)
+        part_path = local_path + PART_SUFFIX
+        offset = resume_offset(sftp, remote_path, part_path, remote_size)
+        result['resumed_from'] = offset
+
+        with sftp.open(remote_path, 'rb') as remote_file, open(part_path, 'ab' if offset else 'wb') as local_file:
+            remote_file.seek(offset)
+            # Gửi trước các request đọc cho phần còn lại để không phải chờ từng vòng khứ hồi
+            remote_file.prefetch(remote_size)
+            remaining = remote_size - offset
+            while remaining > 0:
+                chunk = remote_file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                local_file.write(chunk)
+                remaining -= len(chunk)
+
+        downloaded_size = os.path.getsize(part_path)
+        if downloaded_size != remote_size:
+            result['error'] = f"Kích thước file tải về ({downloaded_size} bytes) khác file trên thiết bị ({remote_size} bytes)."
+            return result
+        local_md5 = file_md5(part_path)
+        if expected_md5 and local_md5 != expected_md5:
+            os.remove(part_path)
+            result['error'] = f"MD5 không khớp (thiết bị: {expected_md5}, tải về: {local_md5}); đã xóa file tải dở."
+            return result
+
+        os.replace(part_path, local_path)
+        save_state(local_path, {'remote_path': remote_path, 'size': remote_size, 'mtime': remote_mtime, 'md5': local_md5})
+        resumed = f", tải tiếp từ byte {offset}" if offset else ""
+        result.update(success=True, md5=local_md5,
+                      output=f"File {remote_path} đã được tải thành công về {local_path}. Kích thước: {remote_size} bytes{resumed}.")
+        return result
+    finally:
+        sftp.close()
+        client.close()
+
+
+def describe_transfer_error(error):
+    """Thông báo lỗi (tiếng Việt) cho exception khi kết nối/tải file qua SFTP."""
+    if isinstance(error, paramiko.AuthenticationException):
+        return "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi trong thời gian chờ."
+    if isinstance(error, FileNotFoundError):
+        return f"File không tồn tại trên thiết bị: {error}"
+    return f"Đã xảy ra lỗi không mong muốn: {error}"
+
+
+def local_path_for_host(local_save_path, hostname, remote_path, multiple_hosts):
+    """
+    Đường dẫn lưu file cho từng thiết bị: '{host}' trong local_save_path được thay bằng hostname;
+    nhiều thiết bị mà không có '{host}' thì local_save_path là thư mục, file lưu thành '<host>_<tên file>'.
+    """
+    if '{host}' in local_save_path:
+        return local_save_path.replace('{host}', hostname)
+    if multiple_hosts:
+        return os.path.join(local_save_path, f"{hostname}_{os.path.basename(remote_path)}")
+    return local_save_path
+
+
+def fetch_from_hosts(hosts, remote_path, local_save_path, timeout=60, workers=8, **options):
+    """
+    Tải cùng một file từ nhiều thiết bị song song (tối đa `workers` phiên SFTP cùng lúc).
+
+    Yields:
+        dict: Kết quả fetch_remote_file của từng thiết bị (thêm key 'host') ngay khi thiết bị đó xong.
+    """
+    def run_one(host):
+        local_path = local_path_for_host(local_save_path, host['hostname'], remote_path, len(hosts) > 1)
+        return fetch_remote_file(
+            host['hostname'], host['username'], host['password'], remote_path, local_path,
+            device_type=host.get('device_type'), port=host.get('port', 22), timeout=timeout, **options
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as pool:
+        futures = {pool.submit(run_one, host): host for host in hosts}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'success': False, 'output': '', 'error': describe_transfer_error(e)}
+            yield {'host': futures[future]['hostname'], **result}
@@ -8,12 +8,84 @@ from netmiko.exceptions import (
     NetmikoAuthenticationException,
     NetmikoBaseException,
     # NetmikoValueError, # Bắt các lỗi ValueError (ví dụ: device_type không hợp lệ)
-    ReadTimeout # Lỗi khi dùng use_textfsm=True mà không tìm thấy template
+    ReadTimeout # Lỗi khi thiết bị không trả hết output trong thời gian chờ
 )
 import os # Import os module để xử lý đường dẫn file cục bộ
+import textfsm
+from command_batch import load_command_specs
+from netmiko_wrapper import parse_with_fallback
+from ssh_cli import load_hosts_file
+from log_transfer import open_sftp, describe_transfer_error, fetch_from_hosts
+from log_tail import TailStateStore, tail_log_file, tail_via_cli, tail_via_sftp, DEFAULT_TAIL_LINES, DEFAULT_MAX_BYTES, DEFAULT_TAIL_STATE_DIR
 
 
-def execute_network_action(device_type, host, username, password, action_type, command=None, secret=None, use_textfsm=False, remote_file_path=None, local_save_path=None, port=22, timeout=60):
+def run_cli_command(net_connect, spec, use_textfsm=False, timeout=60):
+    """
+    Chạy một lệnh CLI trên kết nối đã mở. Lệnh chỉ được gửi một lần; khi use_textfsm=True, output thô được
+    phân tích lần lượt bằng template riêng của lệnh (nếu có), NTC-Templates, rồi giữ nguyên output thô.
+
+    Args:
+        net_connect: Kết nối Netmiko đang mở.
+        spec (dict): {'key', 'command', 'textfsm_template'} (xem command_batch.load_command_specs).
+        use_textfsm (bool): Parse output bằng template riêng của lệnh (nếu có) hoặc TextFSM/NTC-Templates.
+        timeout (int): Thời gian chờ cơ sở (giây).
+
+    Returns:
+        dict: Kết quả lệnh (output, parsed_output, error, success).
+    """
+    command = spec['command']
+    output = None
+    parsed_output = None
+    error_message = None
+    success = False
+
+    try:
+        output = net_connect.send_command(command, use_textfsm=False, read_timeout=timeout + 30)
+        success = True
+        if use_textfsm:
+            parsed_output, source = parse_with_fallback(
+                output, net_connect.device_type, command, template_path=spec.get('textfsm_template')
+            )
+            if source == 'raw':
+                parsed_output = None
+                error_message = "Lỗi phân tích TextFSM: Không tìm thấy template hoặc output không khớp với template."
+
+    except ReadTimeout as e:
+        # Thiết bị không trả hết output trong thời gian chờ: không gửi lại lệnh để tránh tăng tải cho thiết bị
+        error_message = f"Lỗi timeout khi đọc output lệnh: {e}"
+    except FileNotFoundError:
+        error_message = f"Lỗi phân tích TextFSM: File template '{spec.get('textfsm_template')}' không tồn tại."
+    except textfsm.TextFSMError as e:
+        error_message = f"Lỗi phân tích TextFSM: {e}"
+
+    return {
+        "success": success,
+        "output": output if output is not None else "",
+        "parsed_output": parsed_output,
+        "error": error_message
+    }
+
+
+def tail_log_over_sftp(host, username, password, remote_file_path, port=22, timeout=60, pattern=None, tail_lines=DEFAULT_TAIL_LINES,
+                      max_bytes=DEFAULT_MAX_BYTES, state_dir=DEFAULT_TAIL_STATE_DIR, reset_offset=False):
+    """tail_log qua SFTP: đọc phần mới của file log từ vị trí byte đã lưu (không cần phiên CLI Netmiko)."""
+    client = None
+    try:
+        client, sftp = open_sftp(host, username, password, port, timeout)
+        return tail_log_file(
+            TailStateStore(state_dir), host, port, remote_file_path, 'sftp',
+            lambda state: tail_via_sftp(sftp, remote_file_path, state, pattern, tail_lines, max_bytes),
+            pattern=pattern, reset=reset_offset
+        )
+    except Exception as e:
+        return {"success": False, "output": "", "parsed_output": None, "error": describe_transfer_error(e)}
+    finally:
+        if client:
+            client.close()
+
+
+def execute_network_action(device_type, host, username, password, action_type, command=None, secret=None, use_textfsm=False, remote_file_path=None, local_save_path=None, port=22, timeout=60, commands=None,
+                           pattern=None, tail_lines=DEFAULT_TAIL_LINES, state_dir=DEFAULT_TAIL_STATE_DIR, reset_offset=False):
     """
     Kết nối tới thiết bị mạng bằng Netmiko và thực hiện một hành động (CLI command hoặc file transfer).
 
@@ -30,9 +102,17 @@ def execute_network_action(device_type, host, username, password, action_type, c
         local_save_path (str, optional): Đường dẫn cục bộ để lưu file nếu action_type là 'get_log_file'.
         port (int): Cổng SSH (mặc định: 22).
         timeout (int): Thời gian chờ kết nối và thực thi lệnh (mặc định: 60 giây).
+        commands (list, optional): Nhiều lệnh CLI chạy trên cùng một phiên SSH, dạng {'key', 'command', 'textfsm_template'}
+                                   (xem command_batch.load_command_specs). Khi có, thay cho 'command'.
+        pattern (str, optional): Bộ lọc của tail_log (chạy trên thiết bị qua '| match'/'| include').
+        tail_lines (int): Số dòng log cuối lấy về mỗi lần tail_log.
+        state_dir (str): Thư mục lưu mốc đã đọc của tail_log.
+        reset_offset (bool): Bỏ mốc đã lưu, tail_log đọc lại như lần đầu.
 
     Returns:
         dict: Kết quả hành động (output, parsed_output, error, success).
+              Với 'commands', kết quả từng lệnh nằm trong 'results' theo key của lệnh.
+              Với 'tail_log', 'output' chỉ gồm các dòng mới từ lần đọc trước (xem log_tail.tail_via_cli).
     """
     device_params = {
         'device_type': device_type,
@@ -52,6 +132,8 @@ def execute_network_action(device_type, host, username, password, action_type, c
     parsed_output = None
     error_message = None
     success = False
+    results = None
+    tail = None
     net_connect = None # Khai báo biến net_connect trước khối try
 
     try:
@@ -61,24 +143,18 @@ def execute_network_action(device_type, host, username, password, action_type, c
             if device_type.startswith("cisco_ios") or device_type.startswith("cisco_xe") or device_type.startswith("cisco_asa"):
                 net_connect.enable()
 
-            if action_type == "cli_command":
+            if action_type == "cli_command" and commands:
+                # Nhiều lệnh trên cùng một phiên SSH
+                results = {spec['key']: run_cli_command(net_connect, spec, use_textfsm, timeout) for spec in commands}
+                success = all(result['success'] for result in results.values())
+
+            elif action_type == "cli_command":
                 # Thực thi lệnh CLI
-                if use_textfsm:
-                    # Gửi lệnh và tự động parse bằng TextFSM
-                    # Nếu lỗi ReadTimeout xảy ra ở đây, nó sẽ bị bắt ở khối except ReadTimeout
-                    parsed_output = net_connect.send_command(
-                        command, use_textfsm=True, read_timeout=timeout + 30 # Tăng timeout riêng cho parsing
-                    )
-                    # Lấy output thô sau khi parse thành công (có thể cần chạy lại lệnh nếu send_command with textfsm không trả raw)
-                    # Một số trường hợp, parsed_output có thể rỗng dù lệnh thành công nếu không có template
-                    if not parsed_output:
-                        output = net_connect.send_command(command, use_textfsm=False)
-                    else:
-                        output = parsed_output # Coi parsed_output là output chính nếu có
-                        
-                else:
-                    output = net_connect.send_command(command)
-                success = True
+                cli_result = run_cli_command(net_connect, {'key': command, 'command': command}, use_textfsm, timeout)
+                output = cli_result['output']
+                parsed_output = cli_result['parsed_output']
+                error_message = cli_result['error']
+                success = cli_result['success']
 
             elif action_type == "get_log_file":
                 # Tải file log
@@ -100,6 +176,14 @@ def execute_network_action(device_type, host, username, password, action_type, c
                     output = f"Không thể tải file {remote_file_path}. Chi tiết: {transfer_result}"
                     success = False
                     error_message = "Lỗi tải file."
+            elif action_type == "tail_log":
+                # Chỉ lấy các dòng log mới từ lần đọc trước
+                tail = tail_log_file(
+                    TailStateStore(state_dir), host, port, remote_file_path, 'cli',
+                    lambda state: tail_via_cli(net_connect, device_type, remote_file_path, state, pattern, tail_lines, timeout + 30),
+                    pattern=pattern, reset=reset_offset
+                )
+                success = tail['success']
             else:
                 error_message = f"Loại hành động '{action_type}' không được hỗ trợ."
 
@@ -108,15 +192,7 @@ def execute_network_action(device_type, host, username, password, action_type, c
     except NetmikoTimeoutException:
         error_message = "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi trong thời gian chờ."
     except ReadTimeout as e:
-        # Lỗi này thường xảy ra khi Netmiko.send_command(use_textfsm=True) không tìm thấy template
-        # hoặc output không khớp với template.
-        error_message = f"Lỗi phân tích TextFSM: {e}. (Có thể không tìm thấy template hoặc output không khớp)."
-        success = True # Coi là thành công về mặt kết nối, lỗi là do parsing
-        # Cố gắng lấy output thô nếu có thể, mặc dù có thể không hoàn chỉnh
-        if net_connect:
-            output = net_connect.send_command(command, use_textfsm=False)
-        else:
-            output = "Kết nối không thành công để lấy output thô."
+        error_message = f"Lỗi timeout khi đọc output: {e}"
     except NetmikoBaseException as e: # Bắt các lỗi ValueError do Netmiko ném ra
         error_message = f"Lỗi Netmiko cấu hình/giá trị: {e}"
     except ValueError as e: # Lỗi Python do tham số thiếu (nếu raise từ hàm này)
@@ -132,6 +208,12 @@ def execute_network_action(device_type, host, username, password, action_type, c
                 print(f"Lỗi khi đóng kết nối Netmiko: {e}", file=sys.stderr)
 
 
+    if tail is not None:
+        return {**tail, "error": error_message or tail['error']}
+
+    if results is not None or (action_type == "cli_command" and commands):
+        return {"success": success, "results": results or {}, "error": error_message}
+
     return {
         "success": success,
         "output": output if output is not None else "", # Đảm bảo luôn trả về chuỗi hoặc rỗng
@@ -142,22 +224,87 @@ def execute_network_action(device_type, host, username, password, action_type, c
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ứng dụng Python Netmiko để chạy lệnh hoặc tải file trên thiết bị mạng.")
     parser.add_argument('--device-type', type=str, required=True, help='Kiểu thiết bị Netmiko (ví dụ: juniper_junos, cisco_ios).')
-    parser.add_argument('--host', type=str, required=True, help='Địa chỉ IP hoặc hostname của thiết bị.')
+    parser.add_argument('--host', type=str, default=None, help='Địa chỉ IP hoặc hostname của thiết bị (bắt buộc trừ khi dùng --hosts-file).')
     parser.add_argument('--username', type=str, required=True, help='Tên người dùng SSH.')
     parser.add_argument('--password', type=str, required=True, help='Mật khẩu SSH.')
     parser.add_argument('--secret', type=str, default=None, help='Mật khẩu enable mode (nếu cần).')
     parser.add_argument('--port', type=int, default=22, help='Cổng SSH (mặc định: 22).')
     parser.add_argument('--timeout', type=int, default=60, help='Thời gian chờ kết nối và thực thi lệnh (mặc định: 60 giây).')
     
-    parser.add_argument('--action-type', type=str, required=True, choices=['cli_command', 'get_log_file'], help='Loại hành động cần thực hiện.')
+    parser.add_argument('--action-type', type=str, required=True, choices=['cli_command', 'get_log_file', 'tail_log'], help='Loại hành động cần thực hiện.')
     
-    parser.add_argument('--command', type=str, default=None, help='Câu lệnh CLI cần thực hiện (nếu action-type là cli_command).')
+    parser.add_argument('--command', type=str, action='append', default=None, help='Câu lệnh CLI cần thực hiện (nếu action-type là cli_command).\nLặp lại --command để chạy nhiều lệnh trên cùng một phiên SSH.')
+    parser.add_argument('--commands-json', type=str, default=None, help='Chuỗi JSON hoặc file JSON: mảng câu lệnh hoặc {"command", "textfsm_template", "key"} (nếu action-type là cli_command).')
     parser.add_argument('--use-textfsm', action='store_true', help='Set to true để parse output bằng TextFSM/NTC-Templates (nếu action-type là cli_command).')
 
-    parser.add_argument('--remote-file-path', type=str, default=None, help='Đường dẫn file trên thiết bị từ xa (nếu action-type là get_log_file).')
-    parser.add_argument('--local-save-path', type=str, default=None, help='Đường dẫn cục bộ để lưu file (nếu action-type là get_log_file).')
+    parser.add_argument('--remote-file-path', type=str, default=None, help='Đường dẫn file trên thiết bị từ xa (nếu action-type là get_log_file).\nVới tail_log: tên log cho lệnh CLI (ví dụ: messages) hoặc đường dẫn file khi dùng --tail-method sftp.')
+    parser.add_argument('--local-save-path', type=str, default=None, help='Đường dẫn cục bộ để lưu file (nếu action-type là get_log_file).\nVới nhiều thiết bị: dùng {host} trong đường dẫn, hoặc truyền thư mục (file lưu thành <host>_<tên file>).')
+    parser.add_argument('--resumable', action='store_true', help='get_log_file qua SFTP có nén: bỏ qua file không đổi, tải tiếp từ file .part nếu lần trước bị ngắt.')
+    parser.add_argument('--verify-md5', action='store_true', help='Với --resumable: so MD5 trên thiết bị (Junos, Cisco IOS/XE) thay cho kích thước/mtime để bỏ qua file không đổi và kiểm tra file tải về.')
+    parser.add_argument('--hosts-file', type=str, default=None, help='File JSON hoặc CSV chứa danh sách thiết bị để tải file log song song (get_log_file, bật --resumable).')
+    parser.add_argument('--workers', type=int, default=8, help='Số thiết bị tải file đồng thời tối đa khi dùng --hosts-file (mặc định: 8).')
+
+    parser.add_argument('--tail-method', type=str, default='cli', choices=['cli', 'sftp'], help="tail_log: 'cli' dùng 'show log ... | last N' và so với các dòng cuối đã thấy; 'sftp' đọc file log từ vị trí byte đã lưu (mặc định: cli).")
+    parser.add_argument('--pattern', type=str, default=None, help="tail_log: chỉ lấy các dòng khớp bộ lọc ('| match'/'| include' trên thiết bị; với sftp là regex Python lọc tại chỗ).")
+    parser.add_argument('--lines', type=int, default=DEFAULT_TAIL_LINES, help=f'tail_log: số dòng log cuối lấy về mỗi lần (mặc định: {DEFAULT_TAIL_LINES}).')
+    parser.add_argument('--state-dir', type=str, default=DEFAULT_TAIL_STATE_DIR, help=f'tail_log: thư mục lưu mốc đã đọc (mặc định: {DEFAULT_TAIL_STATE_DIR}).')
+    parser.add_argument('--reset-offset', action='store_true', help='tail_log: bỏ mốc đã lưu và đọc lại như lần đầu.')
 
     args = parser.parse_args()
+    if args.hosts_file and args.action_type != 'get_log_file':
+        parser.error("--hosts-file chỉ dùng với --action-type get_log_file.")
+    if not args.host and not args.hosts_file:
+        parser.error("Cần --host hoặc --hosts-file.")
+
+    if args.action_type == 'get_log_file' and (args.resumable or args.hosts_file):
+        # Tải file qua SFTP trực tiếp (không cần phiên CLI Netmiko)
+        if not args.remote_file_path or not args.local_save_path:
+            parser.error("--remote-file-path và --local-save-path là bắt buộc cho get_log_file.")
+        try:
+            hosts = load_hosts_file(args.hosts_file) if args.hosts_file else [{'hostname': args.host}]
+        except (OSError, ValueError) as e:
+            parser.error(f"Không đọc được --hosts-file: {e}")
+        for host in hosts:
+            host.setdefault('device_type', args.device_type)
+            host.setdefault('username', args.username)
+            host.setdefault('password', args.password)
+            host.setdefault('port', args.port)
+
+        results = fetch_from_hosts(
+            hosts, args.remote_file_path, args.local_save_path,
+            timeout=args.timeout, workers=args.workers, verify_md5=args.verify_md5
+        )
+        all_success = True
+        if args.hosts_file:
+            # Nhiều thiết bị: mỗi dòng một kết quả JSON (NDJSON), in ngay khi từng thiết bị xong
+            for result in results:
+                all_success = all_success and result['success']
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+        else:
+            result = next(results)
+            result.pop('host')
+            all_success = result['success']
+            print(json.dumps(result, indent=2))
+        sys.exit(0 if all_success else 1)
+
+    if args.action_type == 'tail_log' and args.tail_method == 'sftp':
+        if not args.remote_file_path:
+            parser.error("--remote-file-path là bắt buộc cho tail_log qua sftp.")
+        result = tail_log_over_sftp(
+            args.host, args.username, args.password, args.remote_file_path, port=args.port, timeout=args.timeout,
+            pattern=args.pattern, tail_lines=args.lines, state_dir=args.state_dir, reset_offset=args.reset_offset
+        )
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result['success'] else 1)
+
+    # Một lệnh giữ nguyên định dạng kết quả như trước; nhiều lệnh chạy trên cùng một phiên SSH
+    command = args.command[0] if args.command and len(args.command) == 1 and not args.commands_json else None
+    commands = None
+    if args.action_type == 'cli_command' and command is None:
+        try:
+            commands = load_command_specs(args.command, args.commands_json)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
 
     result = execute_network_action( # Đổi tên hàm
         device_type=args.device_type,
@@ -168,10 +315,15 @@ if __name__ == "__main__":
         port=args.port,
         timeout=args.timeout,
         action_type=args.action_type,
-        command=args.command,
+        command=command,
+        commands=commands,
         use_textfsm=args.use_textfsm,
         remote_file_path=args.remote_file_path,
-        local_save_path=args.local_save_path
+        local_save_path=args.local_save_path,
+        pattern=args.pattern,
+        tail_lines=args.lines,
+        state_dir=args.state_dir,
+        reset_offset=args.reset_offset
     )
 
     print(json.dumps(result, indent=2))
@@ -1,75 +1,65 @@
-import os
-import textfsm
 from netmiko import ConnectHandler
-from netmiko.exceptions import ReadTimeout
+from ntc_parser import get_structured_data
+from textfsm_registry import find_custom_template, parse_with_template
 import logging
 
 # Cấu hình logging thay vì dùng print
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def get_custom_template(device_type, command):
-    """Tìm template tùy chỉnh dựa trên vị trí của file script này."""
-    # Normalize tên lệnh
-    command_norm = command.lower().strip().replace(" ", "_").replace("/", "_")
-    template_name = f"{device_type}_{command_norm}.textfsm"
-    
-    # Xây dựng đường dẫn tuyệt đối đến thư mục 'templates' cùng cấp với script này
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    template_dir = os.path.join(script_dir, "templates")
-    full_path = os.path.join(template_dir, template_name)
-    
-    logging.info(f"🔍 Tìm kiếm template tùy chỉnh: {full_path}")
-    return full_path if os.path.exists(full_path) else None
+    """Tìm template tùy chỉnh trong các thư mục 'templates'/'textfsm_template' cùng cấp với script này."""
+    template_path = find_custom_template(device_type, command)
+    logging.info(f"🔍 Tìm kiếm template tùy chỉnh cho '{command}' ({device_type}): {template_path or 'không có'}")
+    return template_path
 
 def parse_custom_template(output, template_path):
-    """Phân tích output với một template TextFSM cụ thể."""
-    with open(template_path) as template_file:
-        fsm = textfsm.TextFSM(template_file)
-        return fsm.ParseTextToDicts(output)
+    """Phân tích output với một template TextFSM cụ thể (template chỉ biên dịch lại khi file thay đổi)."""
+    return parse_with_template(output, template_path)
 
-def smart_send_command(device, command, prefer_custom=False):
+def parse_ntc_template(output, device_type, command):
+    """Phân tích output với NTC-Templates; trả về None nếu không có template hoặc không khớp."""
+    parsed_output = get_structured_data(output, platform=device_type, command=command)
+    # get_structured_data trả về list nếu parse thành công, hoặc chính output (string) nếu không có template
+    return parsed_output if isinstance(parsed_output, list) and parsed_output else None
+
+def parse_with_fallback(raw_output, device_type, command, template_path=None, prefer_custom=True):
     """
-    Gửi lệnh tới thiết bị.
-    - Nếu prefer_custom=True: Ưu tiên 1 là template tùy chỉnh, 2 là NTC, 3 là raw.
-    - Nếu prefer_custom=False (mặc định): Ưu tiên 1 là NTC, 2 là tùy chỉnh, 3 là raw.
+    Thử lần lượt các cách phân tích trên cùng một output thô, không gửi lại lệnh tới thiết bị.
+    - prefer_custom=True: template tùy chỉnh (template_path hoặc thư mục templates), rồi NTC, rồi raw.
+    - prefer_custom=False: NTC, rồi template tùy chỉnh, rồi raw.
+    Lỗi của template_path truyền vào (không tồn tại, sai cú pháp) được raise cho nơi gọi xử lý.
+
+    Returns:
+        tuple: (kết quả, nguồn) - nguồn là 'custom', 'ntc' hoặc 'raw' (khi đó kết quả là output thô).
     """
-    with ConnectHandler(**device) as conn:
-        # LUỒNG 1: Ưu tiên template tùy chỉnh
-        if prefer_custom:
-            template_path = get_custom_template(device['device_type'], command)
-            if template_path:
-                logging.info(f"✅ Ưu tiên dùng template tùy chỉnh: {template_path}")
-                raw_output = conn.send_command(command, use_textfsm=False)
-                return parse_custom_template(raw_output, template_path)
-            else:
-                logging.warning("⚠️ Không tìm thấy template tùy chỉnh, fallback về NTC-Templates.")
-                # Nếu không có template tùy chỉnh, chạy logic NTC như bình thường
-                # Netmiko sẽ trả về list nếu parse thành công, hoặc string nếu thất bại
-                return conn.send_command(command, use_textfsm=True, read_timeout=120)
+    def parse_custom():
+        path = template_path or get_custom_template(device_type, command)
+        return parse_custom_template(raw_output, path) if path else None
 
-        # LUỒNG 2: Ưu tiên NTC-Templates (mặc định)
-        # 1. Thử dùng NTC-Templates trước
-        try:
-            # Tăng read_timeout để tránh lỗi khi parsing lâu
-            parsed_output = conn.send_command(command, use_textfsm=True, read_timeout=120)
-            # Netmiko trả về list nếu parse thành công, hoặc string nếu không có template
-            if isinstance(parsed_output, list) and parsed_output:
-                logging.info("✅ Phân tích thành công bằng NTC-Templates.")
-                return parsed_output
-            # Nếu trả về string, nó sẽ được xử lý ở dưới như là raw_output
-            raw_output = str(parsed_output)
+    strategies = [('custom', parse_custom), ('ntc', lambda: parse_ntc_template(raw_output, device_type, command))]
+    if not prefer_custom:
+        strategies.reverse()
+    for source, parse in strategies:
+        parsed_output = parse()
+        if parsed_output:
+            logging.info(f"✅ Phân tích thành công bằng {'template tùy chỉnh' if source == 'custom' else 'NTC-Templates'}.")
+            return parsed_output, source
+    logging.warning("⚠️ Không có template NTC hay template tùy chỉnh khớp với output. Trả về output thô.")
+    return raw_output, 'raw'
 
-        except ReadTimeout:
-            # ReadTimeout thường xảy ra khi use_textfsm=True nhưng không có template
-            logging.warning("ReadTimeout khi dùng NTC, có thể do không có template. Lấy output thô.")
-            raw_output = conn.send_command(command, use_textfsm=False)
+def smart_send_on_connection(conn, device_type, command, prefer_custom=False, read_timeout=120):
+    """
+    Gửi lệnh trên một kết nối Netmiko đã mở (dùng lại được cho nhiều lệnh trong cùng phiên SSH).
+    Lệnh chỉ được gửi một lần; các cách phân tích được thử trên output thô đã nhận (xem parse_with_fallback).
+    - Nếu prefer_custom=True: Ưu tiên 1 là template tùy chỉnh, 2 là NTC, 3 là raw.
+    - Nếu prefer_custom=False (mặc định): Ưu tiên 1 là NTC, 2 là tùy chỉnh, 3 là raw.
+    """
+    raw_output = conn.send_command(command, use_textfsm=False, read_timeout=read_timeout)
+    return parse_with_fallback(raw_output, device_type, command, prefer_custom=prefer_custom)[0]
 
-        # 2. Nếu NTC không thành công, thử template tùy chỉnh
-        template_path = get_custom_template(device['device_type'], command)
-        if template_path:
-            logging.warning(f"⚠️ NTC template không có hoặc không khớp, dùng template tùy chỉnh: {template_path}")
-            return parse_custom_template(raw_output, template_path)
-        
-        # 3. Nếu cả hai đều không được, trả về output thô
-        logging.warning("⚠️ Không tìm thấy template NTC hay template tùy chỉnh. Trả về output thô.")
-        return raw_output
+def smart_send_command(device, command, prefer_custom=False):
+    """
+    Mở kết nối tới thiết bị và gửi một lệnh (xem smart_send_on_connection).
+    """
+    with ConnectHandler(**device) as conn:
+        return smart_send_on_connection(conn, device['device_type'], command, prefer_custom)
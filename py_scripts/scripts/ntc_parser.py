@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import tempfile
+import threading
+from textfsm import clitable
+from netmiko.utilities import get_template_dir, get_structured_data as netmiko_get_structured_data
+from textfsm_registry import default_registry
+
+# Thư mục lưu bản index ntc-templates đã phân tích (JSON, chỉ gồm các chuỗi) giữa các lần chạy
+DEFAULT_INDEX_CACHE_DIR = os.path.join(tempfile.gettempdir(), "ntc_index_cache")
+# Tăng khi thay đổi cấu trúc dữ liệu được lưu để bỏ qua cache cũ
+INDEX_CACHE_VERSION = 2
+
+
+class NtcTemplateIndex:
+    """
+    Index ntc-templates (file 'index' dạng CliTable) được phân tích một lần và lưu ra đĩa dạng JSON
+    (không dùng pickle: thư mục tạm dùng chung, người khác có thể đặt file vào đó).
+    Việc tìm template theo (platform, command) được ghi nhớ; regex của index chỉ biên dịch khi cần.
+    Khớp giống CliTable: dòng đầu tiên có Platform và Command khớp (re.match) được chọn.
+    """
+
+    def __init__(self, template_dir=None, cache_dir=DEFAULT_INDEX_CACHE_DIR):
+        self.template_dir = template_dir or get_template_dir()
+        self.index_file = os.path.join(self.template_dir, "index")
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._rows = None       # list (templates, platform_regex, command_regex) theo thứ tự trong index
+        self._patterns = {}     # chuỗi regex -> regex đã biên dịch
+        self._platform_rows = {}  # platform -> các dòng có Platform khớp
+        self._lookups = {}      # (platform, command) -> tên template (chuỗi 'a.textfsm[:b.textfsm]') hoặc None
+
+    def _cache_path(self):
+        safe_name = re.sub(r'[^A-Za-z0-9]+', '_', os.path.abspath(self.index_file)).strip('_')
+        return os.path.join(self.cache_dir, f"{safe_name}-v{INDEX_CACHE_VERSION}.json")
+
+    def _load_rows(self):
+        stat = os.stat(self.index_file)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cache_path = self._cache_path()
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+            rows = [tuple(row) for row in cached['rows']]
+            if tuple(cached['signature']) == signature and all(
+                len(row) == 3 and all(isinstance(value, str) for value in row) for row in rows
+            ):
+                return rows
+        except Exception:
+            # Chưa có cache hoặc cache hỏng: phân tích lại index
+            pass
+
+        # Dùng chính CliTable để đọc index (mở rộng cú pháp 'sh[[ow]]'), chỉ lưu lại các chuỗi regex
+        index = clitable.CliTable("index", self.template_dir).index.index
+        rows = [(row['Template'], row['Platform'], row['Command']) for row in index]
+
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'signature': signature, 'rows': rows}, file)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Không ghi được cache (thư mục chỉ đọc...) thì vẫn dùng index vừa đọc
+            pass
+        return rows
+
+    def _pattern(self, pattern):
+        compiled = self._patterns.get(pattern)
+        if compiled is None:
+            compiled = self._patterns[pattern] = re.compile(pattern)
+        return compiled
+
+    def find(self, platform, command):
+        """Trả về tên file template (có thể nhiều file cách nhau bởi ':') cho platform/command, hoặc None."""
+        key = (platform, command)
+        with self._lock:
+            if key in self._lookups:
+                return self._lookups[key]
+            if self._rows is None:
+                self._rows = self._load_rows()
+            rows = self._platform_rows.get(platform)
+            if rows is None:
+                rows = self._platform_rows[platform] = [
+                    row for row in self._rows if not row[1] or self._pattern(row[1]).match(platform)
+                ]
+            templates = next(
+                (row[0] for row in rows if not row[2] or self._pattern(row[2]).match(command)), None
+            )
+            self._lookups[key] = templates
+            return templates
+
+    def template_path(self, platform, command):
+        """Đường dẫn file template cho platform/command; None nếu không có hoặc dòng index dùng nhiều template."""
+        templates = self.find(platform, command)
+        if templates is None and 'cisco_xe' in platform:
+            templates = self.find('cisco_ios', command)
+        if templates is None or ':' in templates:
+            return None
+        return os.path.join(self.template_dir, templates)
+
+    def parse(self, raw_output, platform, command):
+        """
+        Phân tích output như netmiko.utilities.get_structured_data: trả về list dictionary (tên cột viết thường),
+        hoặc chính raw_output nếu không có template hay template không khớp dữ liệu nào.
+        """
+        templates = self.find(platform, command)
+        if templates is None:
+            return raw_output
+        if ':' in templates:
+            # Dòng index dùng nhiều template (gộp bảng theo Key): để CliTable của Netmiko xử lý
+            return netmiko_get_structured_data(raw_output, platform=platform, command=command)
+
+        template_path = os.path.join(self.template_dir, templates)
+        parsed_output = [
+            {name.lower(): value for name, value in row.items()}
+            for row in default_registry.parse(template_path, raw_output)
+        ]
+        return parsed_output or raw_output
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def default_index():
+    """Index ntc-templates dùng chung trong tiến trình (khởi tạo khi dùng lần đầu)."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = NtcTemplateIndex()
+        return _default_index
+
+
+def get_structured_data(raw_output, platform=None, command=None):
+    """
+    Thay thế netmiko.utilities.get_structured_data với index và template được cache.
+    Giống Netmiko: platform 'cisco_xe' không có kết quả thì thử lại với 'cisco_ios'.
+    """
+    if platform is None or command is None:
+        raise ValueError("Either 'platform/command' or 'template' must be specified.")
+    index = default_index()
+    parsed_output = index.parse(raw_output, platform, command)
+    if 'cisco_xe' in platform and not isinstance(parsed_output, list):
+        parsed_output = index.parse(raw_output, 'cisco_ios', command)
+    return parsed_output
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+from urllib.parse import quote, unquote
+from contextlib import contextmanager
+import numpy as np
+from textfsm_registry import SCRIPT_DIR
+
+DEFAULT_OPTICS_DIR = os.path.join(SCRIPT_DIR, "output", "optics_store")
+# Một bản ghi công suất quang: thời điểm (epoch giây), Rx/Tx (dBm), nhiệt độ (°C); giá trị thiếu là NaN
+READING_DTYPE = np.dtype([('ts', '<f8'), ('rx', '<f4'), ('tx', '<f4'), ('temp', '<f4')])
+METRICS = ('rx', 'tx', 'temp')
+# Tầng lưu trữ: 'raw' giữ từng lần đo, 'hourly' giữ trung bình theo giờ sau khi compact
+RAW_TIER = 'raw'
+HOURLY_TIER = 'hourly'
+DEFAULT_RAW_RETENTION = 14 * 86400
+DEFAULT_HOURLY_RETENTION = 400 * 86400
+
+# Tên trường của các template optics (juniper/cisco/nokia_show_optical) -> trường chuẩn
+OPTICS_FIELD_ALIASES = {
+    'port': ('interface',),
+    'rx': ('rx_power_dbm', 'rx_optical_power_avg_dbm'),
+    'tx': ('tx_power_dbm', 'tx_output_power_dbm'),
+    'temp': ('temperature_c', 'temperature'),
+}
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def normalize_optics_rows(parsed_output):
+    """Chuẩn hóa kết quả TextFSM optics (tên trường khác nhau theo vendor) thành list {'port', 'rx', 'tx', 'temp'}."""
+    readings = []
+    for row in parsed_output or []:
+        row = {key.lower(): value for key, value in row.items()}
+        reading = {}
+        for field, aliases in OPTICS_FIELD_ALIASES.items():
+            reading[field] = next((row[alias] for alias in aliases if row.get(alias) not in (None, '')), None)
+        if not reading['port']:
+            continue
+        readings.append({'port': reading['port'], **{metric: to_float(reading[metric]) for metric in METRICS}})
+    return readings
+
+
+class FleetSeries:
+    """
+    Dữ liệu của nhiều series (thiết bị, cổng) nối liền trong các mảng numpy, sắp theo series rồi theo thời gian.
+    Series i nằm trong đoạn [bounds[i], bounds[i + 1]) của ts/rx/tx/temp.
+    """
+
+    # Khóa sắp xếp chung cho mọi series: series * SERIES_SPAN + ts (ts epoch giây < 1e10; float64 còn chính xác
+    # dưới 1 giây tới khoảng 100.000 series)
+    SERIES_SPAN = 1e10
+
+    def __init__(self, names, bounds, readings):
+        self.names = names
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.ts = readings['ts']
+        self.values = {metric: readings[metric].astype(np.float64) for metric in METRICS}
+        series_ids = np.repeat(np.arange(len(names), dtype=np.float64), np.diff(self.bounds))
+        self._keys = series_ids * self.SERIES_SPAN + self.ts
+
+    def __len__(self):
+        return len(self.names)
+
+    def window_means(self, metric, start, end):
+        """
+        Trung bình (bỏ NaN) của metric trong khoảng thời gian [start, end) cho từng series, tính một lần cho cả fleet
+        bằng tổng tích lũy. start/end là số hoặc mảng theo series. Series không có dữ liệu trong khoảng trả NaN.
+        """
+        values = self.values[metric]
+        valid = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        first = self._search(start)
+        last = self._search(end)
+        count = counts[last] - counts[first]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, (sums[last] - sums[first]) / np.maximum(count, 1), np.nan)
+
+    def _search(self, moments):
+        """Vị trí (trong mảng nối liền) của bản ghi đầu tiên có ts >= moment, cho từng series (một lần searchsorted)."""
+        moments = np.clip(np.broadcast_to(np.asarray(moments, dtype=np.float64), (len(self),)), 0, self.SERIES_SPAN - 1)
+        return np.searchsorted(self._keys, np.arange(len(self)) * self.SERIES_SPAN + moments, side='left')
+
+    def latest(self):
+        """Chỉ số bản ghi mới nhất của từng series (-1 nếu series rỗng)."""
+        return np.where(self.bounds[1:] > self.bounds[:-1], self.bounds[1:] - 1, -1)
+
+
+class OpticsStore:
+    """
+    Kho time-series công suất quang: mỗi (thiết bị, cổng) một file nhị phân chỉ ghi thêm gồm các bản ghi
+    READING_DTYPE (20 byte), đọc lại bằng numpy không cần phân tích.
+    - '<root>/raw/<thiết bị>/<cổng>.bin': từng lần đo.
+    - '<root>/hourly/<thiết bị>/<cổng>.bin': trung bình theo giờ của dữ liệu raw đã quá hạn (compact).
+    Ghi thêm và compact giữ khóa file '<root>/.lock'.
+    """
+
+    def __init__(self, root=DEFAULT_OPTICS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, tier, device, port):
+        # Tên file mã hóa URL để giữ nguyên tên cổng có '/' (xe-0/0/1, 1/1/1)
+        return os.path.join(self.root, tier, quote(device, safe=''), quote(port, safe='') + '.bin')
+
+    def append(self, device, readings, timestamp=None):
+        """Ghi thêm các lần đo (list {'port', 'rx', 'tx', 'temp'}) của một thiết bị tại thời điểm timestamp."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.locked():
+            for reading in readings:
+                record = np.array([(timestamp, reading['rx'], reading['tx'], reading['temp'])], dtype=READING_DTYPE)
+                path = self._path(RAW_TIER, device, reading['port'])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'ab') as file:
+                    file.write(record.tobytes())
+        return len(readings)
+
+    def series(self):
+        """Danh sách (thiết bị, cổng) có dữ liệu ở bất kỳ tầng nào."""
+        names = set()
+        for tier in (RAW_TIER, HOURLY_TIER):
+            tier_dir = os.path.join(self.root, tier)
+            if not os.path.isdir(tier_dir):
+                continue
+            for device in os.listdir(tier_dir):
+                for name in os.listdir(os.path.join(tier_dir, device)):
+                    if name.endswith('.bin'):
+                        names.add((unquote(device), unquote(name[:-4])))
+        return sorted(names)
+
+    def _read(self, tier, device, port):
+        path = self._path(tier, device, port)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=READING_DTYPE)
+        # Bỏ phần cuối không đủ một bản ghi (lần ghi bị ngắt giữa chừng)
+        count = os.path.getsize(path) // READING_DTYPE.itemsize
+        return np.fromfile(path, dtype=READING_DTYPE, count=count)
+
+    def load(self, since=None, devices=None):
+        """Đọc dữ liệu (hourly rồi raw, sắp theo thời gian) của các series từ thời điểm since thành FleetSeries."""
+        names, chunks, bounds = [], [], [0]
+        for device, port in self.series():
+            if devices and device not in devices:
+                continue
+            readings = np.concatenate((self._read(HOURLY_TIER, device, port), self._read(RAW_TIER, device, port)))
+            if since is not None:
+                readings = readings[readings['ts'] >= since]
+            if len(readings) > 1 and (np.diff(readings['ts']) < 0).any():
+                # Dữ liệu ghi thêm vốn đã theo thời gian; chỉ sắp lại khi đồng hồ lệch hoặc vừa compact
+                readings = readings[np.argsort(readings['ts'], kind='stable')]
+            names.append((device, port))
+            chunks.append(readings)
+            bounds.append(bounds[-1] + len(readings))
+        readings = np.concatenate(chunks) if chunks else np.empty(0, dtype=READING_DTYPE)
+        return FleetSeries(names, bounds, readings)
+
+    def compact(self, raw_retention=DEFAULT_RAW_RETENTION, hourly_retention=DEFAULT_HOURLY_RETENTION, now=None):
+        """
+        Gộp dữ liệu raw cũ hơn raw_retention thành trung bình theo giờ (tầng hourly) và xóa dữ liệu hourly
+        cũ hơn hourly_retention. Returns: số bản ghi raw đã gộp.
+        """
+        now = time.time() if now is None else now
+        raw_cutoff, hourly_cutoff = now - raw_retention, now - hourly_retention
+        compacted = 0
+        with self.locked():
+            for device, port in self.series():
+                raw = self._read(RAW_TIER, device, port)
+                old = raw[raw['ts'] < raw_cutoff]
+                hourly = self._read(HOURLY_TIER, device, port)
+                if len(old):
+                    hours = np.floor(old['ts'] / 3600) * 3600
+                    unique_hours, group = np.unique(hours, return_inverse=True)
+                    summary = np.zeros(len(unique_hours), dtype=READING_DTYPE)
+                    summary['ts'] = unique_hours
+                    for metric in METRICS:
+                        values = old[metric].astype(np.float64)
+                        valid = ~np.isnan(values)
+                        sums = np.bincount(group, weights=np.where(valid, values, 0.0), minlength=len(unique_hours))
+                        counts = np.bincount(group, weights=valid, minlength=len(unique_hours))
+                        with np.errstate(invalid='ignore', divide='ignore'):
+                            summary[metric] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+                    hourly = np.concatenate((hourly, summary))
+                    compacted += len(old)
+                hourly = hourly[hourly['ts'] >= hourly_cutoff]
+                self._rewrite(HOURLY_TIER, device, port, hourly)
+                if len(old):
+                    self._rewrite(RAW_TIER, device, port, raw[raw['ts'] >= raw_cutoff])
+        return compacted
+
+    def _rewrite(self, tier, device, port, readings):
+        path = self._path(tier, device, port)
+        if not len(readings):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        readings.tofile(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def evaluate_thresholds(fleet, rx_min=None, tx_min=None, temp_max=None, max_age=None, now=None):
+    """
+    So lần đo mới nhất của mọi cổng với ngưỡng (tính vector trên cả fleet).
+
+    Returns:
+        list: {'device', 'port', 'ts', 'rx', 'tx', 'temp', 'violations'} cho các cổng vượt ngưỡng.
+    """
+    now = time.time() if now is None else now
+    latest = fleet.latest()
+    present = latest >= 0
+    if not present.any():
+        return []
+    index = np.where(present, latest, 0)
+    ts = np.where(present, fleet.ts[index], np.nan)
+    current = {metric: np.where(present, fleet.values[metric][index], np.nan) for metric in METRICS}
+
+    checks = []
+    if rx_min is not None:
+        checks.append(('rx_low', current['rx'] < rx_min))
+    if tx_min is not None:
+        checks.append(('tx_low', current['tx'] < tx_min))
+    if temp_max is not None:
+        checks.append(('temp_high', current['temp'] > temp_max))
+    fresh = present if max_age is None else present & (now - ts <= max_age)
+
+    results = []
+    flagged = np.zeros(len(fleet), dtype=bool)
+    for _, mask in checks:
+        flagged |= mask
+    for series_index in np.nonzero(flagged & fresh)[0]:
+        device, port = fleet.names[series_index]
+        results.append({
+            'device': device,
+            'port': port,
+            'ts': float(ts[series_index]),
+            **{metric: rounded(current[metric][series_index]) for metric in METRICS},
+            'violations': [name for name, mask in checks if mask[series_index]],
+        })
+    return results
+
+
+def evaluate_trend(fleet, since, metric='rx', drop=2.0, baseline_window=86400, recent_window=86400, now=None):
+    """
+    Tìm các cổng có metric giảm hơn `drop` (dB) kể từ since: so trung bình trong baseline_window đầu tiên
+    (tính từ since) với trung bình trong recent_window gần nhất, cho cả fleet một lần.
+
+    Returns:
+        list: {'device', 'port', 'baseline', 'current', 'delta'} sắp theo mức giảm lớn nhất.
+    """
+    now = time.time() if now is None else now
+    baseline = fleet.window_means(metric, since, since + baseline_window)
+    current = fleet.window_means(metric, max(since, now - recent_window), np.inf)
+    with np.errstate(invalid='ignore'):
+        delta = current - baseline
+        degraded = np.nonzero(delta < -abs(drop))[0]
+    degraded = degraded[np.argsort(delta[degraded], kind='stable')]
+    return [
+        {
+            'device': fleet.names[index][0],
+            'port': fleet.names[index][1],
+            'baseline': rounded(baseline[index]),
+            'current': rounded(current[index]),
+            'delta': rounded(delta[index]),
+        }
+        for index in degraded
+    ]
+
+
+def rounded(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def parse_duration(value):
+    """'7d', '12h', '30m', '3600' -> số giây."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    value = value.strip().lower()
+    try:
+        if value and value[-1] in units:
+            return float(value[:-1]) * units[value[-1]]
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Khoảng thời gian không hợp lệ: '{value}' (ví dụ: 7d, 12h, 30m).")
+
+
+def ingest_ssh_output(store, device, data):
+    """
+    Ghi kết quả optics từ output JSON của ssh.py/fleet_collector: một kết quả {'parsed_output'},
+    kết quả nhiều lệnh {'results': {...}} hoặc trực tiếp list bản ghi.
+    """
+    if isinstance(data, dict) and 'results' in data and isinstance(data['results'], dict):
+        rows = [row for result in data['results'].values() if isinstance(result.get('parsed_output'), list) for row in result['parsed_output']]
+    elif isinstance(data, dict):
+        rows = data.get('parsed_output') if isinstance(data.get('parsed_output'), list) else []
+    else:
+        rows = data
+    return store.append(device, normalize_optics_rows(rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kho time-series công suất quang (Rx/Tx/nhiệt độ) theo thiết bị và cổng, đánh giá ngưỡng và xu hướng trên cả fleet.")
+    parser.add_argument('--store', type=str, default=DEFAULT_OPTICS_DIR, help=f'Thư mục kho dữ liệu (mặc định: {DEFAULT_OPTICS_DIR}).')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Ghi kết quả optics (JSON của ssh.py --use-textfsm) vào kho.')
+    ingest_parser.add_argument('--device', type=str, required=True, help='Tên router.')
+    ingest_parser.add_argument('--json', type=str, default='-', help="File JSON kết quả, '-' để đọc từ stdin (mặc định).")
+
+    compact_parser = subparsers.add_parser('compact', help='Gộp dữ liệu cũ theo giờ và xóa dữ liệu quá hạn.')
+    compact_parser.add_argument('--raw-retention', type=parse_duration, default=DEFAULT_RAW_RETENTION, help='Giữ từng lần đo trong khoảng này (mặc định: 14d).')
+    compact_parser.add_argument('--hourly-retention', type=parse_duration, default=DEFAULT_HOURLY_RETENTION, help='Giữ trung bình theo giờ trong khoảng này (mặc định: 400d).')
+
+    threshold_parser = subparsers.add_parser('thresholds', help='Các cổng có lần đo mới nhất vượt ngưỡng.')
+    threshold_parser.add_argument('--rx-min', type=float, default=-20.0, help='Ngưỡng Rx thấp (dBm, mặc định: -20).')
+    threshold_parser.add_argument('--tx-min', type=float, default=None, help='Ngưỡng Tx thấp (dBm).')
+    threshold_parser.add_argument('--temp-max', type=float, default=None, help='Ngưỡng nhiệt độ cao (°C).')
+    threshold_parser.add_argument('--max-age', type=parse_duration, default=None, help='Bỏ qua cổng có lần đo mới nhất cũ hơn khoảng này.')
+    threshold_parser.add_argument('--device', action='append', default=None, help='Chỉ xét các router này (lặp lại được).')
+
+    trend_parser = subparsers.add_parser('trend', help='Các cổng có công suất giảm quá mức trong một khoảng thời gian.')
+    trend_parser.add_argument('--since', type=parse_duration, default=7 * 86400, help='Khoảng thời gian xét, tính lùi từ hiện tại (mặc định: 7d).')
+    trend_parser.add_argument('--metric', choices=('rx', 'tx'), default='rx', help='Giá trị xét (mặc định: rx).')
+    trend_parser.add_argument('--drop', type=float, default=2.0, help='Mức giảm tối thiểu (dB, mặc định: 2).')
+    trend_parser.add_argument('--window', type=parse_duration, default=86400, help='Độ dài cửa sổ lấy trung bình ở đầu và cuối khoảng (mặc định: 1d).')
+    trend_parser.add_argument('--device', action='append', default=None, help='Chỉ xét các router này (lặp lại được).')
+
+    args = parser.parse_args()
+    store = OpticsStore(args.store)
+
+    if args.action == 'ingest':
+        try:
+            if args.json == '-':
+                data = json.load(sys.stdin)
+            else:
+                with open(args.json, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(json.dumps({'success': False, 'error': f"Không đọc được JSON kết quả: {e}"}, ensure_ascii=False))
+            sys.exit(1)
+        count = ingest_ssh_output(store, args.device, data)
+        print(json.dumps({'success': True, 'device': args.device, 'ports': count, 'error': None}, ensure_ascii=False))
+
+    elif args.action == 'compact':
+        compacted = store.compact(args.raw_retention, args.hourly_retention)
+        print(json.dumps({'success': True, 'compacted': compacted, 'error': None}, ensure_ascii=False))
+
+    elif args.action == 'thresholds':
+        fleet = store.load(since=time.time() - args.max_age if args.max_age else None, devices=args.device)
+        results = evaluate_thresholds(fleet, args.rx_min, args.tx_min, args.temp_max, args.max_age)
+        print(json.dumps({'success': True, 'ports': len(fleet), 'results': results, 'error': None}, ensure_ascii=False, indent=2))
+
+    else:
+        since = time.time() - args.since
+        fleet = store.load(since=since, devices=args.device)
+        results = evaluate_trend(fleet, since, args.metric, args.drop, args.window, args.window)
+        print(json.dumps({'success': True, 'ports': len(fleet), 'results': results, 'error': None}, ensure_ascii=False, indent=2))
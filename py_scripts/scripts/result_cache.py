@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager, ExitStack
+
+# Thư mục cache kết quả lệnh mặc định (dùng chung giữa các lần gọi ssh.py/ssh2.py từ n8n)
+DEFAULT_RESULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "ssh_result_cache")
+
+# Thời gian sống (giây) của kết quả theo loại lệnh, dòng đầu tiên khớp (re.search trên lệnh viết thường) được dùng.
+# Số liệu thay đổi nhanh (CPU, bộ nhớ) sống ngắn; thông tin phần cứng/phiên bản sống lâu.
+DEFAULT_TTL_RULES = (
+    (r'\b(cpu|proc(esses)?|mem(ory)?|clock|uptime)\b', 15),
+    (r'\b(alarms?|facility-alarm|log(ging)?)\b', 30),
+    (r'\b(interfaces?|optics?|transceiver|diagnostics|port|mda)\b', 60),
+    (r'\b(version|inventory|chassis|hardware|module|license|serial)\b', 3600),
+)
+DEFAULT_TTL = 60
+
+
+def ttl_for_command(command, rules=DEFAULT_TTL_RULES, default=DEFAULT_TTL):
+    """Thời gian sống (giây) của kết quả một câu lệnh theo bảng rules."""
+    command = command.lower()
+    for pattern, ttl in rules:
+        if re.search(pattern, command):
+            return ttl
+    return default
+
+
+class ResultCache:
+    """
+    Cache kết quả lệnh trên đĩa (mỗi kết quả một file JSON), key theo (host, port, device_type, tài khoản, lệnh, template,
+    cách parse): tài khoản khác hoặc sai mật khẩu không dùng được kết quả của tài khoản đã xác thực.
+    - Kết quả chỉ được dùng khi tuổi <= TTL của lệnh và <= max_age (nếu có); max_age=0 luôn chạy lại lệnh.
+    - locked() giữ khóa file (flock) theo key: các tiến trình/thread cùng hỏi một câu sẽ chờ lần chạy đầu tiên
+      rồi dùng lại kết quả của nó thay vì mở thêm phiên SSH (single-flight).
+    Chỉ kết quả thành công, không có lỗi mới được lưu.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_RESULT_CACHE_DIR, max_age=None, ttl_rules=DEFAULT_TTL_RULES, default_ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.ttl_rules = ttl_rules
+        self.default_ttl = default_ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(host, spec, parser_variant):
+        """
+        Args:
+            host (dict): Thiết bị với 'hostname', 'device_type', 'port', 'username', 'password'.
+            spec (dict): Câu lệnh {'command', 'textfsm_template'}.
+            parser_variant (str): Cách phân tích output (ví dụ: 'raw', 'textfsm', 'wrapper:custom'), vì cùng lệnh
+                                  nhưng khác cách parse cho kết quả khác.
+        """
+        template = spec.get('textfsm_template')
+        if template:
+            # Đổi template thì key đổi theo
+            try:
+                template = f"{os.path.abspath(template)}@{os.stat(template).st_mtime_ns}"
+            except OSError:
+                pass
+        # Chỉ đưa digest của mật khẩu vào key (giống khóa pool của ssh_pool_daemon)
+        password_digest = hashlib.sha256(str(host['password']).encode('utf-8')).hexdigest()[:16]
+        raw_key = json.dumps([host['hostname'], int(host.get('port', 22)), host['device_type'], host['username'], password_digest,
+                              spec['command'].strip(), template, parser_variant])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def ttl_for(self, command):
+        ttl = ttl_for_command(command, self.ttl_rules, self.default_ttl)
+        return ttl if self.max_age is None else min(ttl, self.max_age)
+
+    def get(self, key, command, fresh_since=None):
+        """
+        Trả về (kết quả, tuổi tính bằng giây) nếu còn hạn, ngược lại None.
+        Kết quả được lưu sau thời điểm fresh_since (time.time()) luôn được dùng, kể cả khi max_age=0.
+        """
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - entry['stored_at']
+        if fresh_since is not None and entry['stored_at'] >= fresh_since:
+            return entry['result'], age
+        if age < 0 or age > self.ttl_for(command):
+            return None
+        return entry['result'], age
+
+    def put(self, key, result):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'stored_at': time.time(), 'result': result}, file, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @contextmanager
+    def locked(self, keys):
+        """Giữ khóa ghi cho các key (theo thứ tự cố định để tránh deadlock) trong suốt khối with."""
+        with ExitStack() as stack:
+            for key in sorted(set(keys)):
+                lock_file = stack.enter_context(open(self._path(key, '.lock'), 'a'))
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                stack.callback(fcntl.flock, lock_file, fcntl.LOCK_UN)
+            yield
+
+    def prune(self, max_ttl=None):
+        """Xóa các kết quả đã quá TTL dài nhất (mặc định là TTL lớn nhất trong bảng)."""
+        max_ttl = max_ttl or max([ttl for _, ttl in self.ttl_rules] + [self.default_ttl])
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.lock'):
+                # File khóa có thể đang được tiến trình khác giữ; file rỗng nên không cần dọn
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.stat(path).st_mtime > max_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def run_commands_cached(cache, host, commands, parser_variant, run_commands):
+    """
+    Chạy các câu lệnh trên một thiết bị qua cache: lệnh còn kết quả trong cache không chạy lại,
+    các lệnh còn lại chạy chung một phiên SSH qua run_commands.
+
+    Args:
+        cache (ResultCache): Cache kết quả.
+        host (dict): Thiết bị ('hostname', 'device_type', 'port', 'username', 'password').
+        commands (list): Danh sách {'key', 'command', 'textfsm_template'}.
+        parser_variant (str): Xem ResultCache.key.
+        run_commands (callable): run_commands(specs) -> {'success', 'results', 'error'} (định dạng ssh_run_commands).
+
+    Returns:
+        dict: {'success', 'results', 'error'}; kết quả lấy từ cache có thêm 'cache_age' (giây).
+    """
+    keys = {spec['key']: cache.key(host, spec, parser_variant) for spec in commands}
+    results = {}
+
+    def lookup(specs, fresh_since=None):
+        missing = []
+        for spec in specs:
+            hit = cache.get(keys[spec['key']], spec['command'], fresh_since)
+            if hit:
+                results[spec['key']] = {**hit[0], 'cache_age': round(hit[1], 1)}
+            else:
+                missing.append(spec)
+        return missing
+
+    error_message = None
+    requested_at = time.time()
+    missing = lookup(commands)
+    if missing:
+        with cache.locked([keys[spec['key']] for spec in missing]):
+            # Trong lúc chờ khóa, tiến trình khác có thể đã chạy xong cùng câu lệnh
+            missing = lookup(missing, fresh_since=requested_at)
+            if missing:
+                batch_result = run_commands(missing)
+                error_message = batch_result['error']
+                for spec in missing:
+                    result = batch_result['results'].get(spec['key'])
+                    if result is None:
+                        continue
+                    results[spec['key']] = result
+                    if result['success'] and not result['error']:
+                        cache.put(keys[spec['key']], result)
+
+    ordered = {spec['key']: results[spec['key']] for spec in commands if spec['key'] in results}
+    return {
+        'success': error_message is None and len(ordered) == len(commands) and all(result['success'] for result in ordered.values()),
+        'results': ordered,
+        'error': error_message
+    }
+
+
+def add_cache_arguments(parser):
+    """Thêm các tham số dòng lệnh của cache kết quả."""
+    parser.add_argument('--cache', action='store_true', help='Dùng lại kết quả lệnh còn hạn trong cache (TTL theo loại lệnh) và gộp các request giống nhau đang chạy.')
+    parser.add_argument('--max-age', type=int, default=None, help='Chỉ dùng kết quả cache có tuổi không quá số giây này (bật --cache; 0 = luôn chạy lại lệnh và cập nhật cache).')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_RESULT_CACHE_DIR, help=f'Thư mục cache kết quả (mặc định: {DEFAULT_RESULT_CACHE_DIR}).')
+
+
+def cache_from_args(args):
+    """Tạo ResultCache theo tham số dòng lệnh, hoặc None nếu không bật cache."""
+    if not args.cache and args.max_age is None:
+        return None
+    cache = ResultCache(args.cache_dir, max_age=args.max_age)
+    cache.prune()
+    return cache
@@ -5,7 +5,16 @@ import sys
 import json
 import time
 import argparse
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd # Thư viện mới để làm việc với Excel
+import openpyxl
+from geo_export import GeoExporter, add_export_arguments, folder_properties
+from row_validation import ROUTE_COLUMNS, validate_table, format_report, new_report, merge_report
+from excel_stream import ExcelRowWriter, iter_excel_batches
+from excel_cache import ExcelSheetCache, DEFAULT_CACHE_DIR
 
 def get_ors_route(api_key, start_coords, end_coords, profile="driving-car"):
     """
@@ -82,7 +91,7 @@ def get_ors_route(api_key, start_coords, end_coords, profile="driving-car"):
         sys.stderr.write(f"ERROR: Lỗi không xác định khi xử lý phản hồi API cho {start_coords} -> {end_coords}: {e}\n")
         return None
 
-def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động"):
+def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động", merge_rings=False):
     """
     Tạo một file KML duy nhất chứa nhiều tuyến đường.
     Args:
@@ -99,6 +108,7 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
                                 - 'duration_minutes': Thời gian tính bằng phút (tùy chọn, để thêm vào mô tả)
         main_folder_name (str): Tên thư mục chính trong KML (cấp 1).
         doc_name (str): Tên của Document trong KML.
+        merge_rings (bool): Gộp các tuyến cùng thư mục, màu và độ rộng thành một placemark MultiGeometry cho mỗi ring.
     Returns:
         str: Chuỗi nội dung KML hoặc None nếu có lỗi.
     """
@@ -113,6 +123,8 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
     main_folder_path = (main_folder_name,)
     main_folder_object = kml.newfolder(name=main_folder_name)
     created_folders[main_folder_path] = main_folder_object
+    # Khi gộp ring: key là (đường dẫn thư mục, màu, độ rộng), value chứa thư mục đích và danh sách tuyến
+    rings = {}
 
     for i, route_info in enumerate(all_routes_data):
         route_coords = route_info.get('Coords')
@@ -161,6 +173,13 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
                     created_folders[level3_path] = level2_folder_object.newfolder(name=third_folder_name)
                 current_folder = created_folders[level3_path]
 
+        if merge_rings:
+            ring_key = (level1_path, second_folder_name or None, third_folder_name or None, color, width)
+            if ring_key not in rings:
+                rings[ring_key] = {'folder': current_folder, 'routes': []}
+            rings[ring_key]['routes'].append((line_name, route_coords, route_info.get('distance_km')))
+            continue
+
         linestring_placemark = current_folder.newlinestring(name=line_name, description=full_description)
         linestring_placemark.coords = route_coords
         linestring_placemark.altitudemode = simplekml.AltitudeMode.clamptoground
@@ -169,216 +188,538 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
         linestring_placemark.style.linestyle.color = color
         linestring_placemark.style.linestyle.width = width
 
+    for (level1_path, second_folder_name, third_folder_name, color, width), ring in rings.items():
+        # Tên ring là tên thư mục sâu nhất chứa các tuyến
+        ring_name = third_folder_name or second_folder_name or level1_path[-1]
+        known_distances = [distance for _, _, distance in ring['routes'] if isinstance(distance, (int, float))]
+        total_distance_km = sum(known_distances)
+
+        description_lines = []
+        for j, (line_name, _, distance) in enumerate(ring['routes']):
+            distance_text = f"{distance:.2f} km" if isinstance(distance, (int, float)) else "N/A"
+            description_lines.append(f"{j+1}. {line_name}: {distance_text}")
+        description_lines.append(f"Tổng khoảng cách: {total_distance_km:.2f} km")
+
+        multigeometry = ring['folder'].newmultigeometry(name=ring_name, description="\n".join(description_lines))
+        for line_name, route_coords, _ in ring['routes']:
+            linestring = multigeometry.newlinestring(coords=route_coords)
+            linestring.altitudemode = simplekml.AltitudeMode.clamptoground
+            linestring.extrude = 0
+
+        multigeometry.extendeddata.newdata(name="SegmentCount", value=len(ring['routes']))
+        multigeometry.extendeddata.newdata(name="TotalDistanceKm", value=round(total_distance_km, 3))
+        for j, (line_name, _, distance) in enumerate(ring['routes']):
+            distance_text = f"{distance:.2f} km" if isinstance(distance, (int, float)) else "N/A"
+            multigeometry.extendeddata.newdata(name=f"Segment{j+1}", value=f"{line_name} ({distance_text})")
+
+        multigeometry.style.linestyle.color = color
+        multigeometry.style.linestyle.width = width
+
     try:
         return kml.kml() # Trả về chuỗi KML
     except Exception as e:
         sys.stderr.write(f"ERROR: Lỗi khi tạo chuỗi KML: {e}\n")
         return None
 
+# Các cột thuộc tính cần cho KML/xuất file, lấy từ bảng đã kiểm tra
+JOB_ATTRIBUTE_COLUMNS = ['LineName', 'Description', 'Color', 'Width', 'FolderName', 'SecondFolderName', 'ThirdFolderName']
+JOB_COORD_COLUMNS = ['Longitude1', 'Latitude1', 'Longitude2', 'Latitude2']
+
+def build_route_jobs(clean_df):
+    """
+    Tạo bảng công việc gọn từ DataFrame đã kiểm tra (row_validation), tránh thao tác pandas theo từng hàng.
+    Returns:
+        dict: 'index' (mảng index của df gốc), 'coords' (mảng float64 n x 4: lon1, lat1, lon2, lat2)
+              và 'attrs' (list các dictionary thuộc tính cho KML, cùng thứ tự).
+    """
+    return {
+        'index': clean_df.index.to_numpy(),
+        'coords': clean_df[JOB_COORD_COLUMNS].to_numpy(dtype='float64'),
+        'attrs': clean_df[JOB_ATTRIBUTE_COLUMNS].to_dict('records'),
+    }
+
+class FixedWindowRateLimiter:
+    """Giới hạn số request gửi đến API trong mỗi cửa sổ 60 giây (thread-safe, dùng chung cho mọi sheet)."""
+
+    def __init__(self, rate_limit):
+        self.rate_limit = rate_limit
+        self.request_count = 0
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Tạm dừng nếu đã hết lượt request trong phút hiện tại, sau đó tính thêm một request."""
+        with self._lock:
+            if self.request_count >= self.rate_limit:
+                elapsed_time = time.time() - self.start_time
+                if elapsed_time < 60:
+                    wait_time = 60 - elapsed_time
+                    sys.stderr.write(f"INFO: Đã đạt giới hạn {self.rate_limit} request trong vòng 1 phút. Tạm dừng {wait_time:.2f} giây...\n")
+                    time.sleep(wait_time)
+                # Reset bộ đếm và thời gian cho phút tiếp theo
+                self.request_count = 0
+                self.start_time = time.time()
+            self.request_count += 1
+
+class RoutingPool:
+    """
+    Hàng đợi định tuyến dùng chung cho mọi sheet: các request Openrouteservice được gửi bởi một nhóm thread cố định
+    và cùng đi qua một bộ giới hạn request, nên tổng số request/phút không phụ thuộc vào số sheet xử lý song song.
+    """
+
+    def __init__(self, api_key, profile, rate_limit, workers=1):
+        self.api_key = api_key
+        self.profile = profile
+        self.limiter = FixedWindowRateLimiter(rate_limit)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ors")
+
+    def _route(self, start_coords, end_coords):
+        self.limiter.wait()
+        return get_ors_route(self.api_key, start_coords, end_coords, self.profile)
+
+    def submit(self, start_coords, end_coords):
+        """Đưa một tuyến vào hàng đợi, trả về Future với kết quả của get_ors_route."""
+        return self._executor.submit(self._route, start_coords, end_coords)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def run_route_jobs(jobs, routing, first_row_number=2):
+    """
+    Đưa toàn bộ công việc vào hàng đợi định tuyến dùng chung rồi gom kết quả theo thứ tự.
+    Args:
+        jobs (dict): Bảng công việc từ build_route_jobs.
+        routing (RoutingPool): Hàng đợi định tuyến dùng chung (có giới hạn request mỗi phút).
+        first_row_number (int): Số hàng Excel ứng với index 0, chỉ dùng cho log.
+    Returns:
+        tuple: (distances, durations, route_coords)
+            - distances, durations: mảng float64 (NaN cho tuyến lỗi hoặc thiếu thông tin)
+            - route_coords: list tọa độ tuyến đường (None cho tuyến lỗi)
+    """
+    job_count = len(jobs['attrs'])
+    distances = np.full(job_count, np.nan)
+    durations = np.full(job_count, np.nan)
+    route_coords = [None] * job_count
+
+    futures = []
+    for attrs, (lon1, lat1, lon2, lat2) in zip(jobs['attrs'], jobs['coords'].tolist()):
+        start_coords = (lon1, lat1)
+        end_coords = (lon2, lat2)
+        sys.stderr.write(f"INFO: Đang tìm đường cho '{attrs['LineName']}' ({start_coords} -> {end_coords})...\n")
+        futures.append(routing.submit(start_coords, end_coords))
+
+    for position, (attrs, future) in enumerate(zip(jobs['attrs'], futures)):
+        line_name = attrs['LineName']
+        try:
+            route_result = future.result()
+
+            if route_result and route_result.get('coordinates'):
+                route_coords[position] = route_result['coordinates']
+                if route_result.get('distance_km') is not None:
+                    distances[position] = route_result['distance_km']
+                if route_result.get('duration_minutes') is not None:
+                    durations[position] = route_result['duration_minutes']
+                sys.stderr.write(f"INFO: Tuyến đường '{line_name}' tìm thấy: {distances[position]:.2f} km, {durations[position]:.0f} phút.\n")
+            else:
+                sys.stderr.write(f"Cảnh báo: Không thể lấy dữ liệu tuyến đường (hoặc tọa độ) cho '{line_name}'. Bỏ qua tuyến này.\n")
+
+        except Exception as e:
+            sys.stderr.write(f"Lỗi không xác định khi xử lý tuyến đường hàng {jobs['index'][position]+first_row_number} ('{line_name}'): {e}\n")
+            continue
+
+    return distances, durations, route_coords
+
+def collect_route_outputs(jobs, distances, durations, route_coords, kml_routes, exporter):
+    """Thêm các tuyến tìm được vào danh sách dữ liệu KML và ghi ra các file xuất GeoJSON/GeoPackage/FlatGeobuf."""
+    for attrs, coordinates, distance_km, duration_minutes in zip(jobs['attrs'], route_coords, distances.tolist(), durations.tolist()):
+        if coordinates is None:
+            continue
+        distance_km = None if np.isnan(distance_km) else distance_km
+        duration_minutes = None if np.isnan(duration_minutes) else duration_minutes
+
+        # Chuẩn bị dữ liệu cho KML
+        kml_routes.append({**attrs, 'Coords': coordinates, 'distance_km': distance_km, 'duration_minutes': duration_minutes})
+
+        if exporter.enabled:
+            exporter.write(
+                {'type': 'LineString', 'coordinates': coordinates},
+                {'LineName': attrs['LineName'], 'Description': attrs['Description'], 'distance_km': distance_km,
+                 'duration_minutes': duration_minutes, 'Color': attrs['Color'], 'Width': attrs['Width'], **folder_properties(attrs)}
+            )
+
+def stream_routes_to_excel(input_file, output_file, routing, kml_routes, exporter, sheet_name=None):
+    """
+    Chế độ luồng: đọc file Excel theo từng lô (openpyxl read_only), tính tuyến đường cho lô
+    và ghi ngay các hàng kết quả ra file Excel đầu ra (ghi từng hàng), nên bộ nhớ không tăng theo kích thước sheet.
+    Returns:
+        tuple: (số hàng đã ghi, báo cáo kiểm tra dữ liệu)
+    """
+    report = new_report()
+    writer = None
+    headers = None
+    row_number = 2 # Hàng 1 là tiêu đề
+    try:
+        for batch in iter_excel_batches(input_file, sheet_name):
+            if writer is None:
+                headers = list(batch[0].keys())
+                for column in ('distance_km', 'duration_minutes'):
+                    if column not in headers:
+                        headers.append(column)
+                writer = ExcelRowWriter(output_file, headers)
+
+            clean_df, rejected_df, batch_report = validate_table(batch, ROUTE_COLUMNS, first_row_number=row_number, default_name_prefix="Tuyến đường")
+            merge_report(report, batch_report)
+
+            jobs = build_route_jobs(clean_df)
+            distances, durations, route_coords = run_route_jobs(jobs, routing, first_row_number=row_number)
+            collect_route_outputs(jobs, distances, durations, route_coords, kml_routes, exporter)
+
+            # Vị trí hàng trong lô -> vị trí trong bảng công việc (index của clean_df là vị trí trong lô)
+            job_positions = dict(zip(jobs['index'].tolist(), range(len(jobs['attrs']))))
+            for index, row in enumerate(batch):
+                position = job_positions.get(index)
+                if position is not None and route_coords[position] is not None:
+                    row = {**row, 'distance_km': distances[position], 'duration_minutes': durations[position]}
+                writer.append([row.get(header) for header in headers])
+            row_number += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # Sheet không có dữ liệu: vẫn tạo file đầu ra chỉ có tiêu đề
+        with ExcelRowWriter(output_file, ['distance_km', 'duration_minutes']):
+            pass
+        return 0, report
+    return writer.row_count, report
+
+def route_dataframe(df_routes, routing, kml_routes, exporter):
+    """
+    Chế độ mặc định: kiểm tra, định tuyến và ghi kết quả vào DataFrame của cả sheet.
+    Returns:
+        dict: Báo cáo kiểm tra dữ liệu.
+    """
+    # Kiểm tra và chuẩn hóa toàn bộ các cột một lần (vector hóa) thay vì ép kiểu từng ô
+    clean_df, rejected_df, report = validate_table(df_routes, ROUTE_COLUMNS, first_row_number=2, default_name_prefix="Tuyến đường")
+
+    # Định tuyến trên bảng công việc gọn, kết quả nằm trong mảng numpy thay vì ghi từng ô vào DataFrame
+    jobs = build_route_jobs(clean_df)
+    distances, durations, route_coords = run_route_jobs(jobs, routing)
+
+    # Ghi kết quả vào DataFrame bằng một lần cập nhật theo cột
+    distance_column = pd.Series(np.nan, index=df_routes.index)
+    duration_column = pd.Series(np.nan, index=df_routes.index)
+    distance_column.loc[jobs['index']] = distances
+    duration_column.loc[jobs['index']] = durations
+    if 'distance_km' in df_routes.columns:
+        # Giữ giá trị có sẵn trong file cho các hàng không tính được
+        distance_column = distance_column.fillna(pd.to_numeric(df_routes['distance_km'], errors='coerce'))
+    if 'duration_minutes' in df_routes.columns:
+        duration_column = duration_column.fillna(pd.to_numeric(df_routes['duration_minutes'], errors='coerce'))
+    df_routes['distance_km'] = distance_column
+    df_routes['duration_minutes'] = duration_column
+
+    collect_route_outputs(jobs, distances, durations, route_coords, kml_routes, exporter)
+    return report
+
+def list_sheet_jobs(input_files, sheets):
+    """
+    Liệt kê các cặp (file Excel, tên sheet) cần xử lý.
+    sheets: None -> sheet đầu tiên của mỗi file; ['*'] -> mọi sheet; ngược lại là danh sách tên sheet
+    (sheet không có trong một file sẽ bị bỏ qua với file đó).
+    """
+    sheet_jobs = []
+    for input_file in input_files:
+        if not sheets:
+            sheet_jobs.append((input_file, None))
+            continue
+        if not os.path.isfile(input_file):
+            raise FileNotFoundError(f"File Excel đầu vào không tồn tại tại đường dẫn: '{input_file}'.")
+        workbook = openpyxl.load_workbook(input_file, read_only=True)
+        try:
+            sheet_names = workbook.sheetnames
+        finally:
+            workbook.close()
+        selected = sheet_names if '*' in sheets else [name for name in sheets if name in sheet_names]
+        if not selected:
+            sys.stderr.write(f"Cảnh báo: File '{input_file}' không có sheet nào trong {sheets}. Bỏ qua file này.\n")
+        sheet_jobs.extend((input_file, name) for name in selected)
+    return sheet_jobs
+
+def _safe_name(name):
+    return re.sub(r'[^\w\-]+', '_', name).strip('_') or 'sheet'
+
+def sheet_output_path(path, input_file, sheet_name, include_workbook, include_sheet):
+    """Đường dẫn đầu ra riêng cho một sheet: thêm tên file Excel và/hoặc tên sheet vào sau tên file gốc."""
+    if not path or not (include_workbook or include_sheet):
+        return path
+    root, ext = os.path.splitext(path)
+    parts = [root]
+    if include_workbook:
+        parts.append(_safe_name(os.path.splitext(os.path.basename(input_file))[0]))
+    if include_sheet:
+        parts.append(_safe_name(sheet_name or 'sheet1'))
+    return "_".join(parts) + ext
+
+def write_kml_file(kml_routes, kml_output_file, merge_rings=False):
+    """Tạo và ghi file KML cho một sheet."""
+    if not kml_routes:
+        sys.stderr.write(f"Cảnh báo: Không có tuyến đường nào được xử lý thành công để tạo file KML '{kml_output_file}'.\n")
+        return False
+    kml_content = create_kml_from_routes(kml_routes, main_folder_name="Các Tuyến Đường ORS", merge_rings=merge_rings)
+    if not kml_content:
+        sys.stderr.write("ERROR: Không thể tạo nội dung KML.\n")
+        return False
+    try:
+        output_dir = os.path.dirname(kml_output_file)
+        if output_dir: # Tạo thư mục nếu nó không tồn tại
+            os.makedirs(output_dir, exist_ok=True)
+        with open(kml_output_file, 'w', encoding='utf-8') as f:
+            f.write(kml_content)
+        sys.stderr.write(f"INFO: Tạo file KML thành công tại: '{kml_output_file}' chứa {len(kml_routes)} tuyến đường.\n")
+        return True
+    except IOError as e:
+        sys.stderr.write(f"ERROR: Không thể ghi vào file KML '{kml_output_file}': {e}\n")
+        return False
+
+def process_sheet(input_file, sheet_name, outputs, routing, stream_excel=False, merge_rings=False, cache=None):
+    """
+    Xử lý một sheet: đọc, kiểm tra, định tuyến (qua hàng đợi dùng chung) và ghi các file đầu ra của sheet.
+    Args:
+        outputs (dict): Đường dẫn đầu ra của sheet: 'excel', 'kml', 'geojson', 'gpkg', 'fgb'.
+        cache (ExcelSheetCache, optional): Cache các sheet đã đọc (không dùng ở chế độ luồng).
+    Returns:
+        dict: Kết quả của sheet (status, số hàng, số tuyến và các file đầu ra).
+    """
+    label = f"{input_file}" + (f" [{sheet_name}]" if sheet_name else "")
+    kml_routes = []
+
+    exporter = GeoExporter(
+        geojson_path=outputs['geojson'], gpkg_path=outputs['gpkg'], fgb_path=outputs['fgb'],
+        layer_name="routes", geometry_type="LineString"
+    )
+    try:
+        if stream_excel:
+            if not os.path.isfile(input_file):
+                raise FileNotFoundError(f"File Excel đầu vào không tồn tại tại đường dẫn: '{input_file}'.")
+            row_count, report = stream_routes_to_excel(input_file, outputs['excel'], routing, kml_routes, exporter, sheet_name)
+            sys.stderr.write(f"INFO: {label}: Đã đọc và ghi {row_count} hàng ở chế độ luồng.\n")
+        else:
+            # Đọc dữ liệu từ file Excel (mặc định sheet đầu tiên), dùng bản cache nếu file không thay đổi
+            if cache is not None:
+                df_routes, cache_hit = cache.read_excel(input_file, sheet_name)
+            else:
+                df_routes, cache_hit = pd.read_excel(input_file, sheet_name=sheet_name if sheet_name else 0), False
+            row_count = len(df_routes)
+            source = " (từ cache)" if cache_hit else ""
+            sys.stderr.write(f"INFO: Đã đọc thành công {row_count} hàng từ file Excel '{label}'{source}.\n")
+            report = route_dataframe(df_routes, routing, kml_routes, exporter)
+    finally:
+        export_files = exporter.close()
+
+    if report['invalid_rows'] or report['defaults_applied']:
+        sys.stderr.write(f"Cảnh báo: {label}: Kiểm tra dữ liệu đầu vào: {format_report(report)}\n")
+    if export_files:
+        sys.stderr.write(f"INFO: {label}: Xuất {exporter.feature_count} tuyến đường ra các file: {export_files}.\n")
+
+    # --- XUẤT FILE KML (nếu đường dẫn được cung cấp) ---
+    kml_written = write_kml_file(kml_routes, outputs['kml'], merge_rings) if outputs['kml'] else False
+
+    # --- XUẤT FILE EXCEL ĐẦU RA ---
+    # Ở chế độ luồng file Excel đã được ghi trong lúc tính tuyến đường
+    if not stream_excel:
+        excel_output_dir = os.path.dirname(outputs['excel'])
+        if excel_output_dir:
+            os.makedirs(excel_output_dir, exist_ok=True)
+        df_routes.to_excel(outputs['excel'], index=False, engine='xlsxwriter')
+
+    return {
+        "status": "success",
+        "excel_input_file": input_file,
+        "sheet": sheet_name,
+        "rows": row_count,
+        "routes": len(kml_routes),
+        "excel_output_file_path": outputs['excel'],
+        "kml_output_file_path": outputs['kml'] if kml_written else None,
+        "export_files": export_files or {},
+    }
+
 if __name__ == "__main__":
     # --- CẤU HÌNH QUA DÒNG LỆNH ---
     parser = argparse.ArgumentParser(
         description="Tính toán tuyến đường bằng Openrouteservice từ file Excel và xuất kết quả ra file Excel và KML.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    
+
     parser.add_argument(
-        '--excel-input-file', 
-        type=str, 
+        '--excel-input-file',
+        type=str,
+        nargs='+',
         required=True,
-        help='Đường dẫn đến file Excel chứa dữ liệu các tuyến đường.'
+        help='Đường dẫn đến file Excel chứa dữ liệu các tuyến đường.\nCó thể truyền nhiều file để xử lý trong cùng một lần chạy.'
     )
-    
+
     parser.add_argument(
-        '--api-key', 
-        type=str, 
-        required=True, 
+        '--sheets',
+        type=str,
+        nargs='+',
+        help="Tên các sheet cần xử lý trong mỗi file Excel ('*' để xử lý mọi sheet).\nMặc định chỉ xử lý sheet đầu tiên."
+    )
+
+    parser.add_argument(
+        '--api-key',
+        type=str,
+        required=True,
         help='Khóa API của Openrouteservice (bắt buộc).'
     )
-    
+
     parser.add_argument(
-        '--profile', 
-        type=str, 
-        default='driving-car', 
+        '--profile',
+        type=str,
+        default='driving-car',
         help='Hồ sơ định tuyến (mặc định: driving-car).\nCác lựa chọn khác: cycling-regular, walking, ...'
     )
-    
+
     parser.add_argument(
         '--rate-limit',
         type=int,
         default=40,
-        help='Số request tối đa mỗi phút gửi đến API Openrouteservice (mặc định: 40).'
+        help='Số request tối đa mỗi phút gửi đến API Openrouteservice (mặc định: 40), dùng chung cho mọi sheet.'
     )
-    
+
     parser.add_argument(
-        '--kml-output-file', 
-        type=str, 
-        help='Đường dẫn đầy đủ để lưu file KML đầu ra (tùy chọn).'
+        '--workers',
+        type=int,
+        default=4,
+        help='Số sheet được đọc/ghi song song (mặc định: 4).'
     )
 
     parser.add_argument(
-        '--excel-output-file', 
-        type=str, 
-        required=True,
-        help='Đường dẫn đầy đủ để lưu file Excel đầu ra với khoảng cách/thời gian đã tính.'
+        '--routing-workers',
+        type=int,
+        default=2,
+        help='Số request Openrouteservice được gửi đồng thời từ hàng đợi định tuyến dùng chung (mặc định: 2).'
     )
-    
-    args = parser.parse_args()
-    # -----------------------
 
-    # --- LOGIC XỬ LÝ ĐẦU VÀO EXCEL ---
-    try:
-        # Đọc dữ liệu từ file Excel. Giả định dữ liệu nằm ở sheet đầu tiên.
-        df_routes = pd.read_excel(args.excel_input_file)
-        sys.stderr.write(f"INFO: Đã đọc thành công {len(df_routes)} hàng từ file Excel '{args.excel_input_file}'.\n")
-
-        # Chuẩn bị các cột mới cho khoảng cách và thời gian nếu chúng chưa tồn tại
-        if 'distance_km' not in df_routes.columns:
-            df_routes['distance_km'] = None
-        if 'duration_minutes' not in df_routes.columns:
-            df_routes['duration_minutes'] = None
-        # Cột 'Coords' sẽ được dùng nội bộ để lưu tọa độ cho việc tạo KML, không xuất ra Excel
-        df_routes['Coords'] = None 
-            
-    except FileNotFoundError:
-        sys.stderr.write(f"ERROR: File Excel đầu vào không tồn tại tại đường dẫn: '{args.excel_input_file}'.\n")
-        sys.exit(1)
-    except Exception as e:
-        sys.stderr.write(f"ERROR: Lỗi khi đọc file Excel '{args.excel_input_file}': {e}\n")
-        sys.exit(1)
+    parser.add_argument(
+        '--kml-output-file',
+        type=str,
+        help='Đường dẫn đầy đủ để lưu file KML đầu ra (tùy chọn).\nKhi xử lý nhiều sheet, tên file/sheet được thêm vào sau tên file cho từng sheet.'
+    )
 
-    all_generated_routes_data_for_kml = []
-    
-    # --- Cấu hình Rate Limiting ---
-    request_count = 0
-    start_time = time.time()
-    # -----------------------------
+    parser.add_argument(
+        '--excel-output-file',
+        type=str,
+        required=True,
+        help='Đường dẫn đầy đủ để lưu file Excel đầu ra với khoảng cách/thời gian đã tính.\nKhi xử lý nhiều sheet, tên file/sheet được thêm vào sau tên file cho từng sheet.'
+    )
 
-    # Lặp qua từng hàng trong DataFrame để lấy dữ liệu tuyến đường
-    for index, row in df_routes.iterrows():
-        try:
-            # --- Bắt đầu logic Rate Limiting ---
-            if request_count >= args.rate_limit:
-                elapsed_time = time.time() - start_time
-                if elapsed_time < 60:
-                    wait_time = 60 - elapsed_time
-                    sys.stderr.write(f"INFO: Đã đạt giới hạn {args.rate_limit} request trong vòng 1 phút. Tạm dừng {wait_time:.2f} giây...\n")
-                    time.sleep(wait_time)
-                # Reset bộ đếm và thời gian cho phút tiếp theo
-                request_count = 0
-                start_time = time.time()
-            # --- Kết thúc logic Rate Limiting ---
+    parser.add_argument(
+        '--merge-rings',
+        action='store_true',
+        help='Gộp các tuyến của cùng một ring (cùng thư mục, màu và độ rộng) thành một placemark MultiGeometry.'
+    )
 
-            line_name = row.get('LineName', f"Tuyến đường {index+1}")
-            
-            # Đảm bảo các giá trị tọa độ là số
-            # Sử dụng pd.to_numeric với errors='coerce' để chuyển đổi không hợp lệ thành NaN
-            lat1 = pd.to_numeric(row.get('Latitude1'), errors='coerce')
-            lon1 = pd.to_numeric(row.get('Longitude1'), errors='coerce')
-            lat2 = pd.to_numeric(row.get('Latitude2'), errors='coerce')
-            lon2 = pd.to_numeric(row.get('Longitude2'), errors='coerce')
-            
-            # Kiểm tra nếu bất kỳ tọa độ nào là NaN (sau khi chuyển đổi không thành công)
-            if pd.isna(lat1) or pd.isna(lon1) or pd.isna(lat2) or pd.isna(lon2):
-                sys.stderr.write(f"Cảnh báo: Hàng {index+2} ('{line_name}') thiếu hoặc có tọa độ không hợp lệ, bỏ qua tuyến này.\n")
-                continue
-
-            kml_color = row.get('Color') 
-            if not kml_color:
-                sys.stderr.write(f"Cảnh báo: Tuyến đường '{line_name}' thiếu màu KML, sử dụng màu mặc định blue (ff0000ff).\n")
-                kml_color = simplekml.Color.blue
-            
-            width = row.get('Width')
-            # Đảm bảo độ rộng là số nguyên, mặc định là 4
-            kml_width = int(width) if pd.notna(width) and isinstance(width, (int, float)) else 4
+    parser.add_argument(
+        '--stream-excel',
+        action='store_true',
+        help='Đọc và ghi file Excel theo từng hàng (openpyxl read_only / xlsxwriter constant_memory)\nthay vì nạp toàn bộ sheet vào bộ nhớ. Dùng cho các file Excel rất lớn.'
+    )
 
-            description = str(row.get('Description', ''))
-            folder_name = row.get('FolderName', 'Tuyến đường chung') 
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help=f'Thư mục cache các sheet Excel đã đọc (mặc định: {DEFAULT_CACHE_DIR}).\nFile không đổi nội dung sẽ được nạp lại từ cache thay vì đọc lại file Excel.'
+    )
 
-            start_coords = (float(lon1), float(lat1))
-            end_coords = (float(lon2), float(lat2))
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Không dùng cache các sheet Excel đã đọc.'
+    )
 
-            sys.stderr.write(f"INFO: Đang tìm đường cho '{line_name}' ({start_coords} -> {end_coords})...\n")
-            
-            route_result = get_ors_route(args.api_key, start_coords, end_coords, args.profile)
-            request_count += 1 # Tăng bộ đếm sau khi gọi API
+    add_export_arguments(parser)
 
-            if route_result and route_result.get('coordinates'):
-                route_coordinates = route_result['coordinates']
-                distance_km = route_result.get('distance_km')
-                duration_minutes = route_result.get('duration_minutes')
-
-                # Cập nhật DataFrame với thông tin đã lấy
-                df_routes.loc[index, 'distance_km'] = distance_km
-                df_routes.loc[index, 'duration_minutes'] = duration_minutes
-                df_routes.loc[index, 'Coords'] = route_coordinates # Lưu tọa độ cho KML
-                
-                # Chuẩn bị dữ liệu cho KML
-                kml_route_info = {
-                    'LineName': line_name,
-                    'Description': description,
-                    'Coords': route_coordinates,
-                    'Color': kml_color,
-                    'Width': kml_width,
-                    'FolderName': folder_name,
-                    'SecondFolderName': row.get('SecondFolderName'),
-                    'ThirdFolderName': row.get('ThirdFolderName'),
-                    'distance_km': distance_km,
-                    'duration_minutes': duration_minutes
-                }
-                all_generated_routes_data_for_kml.append(kml_route_info)
+    args = parser.parse_args()
+    # -----------------------
 
-                sys.stderr.write(f"INFO: Tuyến đường '{line_name}' tìm thấy: {distance_km:.2f} km, {duration_minutes:.0f} phút.\n")
-            else:
-                sys.stderr.write(f"Cảnh báo: Không thể lấy dữ liệu tuyến đường (hoặc tọa độ) cho '{line_name}'. Bỏ qua tuyến này.\n")
+    try:
+        sheet_jobs = list_sheet_jobs(args.excel_input_file, args.sheets)
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Lỗi khi đọc danh sách sheet: {e}\n")
+        result = {"status": "error", "message": f"Lỗi khi đọc danh sách sheet: {e}"}
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        sys.exit(1)
+    if not sheet_jobs:
+        result = {"status": "error", "message": "Không có sheet nào để xử lý."}
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        sys.exit(1)
 
-        except ValueError as e:
-            sys.stderr.write(f"ERROR: Lỗi chuyển đổi kiểu dữ liệu cho hàng {index+2} ('{line_name}'): {e}. Đảm bảo tọa độ là số và độ rộng là số nguyên.\n")
-            continue
-        except Exception as e:
-            sys.stderr.write(f"Lỗi không xác định khi xử lý tuyến đường hàng {index+2} ('{line_name}'): {e}\n")
-            continue
+    # Mỗi sheet có file đầu ra riêng khi xử lý nhiều sheet
+    include_workbook = len(set(args.excel_input_file)) > 1
+    include_sheet = len(sheet_jobs) > len(set(input_file for input_file, _ in sheet_jobs))
+    outputs_by_job = [
+        {
+            key: sheet_output_path(path, input_file, sheet_name, include_workbook, include_sheet)
+            for key, path in (('excel', args.excel_output_file), ('kml', args.kml_output_file), ('geojson', args.output_geojson),
+                              ('gpkg', args.output_gpkg), ('fgb', args.output_fgb))
+        }
+        for input_file, sheet_name in sheet_jobs
+    ]
 
-    # --- XUẤT FILE KML (nếu đường dẫn được cung cấp) ---
-    if args.kml_output_file:
-        if all_generated_routes_data_for_kml:
-            kml_content = create_kml_from_routes(all_generated_routes_data_for_kml, main_folder_name="Các Tuyến Đường ORS")
-            if kml_content:
+    cache = None
+    if not args.no_cache and not args.stream_excel:
+        try:
+            cache = ExcelSheetCache(args.cache_dir)
+            cache.prune()
+        except OSError as e:
+            sys.stderr.write(f"Cảnh báo: Không thể dùng thư mục cache '{args.cache_dir}': {e}. Đọc trực tiếp file Excel.\n")
+
+    results = []
+    with RoutingPool(args.api_key, args.profile, args.rate_limit, args.routing_workers) as routing:
+        with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(sheet_jobs))), thread_name_prefix="sheet") as sheet_pool:
+            futures = [
+                sheet_pool.submit(process_sheet, input_file, sheet_name, outputs, routing, args.stream_excel, args.merge_rings, cache)
+                for (input_file, sheet_name), outputs in zip(sheet_jobs, outputs_by_job)
+            ]
+            for (input_file, sheet_name), future in zip(sheet_jobs, futures):
                 try:
-                    output_dir = os.path.dirname(args.kml_output_file)
-                    if output_dir: # Tạo thư mục nếu nó không tồn tại
-                        os.makedirs(output_dir, exist_ok=True)
-                    with open(args.kml_output_file, 'w', encoding='utf-8') as f:
-                        f.write(kml_content)
-                    sys.stderr.write(f"INFO: Tạo file KML thành công tại: '{args.kml_output_file}' chứa {len(all_generated_routes_data_for_kml)} tuyến đường.\n")
-                except IOError as e:
-                    sys.stderr.write(f"ERROR: Không thể ghi vào file KML '{args.kml_output_file}': {e}\n")
-            else:
-                sys.stderr.write(f"ERROR: Không thể tạo nội dung KML.\n")
+                    results.append(future.result())
+                except FileNotFoundError as e:
+                    sys.stderr.write(f"ERROR: {e}\n")
+                    results.append({"status": "error", "excel_input_file": input_file, "sheet": sheet_name, "message": str(e)})
+                except Exception as e:
+                    sys.stderr.write(f"ERROR: Lỗi khi xử lý file Excel '{input_file}'" + (f" [{sheet_name}]" if sheet_name else "") + f": {e}\n")
+                    results.append({"status": "error", "excel_input_file": input_file, "sheet": sheet_name, "message": f"Lỗi khi xử lý file Excel: {e}"})
+
+    failed = [item for item in results if item['status'] != 'success']
+    if len(results) == 1:
+        # Một sheet: giữ nguyên định dạng kết quả như trước
+        item = results[0]
+        if failed:
+            result = {"status": "error", "message": item['message']}
         else:
-            sys.stderr.write("Cảnh báo: Không có tuyến đường nào được xử lý thành công để tạo file KML.\n")
-
-    # --- XUẤT FILE EXCEL ĐẦU RA ---
-    try:
-        excel_output_dir = os.path.dirname(args.excel_output_file)
-        if excel_output_dir:
-            os.makedirs(excel_output_dir, exist_ok=True)
-        
-        # Tạo bản sao DataFrame và xóa cột 'Coords' trước khi xuất ra Excel
-        df_output = df_routes.drop(columns=['Coords'], errors='ignore')
-
-        df_output.to_excel(args.excel_output_file, index=False, engine='xlsxwriter')
+            result = {
+                "status": "success",
+                "excel_output_file_path": item['excel_output_file_path'],
+                "message": f"Tạo file Excel đầu ra thành công tại: '{item['excel_output_file_path']}' với khoảng cách và thời gian đã tính."
+            }
+    else:
         result = {
-            "status": "success",
-            "excel_output_file_path": args.excel_output_file,
-            "message": f"Tạo file Excel đầu ra thành công tại: '{args.excel_output_file}' với khoảng cách và thời gian đã tính."
+            "status": "success" if not failed else ("error" if len(failed) == len(results) else "partial"),
+            "sheets": results,
+            "message": f"Đã xử lý thành công {len(results) - len(failed)}/{len(results)} sheet."
         }
-        print(json.dumps(result, indent=2, ensure_ascii=False))
-
-    except Exception as e:
-        sys.stderr.write(f"ERROR: Lỗi khi ghi file Excel đầu ra '{args.excel_output_file}': {e}\n")
-        result = {"status": "error", "message": f"Lỗi khi ghi file Excel đầu ra: {e}"}
-        print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if len(failed) == len(results):
         sys.exit(1)
 
-    sys.stderr.write("INFO: Quá trình hoàn tất.\n")
\ No newline at end of file
+    sys.stderr.write("INFO: Quá trình hoàn tất.\n")
@@ -2,11 +2,13 @@ import requests
 import simplekml
 import os
 import sys
-import json
 import time
 import argparse
-import openpyxl
 from collections import deque
+from geo_export import GeoExporter, add_export_arguments, folder_properties
+from row_validation import ROUTE_COLUMNS, validate_batches, new_report, format_report
+from json_stream import iter_row_batches, InputFormatError
+from excel_stream import ExcelRowWriter
 
 # Khởi tạo logger
 def setup_logger(log_file_path):
@@ -44,7 +46,7 @@ def get_ors_route(api_key, start_coords, end_coords, profile="driving-car", max_
         logger (logging.Logger): Đối tượng logger.
         
     Returns:
-        tuple: (list các cặp tọa độ, float khoảng cách), hoặc (None, None) nếu thất bại.
+        tuple: (list các cặp tọa độ, float khoảng cách km, float thời gian phút), hoặc (None, None, None) nếu thất bại.
     """
     retry_delay = 1  # Thời gian chờ ban đầu (giây)
     
@@ -69,15 +71,17 @@ def get_ors_route(api_key, start_coords, end_coords, profile="driving-car", max_
             
             if data and 'features' in data and len(data['features']) > 0:
                 coordinates = [tuple(seg) for seg in data['features'][0]['geometry']['coordinates']]
-                # Lấy khoảng cách từ phản hồi API
-                distance_km = data['features'][0]['properties']['summary']['distance'] / 1000
+                # Lấy khoảng cách (mét) và thời gian (giây) từ phản hồi API
+                summary = data['features'][0]['properties']['summary']
+                distance_km = summary['distance'] / 1000
+                duration_minutes = summary['duration'] / 60 if 'duration' in summary else None
                 if logger:
                     logger.info(f"API Openrouteservice: Lấy dữ liệu thành công cho {start_coords} -> {end_coords}. Khoảng cách: {distance_km:.2f} km.")
-                return coordinates, distance_km
+                return coordinates, distance_km, duration_minutes
             else:
                 if logger:
                     logger.error(f"API Openrouteservice: Không tìm thấy dữ liệu tuyến đường cho {start_coords} -> {end_coords} trong phản hồi.")
-                return None, None
+                return None, None, None
 
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 429:
@@ -88,23 +92,24 @@ def get_ors_route(api_key, start_coords, end_coords, profile="driving-car", max_
             else:
                 if logger:
                     logger.error(f"API Openrouteservice: Lỗi HTTP {e.response.status_code} khi gọi API cho {start_coords} -> {end_coords}: {e}")
-                return None, None
+                return None, None, None
         except requests.exceptions.RequestException as e:
             if logger:
                 logger.error(f"API Openrouteservice: Lỗi kết nối hoặc thời gian chờ cho {start_coords} -> {end_coords}: {e}")
-            return None, None
+            return None, None, None
         except KeyError as e:
             if logger:
                 logger.error(f"API Openrouteservice: Lỗi cấu trúc JSON từ Openrouteservice cho {start_coords} -> {end_coords}: {e}")
-            return None, None
+            return None, None, None
     
     if logger:
         logger.error(f"Thử lại {max_retries} lần không thành công cho tuyến đường {start_coords} -> {end_coords}.")
-    return None, None
+    return None, None, None
 
-def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động", logger=None):
+def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động", logger=None, merge_rings=False):
     """
     Tạo một file KML duy nhất chứa nhiều tuyến đường.
+    Nếu merge_rings=True, các tuyến cùng thư mục, màu và độ rộng được gộp thành một placemark MultiGeometry cho mỗi ring.
     """
     if not all_routes_data:
         if logger:
@@ -117,6 +122,8 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
     main_folder_path = (main_folder_name,)
     main_folder_object = kml.newfolder(name=main_folder_name)
     created_folders[main_folder_path] = main_folder_object
+    # Khi gộp ring: key là (đường dẫn thư mục, màu, độ rộng), value chứa thư mục đích và danh sách tuyến
+    rings = {}
 
     for i, route_info in enumerate(all_routes_data):
         route_coords = route_info.get('Coords')
@@ -152,6 +159,13 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
                     created_folders[level3_path] = level2_folder_object.newfolder(name=third_folder_name)
                 current_folder = created_folders[level3_path]
 
+        if merge_rings:
+            ring_key = (level1_path, second_folder_name or None, third_folder_name or None, color, width)
+            if ring_key not in rings:
+                rings[ring_key] = {'folder': current_folder, 'routes': []}
+            rings[ring_key]['routes'].append((line_name, route_coords, route_info.get('Distance')))
+            continue
+
         linestring_placemark = current_folder.newlinestring(name=line_name, description=description)
         linestring_placemark.coords = route_coords
         linestring_placemark.altitudemode = simplekml.AltitudeMode.clamptoground
@@ -160,6 +174,33 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
         linestring_placemark.style.linestyle.color = color
         linestring_placemark.style.linestyle.width = width
 
+    for (level1_path, second_folder_name, third_folder_name, color, width), ring in rings.items():
+        # Tên ring là tên thư mục sâu nhất chứa các tuyến
+        ring_name = third_folder_name or second_folder_name or level1_path[-1]
+        known_distances = [distance for _, _, distance in ring['routes'] if isinstance(distance, (int, float))]
+        total_distance_km = sum(known_distances)
+
+        description_lines = []
+        for j, (line_name, _, distance) in enumerate(ring['routes']):
+            distance_text = f"{distance:.2f} km" if isinstance(distance, (int, float)) else "N/A"
+            description_lines.append(f"{j+1}. {line_name}: {distance_text}")
+        description_lines.append(f"Tổng khoảng cách: {total_distance_km:.2f} km")
+
+        multigeometry = ring['folder'].newmultigeometry(name=ring_name, description="\n".join(description_lines))
+        for line_name, route_coords, _ in ring['routes']:
+            linestring = multigeometry.newlinestring(coords=route_coords)
+            linestring.altitudemode = simplekml.AltitudeMode.clamptoground
+            linestring.extrude = 0
+
+        multigeometry.extendeddata.newdata(name="SegmentCount", value=len(ring['routes']))
+        multigeometry.extendeddata.newdata(name="TotalDistanceKm", value=round(total_distance_km, 3))
+        for j, (line_name, _, distance) in enumerate(ring['routes']):
+            distance_text = f"{distance:.2f} km" if isinstance(distance, (int, float)) else "N/A"
+            multigeometry.extendeddata.newdata(name=f"Segment{j+1}", value=f"{line_name} ({distance_text})")
+
+        multigeometry.style.linestyle.color = color
+        multigeometry.style.linestyle.width = width
+
     try:
         if logger:
             logger.info("Tạo chuỗi KML thành công.")
@@ -169,44 +210,36 @@ def create_kml_from_routes(all_routes_data, main_folder_name="Các Tuyến Đư
             logger.error(f"Lỗi khi tạo chuỗi KML: {e}")
         return None
 
+# Tên sheet và các cột kết quả bổ sung vào file Excel đầu ra
+EXCEL_SHEET_TITLE = "Kết quả Tuyến Đường"
+EXCEL_RESULT_HEADERS = ["Distance (km)", "Duration (min)", "Status"]
+# Kết quả mặc định cho hàng không có trong processed_data
+MISSING_RESULT = ('N/A', 'N/A', 'Lỗi')
+
+def excel_column_order(rows):
+    """Thứ tự cột đầu vào: các cột của hàng đầu tiên, sau đó các cột chỉ xuất hiện ở hàng sau (tính một lần)."""
+    return list(dict.fromkeys(key for row in rows for key in row))
+
 def create_excel_from_results(original_data, processed_data, output_file, logger=None):
     """
     Tạo một file Excel từ dữ liệu ban đầu và kết quả xử lý.
+
+    Args:
+        original_data (list): Các hàng đầu vào theo thứ tự.
+        processed_data (dict): Kết quả theo vị trí hàng trong original_data: {vị trí: (khoảng cách, thời gian, trạng thái)}.
+                               Ghép theo vị trí hàng nên các tuyến trùng LineName không ghi đè kết quả của nhau.
+        output_file (str): Đường dẫn file Excel đầu ra.
+        logger (logging.Logger): Đối tượng logger.
     """
     try:
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Kết quả Tuyến Đường"
-
-        # Ghi tiêu đề
-        headers = list(original_data[0].keys()) if original_data else []
-        headers.extend(["Distance (km)", "Status"])
-        sheet.append(headers)
-
-        # Tạo một dictionary để tra cứu kết quả đã xử lý
-        processed_map = {item['LineName']: item for item in processed_data}
-
-        # Ghi dữ liệu
-        for row in original_data:
-            line_name = row.get('LineName')
-            processed_info = processed_map.get(line_name, {})
-            
-            # Ghi dữ liệu ban đầu
-            row_data = [row.get(key) for key in original_data[0].keys()]
-            
-            # Bổ sung kết quả xử lý
-            distance = processed_info.get('Distance', 'N/A')
-            status = processed_info.get('Status', 'Lỗi')
-            
-            row_data.extend([distance, status])
-            sheet.append(row_data)
-
-        # Lưu file
-        output_dir = os.path.dirname(output_file)
-        if output_dir:
-            os.makedirs(output_dir, exist_ok=True)
-        workbook.save(output_file)
-        
+        # Ghi từng hàng (xlsxwriter constant_memory / openpyxl write_only), không dựng cả workbook trong bộ nhớ
+        headers = excel_column_order(original_data)
+
+        with ExcelRowWriter(output_file, headers + EXCEL_RESULT_HEADERS, sheet_title=EXCEL_SHEET_TITLE) as writer:
+            for position, row in enumerate(original_data):
+                # Ghi dữ liệu ban đầu và bổ sung kết quả xử lý
+                writer.append([row.get(key) for key in headers] + list(processed_data.get(position, MISSING_RESULT)))
+
         if logger:
             logger.info(f"Tạo file Excel thành công tại '{output_file}'.")
         return True
@@ -215,6 +248,164 @@ def create_excel_from_results(original_data, processed_data, output_file, logger
             logger.error(f"Lỗi khi tạo file Excel '{output_file}': {e}")
         return False
 
+def route_batches(batches, api_key, profile, rate_limit, exporter, add_result, logger=None):
+    """
+    Kiểm tra dữ liệu từng lô ngay khi đọc xong, gọi API cho các hàng hợp lệ (tối đa rate_limit request/phút)
+    và báo kết quả của từng hàng qua add_result.
+
+    Args:
+        batches (iterable): Các lô hàng đầu vào (list các dictionary).
+        exporter (GeoExporter): Nơi ghi các tuyến ra GeoJSON/GeoPackage/FlatGeobuf.
+        add_result (callable): add_result(batch, index, khoảng cách, thời gian, trạng thái), gọi cho mọi hàng kể cả hàng bị loại.
+        logger (logging.Logger): Đối tượng logger.
+
+    Returns:
+        tuple: (dữ liệu các tuyến đã tính để tạo KML, báo cáo kiểm tra dữ liệu)
+    Raises:
+        InputFormatError: Nếu file JSON đầu vào sai định dạng.
+    """
+    all_generated_routes_data = []
+    # Cửa sổ trượt
+    request_timestamps = deque()
+
+    def record_rejected(batch, rejected_df):
+        for index, error in zip(rejected_df.index, rejected_df['_error']):
+            add_result(batch, index, 'N/A', 'N/A', f"Lỗi: {error}")
+
+    report = new_report()
+    clean_rows = validate_batches(
+        batches, ROUTE_COLUMNS, report,
+        default_name_prefix="Tuyến đường", on_rejected=record_rejected
+    )
+
+    for i, (batch, index, route_data) in enumerate(clean_rows):
+        original_row = batch[index]
+        line_name = route_data['LineName']
+        logger.info(f"Đang xử lý tuyến đường: '{line_name}' (số thứ tự: {i+1}).")
+
+        try:
+            # Logic cửa sổ trượt
+            current_time = time.time()
+            while request_timestamps and current_time - request_timestamps[0] > 60:
+                request_timestamps.popleft()
+
+            if len(request_timestamps) >= rate_limit:
+                time_to_wait = 60 - (current_time - request_timestamps[0])
+                logger.info(f"Đã đạt giới hạn {rate_limit} request/phút. Tạm dừng {time_to_wait:.2f} giây...")
+                time.sleep(time_to_wait)
+                current_time = time.time()
+                while request_timestamps and current_time - request_timestamps[0] > 60:
+                    request_timestamps.popleft()
+
+            # Dữ liệu đã được kiểm tra và ép kiểu theo cột bởi row_validation
+            kml_color = route_data['Color']
+            kml_width = route_data['Width']
+            description = route_data['Description']
+            folder_name = route_data['FolderName']
+
+            start_coords = (route_data['Longitude1'], route_data['Latitude1'])
+            end_coords = (route_data['Longitude2'], route_data['Latitude2'])
+
+            route_coordinates, distance_km, duration_minutes = get_ors_route(api_key, start_coords, end_coords, profile, logger=logger)
+            request_timestamps.append(time.time())
+
+            if route_coordinates and distance_km is not None:
+                all_generated_routes_data.append({
+                    'LineName': line_name,
+                    'Description': description,
+                    'Coords': route_coordinates,
+                    'Distance': distance_km,
+                    'Duration': duration_minutes,
+                    'Color': kml_color,
+                    'Width': kml_width,
+                    'FolderName': folder_name,
+                    'SecondFolderName': route_data['SecondFolderName'],
+                    'ThirdFolderName': route_data['ThirdFolderName']
+                })
+                add_result(batch, index, distance_km, duration_minutes if duration_minutes is not None else 'N/A', 'Thành công')
+                if exporter.enabled:
+                    exporter.write(
+                        {'type': 'LineString', 'coordinates': route_coordinates},
+                        {'row_number': original_row.get('row_number'), 'LineName': line_name, 'Description': description,
+                         'Distance': distance_km, 'Duration': duration_minutes, 'Color': kml_color, 'Width': kml_width, **folder_properties(route_data)}
+                    )
+            else:
+                add_result(batch, index, 'N/A', 'N/A', 'Lỗi: Không lấy được dữ liệu API')
+                logger.warning(f"Không thể lấy dữ liệu tuyến đường cho '{line_name}'.")
+
+        except Exception as e:
+            logger.error(f"Lỗi không xác định khi xử lý tuyến đường thứ {i+1} ('{line_name}'): {e}")
+            add_result(batch, index, 'N/A', 'N/A', f"Lỗi: {str(e)}")
+            continue
+
+    return all_generated_routes_data, report
+
+def stream_routes_to_excel(batches, output_file, api_key, profile, rate_limit, exporter, logger=None):
+    """
+    Chế độ --stream-excel: ghi ngay từng hàng kết quả ra file Excel khi xử lý xong, không giữ dữ liệu đầu vào trong bộ nhớ.
+    Thứ tự hàng theo thứ tự hoàn thành: các hàng bị loại của mỗi lô được ghi trước các tuyến của lô đó.
+
+    Returns:
+        tuple: (dữ liệu các tuyến để tạo KML, báo cáo kiểm tra dữ liệu, số hàng đã ghi)
+    """
+    writer = None
+    headers = []
+
+    def open_writer(batches):
+        nonlocal writer
+        for batch in batches:
+            if writer is None:
+                # Thứ tự cột lấy theo lô đầu tiên, giống create_excel_from_results
+                headers.extend(excel_column_order(batch))
+                writer = ExcelRowWriter(output_file, headers + EXCEL_RESULT_HEADERS, sheet_title=EXCEL_SHEET_TITLE)
+            yield batch
+
+    def add_result(batch, index, distance, duration, status):
+        row = batch[index]
+        writer.append([row.get(key) for key in headers] + [distance, duration, status])
+
+    try:
+        routes, report = route_batches(open_writer(batches), api_key, profile, rate_limit, exporter, add_result, logger)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        raise
+
+    if writer is None:
+        logger.warning("Không có dữ liệu đầu vào để tạo file Excel.")
+        return routes, report, 0
+    try:
+        writer.close()
+        logger.info(f"Ghi {writer.row_count} hàng kết quả (dạng luồng) vào file Excel '{output_file}'.")
+    except Exception as e:
+        logger.error(f"Lỗi khi tạo file Excel '{output_file}': {e}")
+    return routes, report, writer.row_count
+
+def collect_routes_for_excel(batches, api_key, profile, rate_limit, exporter, logger=None):
+    """
+    Chế độ mặc định: giữ các hàng gốc và kết quả theo vị trí hàng để create_excel_from_results ghi file Excel theo thứ tự đầu vào.
+
+    Returns:
+        tuple: (dữ liệu các tuyến để tạo KML, báo cáo kiểm tra dữ liệu, các hàng gốc,
+                kết quả theo vị trí hàng {vị trí: (khoảng cách, thời gian, trạng thái)})
+    """
+    original_rows = []
+    processed_data = {}
+    batch_start = 0 # Vị trí (trong toàn bộ dữ liệu đầu vào) của hàng đầu tiên thuộc lô đang xử lý
+
+    def keep_batches(batches):
+        nonlocal batch_start
+        for batch in batches:
+            batch_start = len(original_rows)
+            original_rows.extend(batch)
+            yield batch
+
+    def add_result(batch, index, distance, duration, status):
+        processed_data[batch_start + index] = (distance, duration, status)
+
+    routes, report = route_batches(keep_batches(batches), api_key, profile, rate_limit, exporter, add_result, logger)
+    return routes, report, original_rows, processed_data
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Tạo KML và Excel chứa các tuyến đường được tính toán bởi Openrouteservice.",
@@ -229,6 +420,9 @@ if __name__ == "__main__":
     parser.add_argument('--output-excel', type=str, default='routes_result.xlsx', help='Đường dẫn để lưu file Excel đầu ra (mặc định: routes_result.xlsx).')
     parser.add_argument('--log-file', type=str, default='processing.log', help='Đường dẫn để lưu file log quá trình xử lý (mặc định: processing.log).')
     parser.add_argument('--use-mock', action='store_true', help='Sử dụng dữ liệu mock có sẵn trong script thay vì đọc từ file.')
+    parser.add_argument('--stream-excel', action='store_true', help='Ghi từng hàng kết quả ra file Excel ngay khi xử lý xong (không giữ dữ liệu đầu vào trong bộ nhớ).\nThứ tự hàng theo thứ tự hoàn thành: các hàng bị loại của mỗi lô được ghi trước các tuyến của lô đó.')
+    parser.add_argument('--merge-rings', action='store_true', help='Gộp các tuyến của cùng một ring (cùng thư mục, màu và độ rộng) thành một placemark MultiGeometry.')
+    add_export_arguments(parser)
 
     args = parser.parse_args()
 
@@ -246,10 +440,10 @@ if __name__ == "__main__":
         {"row_number": 8, "LineName": "Canh Vinh - Quy Nhơn Tây", "Latitude1": 13.733403, "Longitude1": 109.082708, "Latitude2": 13.7465753, "Longitude2": 109.1519561, "Color": "ffffff00", "Width": 2, "Description": "", "FolderName": "Bình Định - Ring 2", "SecondFolderName": "", "ThirdFolderName": "", "Distance": ""}
     ]
 
-    routes_to_process = []
+    # Dữ liệu đầu vào được đọc dạng luồng theo từng lô
     if args.use_mock:
         logger.info("Sử dụng dữ liệu MOCK để chạy thử.")
-        routes_to_process = mock_routes_data
+        input_batches = [mock_routes_data]
     else:
         if not args.input_file:
             logger.error("Khi không sử dụng --use-mock, bạn phải cung cấp đường dẫn file với --input-file.")
@@ -260,116 +454,41 @@ if __name__ == "__main__":
             logger.error(f"File JSON đầu vào không tồn tại tại đường dẫn: '{args.input_file}'.")
             sys.exit(1)
 
-        try:
-            with open(args.input_file, 'r', encoding='utf-8') as f:
-                data_from_file = json.load(f)
-                routes_to_process = data_from_file
-            logger.info(f"Đọc dữ liệu từ file '{args.input_file}' thành công.")
-        except json.JSONDecodeError as e:
-            logger.error(f"Lỗi đọc file JSON: {e}")
-            sys.exit(1)
-        except Exception as e:
-            logger.error(f"Lỗi khi mở hoặc đọc file JSON: {e}")
-            sys.exit(1)
-
-        if not isinstance(routes_to_process, list):
-            logger.error("Cấu trúc file JSON không đúng. Phải là một mảng (list) các đối tượng tuyến đường.")
-            sys.exit(1)
+        input_batches = iter_row_batches(args.input_file)
+        logger.info(f"Bắt đầu đọc dữ liệu dạng luồng từ file '{args.input_file}'.")
 
-    all_generated_routes_data = []
-    processed_excel_data = []
+    try:
+        exporter = GeoExporter(
+            geojson_path=args.output_geojson, gpkg_path=args.output_gpkg, fgb_path=args.output_fgb,
+            layer_name="routes", geometry_type="LineString"
+        )
+    except Exception as e:
+        logger.error(f"Lỗi khi mở file xuất GeoJSON/GeoPackage/FlatGeobuf: {e}")
+        sys.exit(1)
     
-    # Cửa sổ trượt
-    request_timestamps = deque()
-
-    for i, route_data in enumerate(routes_to_process):
-        line_name = route_data.get('LineName', f"Tuyến đường {i+1}")
-        logger.info(f"Đang xử lý tuyến đường: '{line_name}' (số thứ tự: {i+1}/{len(routes_to_process)}).")
-        
-        try:
-            # Logic cửa sổ trượt
-            current_time = time.time()
-            while request_timestamps and current_time - request_timestamps[0] > 60:
-                request_timestamps.popleft()
-
-            if len(request_timestamps) >= args.rate_limit:
-                time_to_wait = 60 - (current_time - request_timestamps[0])
-                logger.info(f"Đã đạt giới hạn {args.rate_limit} request/phút. Tạm dừng {time_to_wait:.2f} giây...")
-                time.sleep(time_to_wait)
-                current_time = time.time()
-                while request_timestamps and current_time - request_timestamps[0] > 60:
-                    request_timestamps.popleft()
-
-            lat1 = float(route_data.get('Latitude1'))
-            lon1 = float(route_data.get('Longitude1'))
-            lat2 = float(route_data.get('Latitude2'))
-            lon2 = float(route_data.get('Longitude2'))
-            
-            kml_color = route_data.get('Color', simplekml.Color.blue)
-            width = route_data.get('Width')
-            kml_width = int(width) if isinstance(width, (int, float)) else 4
-            description = str(route_data.get('Description', ''))
-            folder_name = route_data.get('FolderName', 'Tuyến đường chung') 
-
-            if None in [lat1, lon1, lat2, lon2]:
-                logger.warning(f"Tuyến đường '{line_name}' thiếu tọa độ (Lat/Lon), bỏ qua.")
-                processed_excel_data.append({
-                    **route_data,
-                    'Distance': 'N/A',
-                    'Status': 'Lỗi: Thiếu tọa độ'
-                })
-                continue
-
-            start_coords = (lon1, lat1)
-            end_coords = (lon2, lat2)
-            
-            route_coordinates, distance_km = get_ors_route(args.api_key, start_coords, end_coords, args.profile, logger=logger)
-            request_timestamps.append(time.time())
-
-            if route_coordinates and distance_km is not None:
-                all_generated_routes_data.append({
-                    'LineName': line_name,
-                    'Description': description,
-                    'Coords': route_coordinates, 
-                    'Color': kml_color,
-                    'Width': kml_width,
-                    'FolderName': folder_name,
-                    'SecondFolderName': route_data.get('SecondFolderName'),
-                    'ThirdFolderName': route_data.get('ThirdFolderName')
-                })
-                processed_excel_data.append({
-                    **route_data,
-                    'Distance': distance_km,
-                    'Status': 'Thành công'
-                })
-            else:
-                processed_excel_data.append({
-                    **route_data,
-                    'Distance': 'N/A',
-                    'Status': 'Lỗi: Không lấy được dữ liệu API'
-                })
-                logger.warning(f"Không thể lấy dữ liệu tuyến đường cho '{line_name}'.")
-
-        except ValueError as e:
-            logger.error(f"Lỗi chuyển đổi kiểu dữ liệu cho tuyến đường '{line_name}': {e}. Đảm bảo tọa độ là số và độ rộng là số nguyên.")
-            processed_excel_data.append({
-                **route_data,
-                'Distance': 'N/A',
-                'Status': 'Lỗi: Sai định dạng tọa độ'
-            })
-            continue
-        except Exception as e:
-            logger.error(f"Lỗi không xác định khi xử lý tuyến đường thứ {i+1} ('{line_name}'): {e}")
-            processed_excel_data.append({
-                **route_data,
-                'Distance': 'N/A',
-                'Status': f"Lỗi: {str(e)}"
-            })
-            continue
+    try:
+        if args.stream_excel:
+            all_generated_routes_data, report, _ = stream_routes_to_excel(
+                input_batches, args.output_excel, args.api_key, args.profile, args.rate_limit, exporter, logger
+            )
+        else:
+            all_generated_routes_data, report, routes_to_process, processed_excel_data = collect_routes_for_excel(
+                input_batches, args.api_key, args.profile, args.rate_limit, exporter, logger
+            )
+    except InputFormatError as e:
+        logger.error(f"Lỗi đọc file JSON: {e}")
+        sys.exit(1)
+
+    if report['invalid_rows'] or report['defaults_applied']:
+        logger.warning(f"Kiểm tra dữ liệu đầu vào: {format_report(report)}")
+
+    export_files = exporter.close()
+    if export_files:
+        logger.info(f"Xuất {exporter.feature_count} tuyến đường ra các file: {export_files}.")
     
     # Tạo file KML
     if all_generated_routes_data:
-        kml_content = create_kml_from_routes(all_generated_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động", logger=logger)
+        kml_content = create_kml_from_routes(all_generated_routes_data, main_folder_name="Các Tuyến Đường", doc_name="Các tuyến đường được tạo tự động", logger=logger, merge_rings=args.merge_rings)
         if kml_content:
             try:
                 output_dir = os.path.dirname(args.output_kml)
@@ -383,10 +502,11 @@ if __name__ == "__main__":
     else:
         logger.warning("Không có tuyến đường nào được xử lý thành công để tạo KML.")
 
-    # Tạo file Excel
-    if routes_to_process:
-        create_excel_from_results(routes_to_process, processed_excel_data, args.output_excel, logger)
-    else:
-        logger.warning("Không có dữ liệu đầu vào để tạo file Excel.")
-    
+    # Tạo file Excel (chế độ --stream-excel đã ghi xong trong lúc xử lý)
+    if not args.stream_excel:
+        if routes_to_process:
+            create_excel_from_results(routes_to_process, processed_excel_data, args.output_excel, logger)
+        else:
+            logger.warning("Không có dữ liệu đầu vào để tạo file Excel.")
+
     logger.info("Chương trình kết thúc.")
\ No newline at end of file
@@ -0,0 +1,216 @@
+import pandas as pd
+
+# Màu KML mặc định (AABBGGRR) và độ rộng đường mặc định, giống simplekml.Color.blue
+DEFAULT_LINE_COLOR = "ffff0000"
+DEFAULT_LINE_WIDTH = 4
+
+# Số hàng lỗi tối đa được liệt kê cho mỗi loại lỗi trong báo cáo
+REPORT_SAMPLE_ROWS = 5
+
+# Các cột thư mục KML dùng chung cho mọi loại dữ liệu
+FOLDER_COLUMNS = {
+    'FolderName': {'type': 'str', 'default': ''},
+    'SecondFolderName': {'type': 'str', 'default': ''},
+    'ThirdFolderName': {'type': 'str', 'default': ''},
+}
+
+# Mô tả cột cho từng loại dữ liệu.
+# type: 'float' | 'int' | 'str'; required: thiếu giá trị thì loại bỏ hàng; default: giá trị thay thế khi trống;
+# min/max: khoảng giá trị hợp lệ (chỉ cho kiểu số).
+SITE_COLUMNS = {
+    'SiteName': {'type': 'str', 'default': None}, # None: dùng "Điểm <số hàng>"
+    'Latitude': {'type': 'float', 'required': True, 'min': -90, 'max': 90},
+    'Longitude': {'type': 'float', 'required': True, 'min': -180, 'max': 180},
+    'Icon': {'type': 'str', 'required': True},
+    'IconScale': {'type': 'float', 'default': 1.0},
+    'Description': {'type': 'str', 'default': ''},
+    **FOLDER_COLUMNS,
+}
+
+LINE_COLUMNS = {
+    'LineName': {'type': 'str', 'required': True},
+    'Latitude1': {'type': 'float', 'required': True, 'min': -90, 'max': 90},
+    'Longitude1': {'type': 'float', 'required': True, 'min': -180, 'max': 180},
+    'Latitude2': {'type': 'float', 'required': True, 'min': -90, 'max': 90},
+    'Longitude2': {'type': 'float', 'required': True, 'min': -180, 'max': 180},
+    'Color': {'type': 'str', 'default': DEFAULT_LINE_COLOR},
+    'Width': {'type': 'int', 'default': DEFAULT_LINE_WIDTH},
+    'Description': {'type': 'str', 'default': ''},
+    **FOLDER_COLUMNS,
+}
+
+# Tuyến đường dùng chung cột với tuyến thẳng, nhưng tên tuyến có thể trống (dùng "Tuyến đường <số hàng>")
+ROUTE_COLUMNS = {
+    **LINE_COLUMNS,
+    'LineName': {'type': 'str', 'default': None},
+    'FolderName': {'type': 'str', 'default': 'Tuyến đường chung'},
+}
+
+
+def rows_to_frame(items):
+    """
+    Chuyển danh sách hàng (dictionary, có thể theo cấu trúc n8n {'json': {...}}) thành DataFrame.
+    """
+    records = [item.get('json', item) if isinstance(item, dict) else {} for item in items]
+    return pd.DataFrame.from_records(records)
+
+
+def _is_blank(series):
+    """Mask các ô trống: NaN/None hoặc chuỗi chỉ có khoảng trắng."""
+    return series.isna() | series.astype(str).str.strip().eq('')
+
+
+def validate_table(data, columns, first_row_number=1, default_name_prefix=None):
+    """
+    Kiểm tra và chuẩn hóa toàn bộ bảng dữ liệu theo cột (vector hóa) thay vì từng hàng.
+
+    Args:
+        data (list | pandas.DataFrame): Danh sách hàng (rawData) hoặc DataFrame đọc từ Excel.
+        columns (dict): Mô tả cột (SITE_COLUMNS, LINE_COLUMNS, ROUTE_COLUMNS).
+        first_row_number (int): Số thứ tự của hàng đầu tiên, dùng khi dữ liệu không có cột 'row_number'
+                                (1 cho JSON, 2 cho Excel có dòng tiêu đề).
+        default_name_prefix (str, optional): Tiền tố tên mặc định cho cột có default None (ví dụ "Điểm").
+
+    Returns:
+        tuple: (clean_df, rejected_df, report)
+            - clean_df: DataFrame các hàng hợp lệ, các cột đã được ép kiểu và điền giá trị mặc định.
+                        Giữ nguyên index và các cột khác của dữ liệu gốc.
+            - rejected_df: DataFrame các hàng bị loại, kèm cột '_row' và '_error' (lỗi đầu tiên gặp phải).
+            - report: dictionary tóm tắt gọn: số hàng, số lỗi theo loại (kèm vài số hàng mẫu), số giá trị mặc định đã áp dụng.
+    """
+    df = data if isinstance(data, pd.DataFrame) else rows_to_frame(data)
+
+    if 'row_number' in df.columns:
+        row_numbers = pd.to_numeric(df['row_number'], errors='coerce')
+        fallback = pd.Series(range(first_row_number, first_row_number + len(df)), index=df.index)
+        row_numbers = row_numbers.fillna(fallback).astype('int64')
+    else:
+        row_numbers = pd.Series(range(first_row_number, first_row_number + len(df)), index=df.index)
+
+    errors = pd.Series('', index=df.index, dtype=object)
+    coerced = {}
+    defaults_applied = {}
+
+    def record_error(mask, reason):
+        # Chỉ giữ lỗi đầu tiên của mỗi hàng
+        errors[mask & errors.eq('')] = reason
+
+    for column, spec in columns.items():
+        raw = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        blank = _is_blank(raw)
+        required = spec.get('required', False)
+        default = spec.get('default')
+
+        if required:
+            record_error(blank, f"Thiếu giá trị '{column}'")
+        elif blank.any() and default != '':
+            defaults_applied[column] = int(blank.sum())
+
+        if spec['type'] in ('float', 'int'):
+            values = pd.to_numeric(raw, errors='coerce')
+            record_error(values.isna() & ~blank, f"'{column}' không phải số")
+            if 'min' in spec:
+                record_error(values.lt(spec['min']), f"'{column}' nhỏ hơn {spec['min']}")
+            if 'max' in spec:
+                record_error(values.gt(spec['max']), f"'{column}' lớn hơn {spec['max']}")
+            if not required and default is not None:
+                values = values.where(~blank, default)
+            coerced[column] = values
+        else:
+            values = raw.where(~blank, '').astype(str).str.strip()
+            if not required:
+                if default is None:
+                    prefix = default_name_prefix or column
+                    values = values.where(~blank, prefix + ' ' + row_numbers.astype(str))
+                else:
+                    values = values.where(~blank, default)
+            coerced[column] = values
+
+    valid = errors.eq('')
+    clean_df = df[valid].copy()
+    for column, spec in columns.items():
+        values = coerced[column][valid]
+        if spec['type'] == 'int':
+            # Cắt phần thập phân giống int() của Python
+            values = values.astype('float64').astype('int64')
+        elif spec['type'] == 'float':
+            values = values.astype('float64')
+        clean_df[column] = values
+
+    rejected_df = df[~valid].copy()
+    rejected_df['_row'] = row_numbers[~valid]
+    rejected_df['_error'] = errors[~valid]
+
+    error_summary = {}
+    for reason, group in rejected_df.groupby('_error', sort=False)['_row']:
+        error_summary[reason] = {'count': int(len(group)), 'rows': [int(row) for row in group.head(REPORT_SAMPLE_ROWS)]}
+
+    report = {
+        'total_rows': int(len(df)),
+        'valid_rows': int(valid.sum()),
+        'invalid_rows': int((~valid).sum()),
+        'errors': error_summary,
+        'defaults_applied': defaults_applied,
+    }
+    return clean_df, rejected_df, report
+
+
+def format_report(report):
+    """Tạo một dòng log ngắn gọn từ báo cáo kiểm tra dữ liệu."""
+    message = f"{report['valid_rows']}/{report['total_rows']} hàng hợp lệ"
+    if report['errors']:
+        details = "; ".join(
+            f"{reason}: {info['count']} hàng (ví dụ hàng {', '.join(str(row) for row in info['rows'])})"
+            for reason, info in report['errors'].items()
+        )
+        message += f". Bị loại: {details}"
+    if report['defaults_applied']:
+        defaults = ", ".join(f"{column}={count}" for column, count in report['defaults_applied'].items())
+        message += f". Giá trị mặc định đã áp dụng: {defaults}"
+    return message
+
+
+def new_report():
+    """Báo cáo rỗng dùng để cộng dồn kết quả kiểm tra của nhiều lô dữ liệu."""
+    return {'total_rows': 0, 'valid_rows': 0, 'invalid_rows': 0, 'errors': {}, 'defaults_applied': {}}
+
+
+def merge_report(total, report):
+    """Cộng dồn báo cáo của một lô vào báo cáo tổng (giữ tối đa REPORT_SAMPLE_ROWS hàng mẫu cho mỗi lỗi)."""
+    for key in ('total_rows', 'valid_rows', 'invalid_rows'):
+        total[key] += report[key]
+    for reason, info in report['errors'].items():
+        summary = total['errors'].setdefault(reason, {'count': 0, 'rows': []})
+        summary['count'] += info['count']
+        summary['rows'] = (summary['rows'] + info['rows'])[:REPORT_SAMPLE_ROWS]
+    for column, count in report['defaults_applied'].items():
+        total['defaults_applied'][column] = total['defaults_applied'].get(column, 0) + count
+    return total
+
+
+def validate_batches(batches, columns, report, first_row_number=1, default_name_prefix=None, on_rejected=None):
+    """
+    Kiểm tra dữ liệu đọc dạng luồng theo từng lô và trả về (generator) các hàng hợp lệ dưới dạng dictionary,
+    để việc tạo KML/gọi API có thể chạy song song với việc đọc file.
+
+    Args:
+        batches (iterable): Các lô hàng (list), ví dụ từ json_stream.iter_row_batches.
+        columns (dict): Mô tả cột (SITE_COLUMNS, LINE_COLUMNS, ROUTE_COLUMNS).
+        report (dict): Báo cáo tổng (từ new_report()), được cộng dồn sau mỗi lô.
+        first_row_number (int): Số thứ tự của hàng đầu tiên trong lô đầu tiên.
+        default_name_prefix (str, optional): Xem validate_table.
+        on_rejected (callable, optional): Hàm gọi với (batch, rejected_df) cho mỗi lô có hàng bị loại.
+                                          Index của rejected_df là vị trí hàng trong batch.
+
+    Yields:
+        tuple: (batch, index, record) - lô chứa hàng gốc, vị trí hàng trong lô và hàng đã chuẩn hóa.
+    """
+    row_number = first_row_number
+    for batch in batches:
+        clean_df, rejected_df, batch_report = validate_table(batch, columns, first_row_number=row_number, default_name_prefix=default_name_prefix)
+        merge_report(report, batch_report)
+        if on_rejected and not rejected_df.empty:
+            on_rejected(batch, rejected_df)
+        row_number += len(batch)
+        for index, record in zip(clean_df.index, clean_df.to_dict('records')):
+            yield batch, index, record
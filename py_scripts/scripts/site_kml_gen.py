@@ -2,9 +2,35 @@ import sys
 import json
 import os
 import argparse
+import math
+from geo_export import GeoExporter, add_export_arguments, folder_properties
+from row_validation import SITE_COLUMNS, validate_batches, new_report, format_report
+from json_stream import iter_row_batches, InputFormatError
+
+# Cấu hình cho chế độ gom cụm điểm (clustering)
+CLUSTER_ICON_URL = "http://maps.google.com/mapfiles/kml/paddle/wht-blank.png"
+CLUSTER_ICON_SCALE = 1.2
+CLUSTER_LOD_PIXELS = 256 # Kích thước 1 tile bản đồ (pixel), ô lưới ở mức zoom z hiển thị đúng bằng 1 tile tại zoom z
+DEFAULT_CLUSTER_ZOOMS = "10,12,14"
+
+# Hàm tạo thẻ Region để giới hạn mức zoom hiển thị của một placemark
+def create_region_kml(north, south, east, west, min_lod_pixels, max_lod_pixels):
+	return f"""
+	  <Region>
+		<LatLonAltBox>
+		  <north>{north}</north>
+		  <south>{south}</south>
+		  <east>{east}</east>
+		  <west>{west}</west>
+		</LatLonAltBox>
+		<Lod>
+		  <minLodPixels>{min_lod_pixels}</minLodPixels>
+		  <maxLodPixels>{max_lod_pixels}</maxLodPixels>
+		</Lod>
+	  </Region>"""
 
 # Hàm tạo một placemark cho điểm
-def create_point_placemark(site_name, lat, lon, description, icon_url, icon_scale):
+def create_point_placemark(site_name, lat, lon, description, icon_url, icon_scale, region_kml=""):
 	def format_coord(lon, lat):
 		return f"{lon},{lat},0" # Altitude is 0 for points unless specified
 
@@ -26,6 +52,7 @@ def create_point_placemark(site_name, lat, lon, description, icon_url, icon_scal
 	  <name>{site_name}</name>
 	  {description_kml}
 	  <styleUrl>#{style_id}</styleUrl>
+	  {region_kml}
 	  <Point>
 		<coordinates>
 		  {format_coord(lon, lat)}
@@ -35,7 +62,90 @@ def create_point_placemark(site_name, lat, lon, description, icon_url, icon_scal
 
 	return style_kml, placemark_kml
 
-def generate_kml_from_sites(items_to_process, doc_name="Dữ liệu điểm KML từ Google Sheet"):
+# Hàm tạo placemark cho một cụm điểm (hiển thị số lượng điểm trong cụm)
+def create_cluster_placemark(count, lat, lon, region_kml):
+	return f"""
+	<Placemark>
+	  <name>{count}</name>
+	  <description>Cụm gồm {count} điểm</description>
+	  <styleUrl>#clusterStyle</styleUrl>
+	  {region_kml}
+	  <Point>
+		<coordinates>
+		  {lon},{lat},0
+		</coordinates>
+	  </Point>
+	</Placemark>"""
+
+def grid_cell_size(zoom):
+	"""Kích thước ô lưới (độ) tương ứng với 1 tile bản đồ ở mức zoom cho trước."""
+	return 360.0 / (2 ** zoom)
+
+def cluster_sites_by_grid(sites, cluster_zooms):
+	"""
+	Gom cụm các điểm bằng băm lưới (grid hashing) O(n) ở nhiều mức zoom.
+	Args:
+		sites (list): Danh sách dictionary chứa 'site_name', 'lat', 'lon', 'description', 'icon_url', 'icon_scale'.
+		cluster_zooms (list): Các mức zoom dùng để gom cụm (ví dụ: [10, 12, 14]).
+	Returns:
+		list: Danh sách chuỗi KML placemark. Mỗi mức zoom chỉ hiển thị trong khoảng zoom của nó (qua Region/Lod),
+		      các điểm riêng lẻ chỉ hiển thị khi phóng to hơn mức zoom lớn nhất.
+	"""
+	placemarks = []
+	# Ô lưới lớn (zoom nhỏ) hiển thị trước, ô lưới nhỏ hiển thị khi phóng to dần
+	cell_sizes = [grid_cell_size(zoom) for zoom in sorted(set(cluster_zooms))]
+
+	def cell_bounds(ix, iy, cell_size):
+		# Trả về (north, south, east, west) của ô lưới
+		return (iy + 1) * cell_size, iy * cell_size, (ix + 1) * cell_size, ix * cell_size
+
+	for level, cell_size in enumerate(cell_sizes):
+		# Mức thô nhất hiển thị từ khi thu nhỏ tối đa, các mức sau hiển thị khi ô lưới của mức trước vượt quá 1 tile
+		min_lod_pixels = CLUSTER_LOD_PIXELS * cell_size / cell_sizes[level - 1] if level > 0 else 0
+
+		cells = {}
+		for site in sites:
+			key = (math.floor(site['lon'] / cell_size), math.floor(site['lat'] / cell_size))
+			cells.setdefault(key, []).append(site)
+
+		for (ix, iy), members in cells.items():
+			region_kml = create_region_kml(*cell_bounds(ix, iy, cell_size), min_lod_pixels, CLUSTER_LOD_PIXELS)
+			if len(members) == 1:
+				# Ô chỉ có 1 điểm: hiển thị chính điểm đó thay vì cụm
+				site = members[0]
+				_, placemark_kml = create_point_placemark(
+					site['site_name'], site['lat'], site['lon'], site['description'], site['icon_url'], site['icon_scale'], region_kml
+				)
+			else:
+				lat = sum(site['lat'] for site in members) / len(members)
+				lon = sum(site['lon'] for site in members) / len(members)
+				placemark_kml = create_cluster_placemark(len(members), lat, lon, region_kml)
+			placemarks.append(placemark_kml)
+
+	# Các điểm riêng lẻ chỉ hiển thị khi ô lưới nhỏ nhất vượt quá 1 tile
+	finest_cell_size = cell_sizes[-1]
+	for site in sites:
+		ix = math.floor(site['lon'] / finest_cell_size)
+		iy = math.floor(site['lat'] / finest_cell_size)
+		region_kml = create_region_kml(*cell_bounds(ix, iy, finest_cell_size), CLUSTER_LOD_PIXELS, -1)
+		_, placemark_kml = create_point_placemark(
+			site['site_name'], site['lat'], site['lon'], site['description'], site['icon_url'], site['icon_scale'], region_kml
+		)
+		placemarks.append(placemark_kml)
+
+	return placemarks
+
+def generate_kml_from_sites(items_to_process, doc_name="Dữ liệu điểm KML từ Google Sheet", cluster_zooms=None, exporter=None):
+	"""
+	Tạo nội dung KML từ danh sách điểm.
+	Args:
+		items_to_process (list): Danh sách các dictionary chứa thông tin điểm đã qua validate_table (SITE_COLUMNS).
+		doc_name (str): Tên của Document trong KML.
+		cluster_zooms (list, optional): Các mức zoom để gom cụm điểm trong từng thư mục. None để tắt gom cụm.
+		exporter (GeoExporter, optional): Đối tượng xuất GeoJSON/GeoPackage/FlatGeobuf, ghi cùng lúc với KML.
+	Returns:
+		str: Chuỗi nội dung KML hoặc None nếu không có dữ liệu hợp lệ.
+	"""
 	all_styles = []
 	# Cấu trúc cây để hỗ trợ nhiều cấp thư mục
 	# grouped_placemarks sẽ là một dictionary mà mỗi key là tên thư mục (hoặc '' cho gốc)
@@ -43,65 +153,86 @@ def generate_kml_from_sites(items_to_process, doc_name="Dữ liệu điểm KML
 	grouped_placemarks = {'placemarks': [], 'subfolders': {}} # Khởi tạo gốc của cấu trúc thư mục KML
 	has_valid_data = False
 
-	for i, data_item in enumerate(items_to_process):
-		site_name = data_item.get("SiteName", f"Điểm {i+1}")
-		try:
-			# Kiểm tra các khóa bắt buộc và chuyển đổi kiểu dữ liệu
-			lat = float(data_item["Latitude"])
-			lon = float(data_item["Longitude"])
-			icon_url = str(data_item["Icon"])
-			icon_scale = float(data_item.get("IconScale", 1.0))
-			description = str(data_item.get("Description", "")).strip()
-			folder_name = str(data_item.get("FolderName", "")).strip()
-			second_folder_name = str(data_item.get("SecondFolderName", "")).strip()
-			third_folder_name = str(data_item.get("ThirdFolderName", "")).strip()
-
-			style_kml, placemark_kml = create_point_placemark(site_name, lat, lon, description, icon_url, icon_scale)
-			all_styles.append(style_kml)
-
-			# Logic nhóm cho 3 cấp thư mục
-			current_level_node = grouped_placemarks # Bắt đầu từ gốc của cấu trúc thư mục KML
-
-			# Duyệt qua các cấp thư mục và tạo/truy cập node tương ứng
-			# current_level_node sẽ luôn trỏ đến dictionary chứa 'placemarks' và 'subfolders'
-			# của cấp hiện tại.
-			
-			# Cấp 1: FolderName
-			if folder_name:
-				if folder_name not in current_level_node['subfolders']:
-					current_level_node['subfolders'][folder_name] = {'placemarks': [], 'subfolders': {}}
-				current_level_node = current_level_node['subfolders'][folder_name] # Di chuyển vào node của FolderName
-
-				# Cấp 2: SecondFolderName
-				if second_folder_name:
-					if second_folder_name not in current_level_node['subfolders']:
-						current_level_node['subfolders'][second_folder_name] = {'placemarks': [], 'subfolders': {}}
-					current_level_node = current_level_node['subfolders'][second_folder_name] # Di chuyển vào node của SecondFolderName
-
-					# Cấp 3: ThirdFolderName
-					if third_folder_name:
-						if third_folder_name not in current_level_node['subfolders']:
-							current_level_node['subfolders'][third_folder_name] = {'placemarks': [], 'subfolders': {}}
-						current_level_node = current_level_node['subfolders'][third_folder_name] # Di chuyển vào node của ThirdFolderName
-			
-			# Thêm placemark vào danh sách 'placemarks' của thư mục đích cuối cùng
+	for data_item in items_to_process:
+		site_name = data_item["SiteName"]
+		# Dữ liệu đã được kiểm tra và ép kiểu theo cột bởi row_validation
+		lat = data_item["Latitude"]
+		lon = data_item["Longitude"]
+		icon_url = data_item["Icon"]
+		icon_scale = data_item["IconScale"]
+		description = data_item["Description"]
+		folder_name = data_item["FolderName"]
+		second_folder_name = data_item["SecondFolderName"]
+		third_folder_name = data_item["ThirdFolderName"]
+
+		style_kml, placemark_kml = create_point_placemark(site_name, lat, lon, description, icon_url, icon_scale)
+		all_styles.append(style_kml)
+
+		# Logic nhóm cho 3 cấp thư mục
+		current_level_node = grouped_placemarks # Bắt đầu từ gốc của cấu trúc thư mục KML
+
+		# Duyệt qua các cấp thư mục và tạo/truy cập node tương ứng
+		# current_level_node sẽ luôn trỏ đến dictionary chứa 'placemarks' và 'subfolders'
+		# của cấp hiện tại.
+		
+		# Cấp 1: FolderName
+		if folder_name:
+			if folder_name not in current_level_node['subfolders']:
+				current_level_node['subfolders'][folder_name] = {'placemarks': [], 'subfolders': {}}
+			current_level_node = current_level_node['subfolders'][folder_name] # Di chuyển vào node của FolderName
+
+			# Cấp 2: SecondFolderName
+			if second_folder_name:
+				if second_folder_name not in current_level_node['subfolders']:
+					current_level_node['subfolders'][second_folder_name] = {'placemarks': [], 'subfolders': {}}
+				current_level_node = current_level_node['subfolders'][second_folder_name] # Di chuyển vào node của SecondFolderName
+
+				# Cấp 3: ThirdFolderName
+				if third_folder_name:
+					if third_folder_name not in current_level_node['subfolders']:
+						current_level_node['subfolders'][third_folder_name] = {'placemarks': [], 'subfolders': {}}
+					current_level_node = current_level_node['subfolders'][third_folder_name] # Di chuyển vào node của ThirdFolderName
+		
+		# Thêm placemark vào danh sách 'placemarks' của thư mục đích cuối cùng
+		if cluster_zooms:
+			# Khi gom cụm, placemark được tạo sau khi đã có đủ các điểm của thư mục
+			current_level_node.setdefault('sites', []).append({
+				'site_name': site_name, 'lat': lat, 'lon': lon, 'description': description,
+				'icon_url': icon_url, 'icon_scale': icon_scale
+			})
+		else:
 			current_level_node['placemarks'].append(placemark_kml)
-			
-			has_valid_data = True
-
-		except (ValueError, TypeError) as e:
-			print(f"[LOG]: Lỗi chuyển đổi kiểu dữ liệu cho '{site_name}' (hàng {i+1}): {e}. Bỏ qua. Dữ liệu: {json.dumps(data_item)}", file=sys.stderr)
-			continue
-		except KeyError as e:
-			print(f"[LOG]: Lỗi: Thiếu khóa bắt buộc {e} cho '{site_name}' (hàng {i+1}). Bỏ qua. Dữ liệu: {json.dumps(data_item)}", file=sys.stderr)
-			continue
-		except Exception as e:
-			print(f"[LOG]: Đã xảy ra lỗi không mong muốn khi xử lý '{site_name}' (hàng {i+1}): {e}. Dữ liệu: {json.dumps(data_item)}", file=sys.stderr)
-			continue
+
+		if exporter and exporter.enabled:
+			exporter.write(
+				{'type': 'Point', 'coordinates': [lon, lat]},
+				{'SiteName': str(site_name), 'Description': description, 'Icon': icon_url, 'IconScale': icon_scale, **folder_properties(data_item)}
+			)
+		
+		has_valid_data = True
 
 	if not has_valid_data:
 		return None # Trả về None nếu không có dữ liệu hợp lệ để tạo KML
 
+	if cluster_zooms:
+		# Gom cụm riêng trong từng thư mục để giữ nguyên cấu trúc FolderName
+		def cluster_folder_recursive(current_folder_node):
+			if current_folder_node.get('sites'):
+				current_folder_node['placemarks'].extend(cluster_sites_by_grid(current_folder_node['sites'], cluster_zooms))
+			for subfolder_node in current_folder_node['subfolders'].values():
+				cluster_folder_recursive(subfolder_node)
+
+		cluster_folder_recursive(grouped_placemarks)
+		all_styles.append(f"""
+	<Style id="clusterStyle">
+	  <IconStyle>
+		<scale>{CLUSTER_ICON_SCALE}</scale>
+		<Icon>
+		  <href>{CLUSTER_ICON_URL}</href>
+		</Icon>
+	  </IconStyle>
+	</Style>""")
+
 	unique_styles = sorted(list(set(all_styles)))
 	styles_combined = "".join(unique_styles)
 	
@@ -169,27 +300,57 @@ if __name__ == "__main__":
         help='Đường dẫn đầy đủ để lưu file KML đầu ra.'
     )
 
+	parser.add_argument(
+        '--cluster',
+        action='store_true',
+        help='Gom cụm các điểm gần nhau theo lưới ở nhiều mức zoom (dùng cho lớp điểm dày đặc).'
+    )
+
+	parser.add_argument(
+        '--cluster-zooms',
+        type=str,
+        default=DEFAULT_CLUSTER_ZOOMS,
+        help=f'Danh sách mức zoom dùng để gom cụm, cách nhau bởi dấu phẩy (mặc định: {DEFAULT_CLUSTER_ZOOMS}).'
+    )
+
+	add_export_arguments(parser)
+
 	args = parser.parse_args()
 
-	items_to_process = []
-	# Đọc dữ liệu từ file JSON
-	try:
-		with open(args.input_file, 'r', encoding='utf-8') as file: # Mở file với encoding UTF-8
-			# Giả định cấu trúc JSON là một mảng chứa một đối tượng có key "rawData"
-			# hoặc trực tiếp là một mảng các đối tượng
-			loaded_data = json.load(file)
-			if isinstance(loaded_data, list) and len(loaded_data) > 0 and "rawData" in loaded_data[0]:
-				items_to_process = loaded_data[0]["rawData"]
-			elif isinstance(loaded_data, list):
-				items_to_process = loaded_data
-			else:
-				raise ValueError("Cấu trúc JSON không hợp lệ. Mong đợi một mảng hoặc một đối tượng có key 'rawData'.")
+	cluster_zooms = None
+	if args.cluster:
+		try:
+			cluster_zooms = [int(zoom) for zoom in args.cluster_zooms.split(',') if zoom.strip()]
+		except ValueError:
+			result = {"status": "error", "message": f"Lỗi: --cluster-zooms không hợp lệ: '{args.cluster_zooms}'."}
+			print(json.dumps(result))
+			sys.exit(1)
 
-	except FileNotFoundError:
+	if not os.path.isfile(args.input_file):
 		result = {"status": "error", "message": f"Lỗi: File đầu vào '{args.input_file}' không tồn tại."}
 		print(json.dumps(result))
 		sys.exit(1)
-	except json.JSONDecodeError as e:
+
+	try:
+		exporter = GeoExporter(
+			geojson_path=args.output_geojson, gpkg_path=args.output_gpkg, fgb_path=args.output_fgb,
+			layer_name="sites", geometry_type="Point"
+		)
+	except Exception as e:
+		result = {"status": "error", "message": f"Lỗi khi mở file xuất GeoJSON/GeoPackage/FlatGeobuf: {e}"}
+		print(json.dumps(result))
+		sys.exit(1)
+
+	# Đọc file JSON dạng luồng theo từng lô, kiểm tra/chuẩn hóa từng lô theo cột và tạo KML ngay khi có dữ liệu
+	report = new_report()
+	clean_records = (record for _, _, record in validate_batches(
+		iter_row_batches(args.input_file), SITE_COLUMNS, report, default_name_prefix="Điểm"
+	))
+
+	try:
+		with exporter:
+			kml_content = generate_kml_from_sites(clean_records, cluster_zooms=cluster_zooms, exporter=exporter)
+	except InputFormatError as e:
 		result = {"status": "error", "message": f"Lỗi parse JSON trong file '{args.input_file}': {e}"}
 		print(json.dumps(result))
 		sys.exit(1)
@@ -198,13 +359,14 @@ if __name__ == "__main__":
 		print(json.dumps(result))
 		sys.exit(1)
 
-	if not items_to_process:
+	if report['invalid_rows'] or report['defaults_applied']:
+		print(f"[LOG]: {format_report(report)}", file=sys.stderr)
+
+	if report['total_rows'] == 0:
 		result = {"status": "error", "message": "Không có dữ liệu hợp lệ trong file JSON đầu vào để tạo KML."}
 		print(json.dumps(result))
 		sys.exit(1)
 
-	kml_content = generate_kml_from_sites(items_to_process)
-
 	if kml_content:
 		try:
 			# Đảm bảo thư mục chứa file đầu ra tồn tại
@@ -220,8 +382,10 @@ if __name__ == "__main__":
 			result = {
 				"status": "success",
 				"kml_file_path": args.output_file,
-				"message": f"Tạo file KML thành công từ {len(items_to_process)} điểm."
+				"message": f"Tạo file KML thành công từ {report['valid_rows']}/{report['total_rows']} điểm."
 			}
+			if exporter.paths:
+				result["export_files"] = exporter.paths
 			print(json.dumps(result))
 
 		except IOError as e:
@@ -3,122 +3,281 @@ from netmiko.exceptions import NetmikoAuthenticationException, NetmikoTimeoutExc
 import sys
 import json
 import argparse
-import textfsm
-from netmiko.utilities import get_structured_data
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ntc_parser import get_structured_data
+from textfsm_registry import parse_with_template
+from ssh_cli import add_ssh_arguments, resolve_ssh_targets, single_command_result
+from result_cache import add_cache_arguments, cache_from_args, run_commands_cached
+from stream_exec import stream_command
 
-def ssh_to_router_with_netmiko(device_type, hostname, username, password, command, use_textfsm=False, textfsm_template=None, port=22, timeout=10):
+def parse_command_output(output, device_type, command, textfsm_template=None):
     """
-    Kết nối SSH tới một thiết bị router bằng Netmiko và thực hiện một câu lệnh.
-    Trả về cả output thô và output đã được phân tích (nếu có).
+    Phân tích output thô bằng template TextFSM tùy chỉnh (nếu có) hoặc ntc-templates.
+
+    Returns:
+        tuple: (parsed_output, error_message) - error_message là None nếu phân tích thành công.
+    """
+    parsed_output = None
+    error_message = None
+    try:
+        if textfsm_template:
+            # Sử dụng template tùy chỉnh do người dùng cung cấp
+            parsed_output = parse_with_template(output, textfsm_template)
+        else:
+            # Sử dụng ntc-templates (index và template được cache, xem ntc_parser.py)
+            parsed_output = get_structured_data(output, platform=device_type, command=command)
+
+        # Kiểm tra nếu parsing không trả về kết quả nào
+        if not parsed_output:
+            error_message = "Phân tích TextFSM không tìm thấy dữ liệu khớp. Output có thể không đúng định dạng hoặc template không phù hợp."
+
+    except FileNotFoundError:
+        error_message = f"Lỗi phân tích TextFSM: File template '{textfsm_template}' không tồn tại."
+    except Exception as e:
+        # Bắt các lỗi parsing khác (ví dụ: ntc-templates chưa cài, lỗi cú pháp template)
+        error_message = f"Lỗi trong quá trình phân tích TextFSM: {e}"
+    return parsed_output, error_message
+
+def run_commands_on_connection(net_connect, device_type, commands, use_textfsm=False, read_timeout=120):
+    """
+    Chạy lần lượt các câu lệnh trên một kết nối Netmiko đã mở.
 
     Args:
-        device_type (str): Kiểu thiết bị (ví dụ: 'juniper', 'cisco_ios', 'arista_eos', v.v.).
-                           Tham khảo tài liệu Netmiko để biết danh sách đầy đủ.
-        hostname (str): Địa chỉ IP hoặc hostname của router.
-        username (str): Tên người dùng SSH.
-        password (str): Mật khẩu SSH.
-        command (str): Câu lệnh CLI cần thực hiện.
-        use_textfsm (bool): True nếu muốn parse output bằng TextFSM.
-        textfsm_template (str, optional): Đường dẫn đến file template TextFSM tùy chỉnh.
-                                           Nếu không cung cấp, sẽ sử dụng ntc-templates.
-        port (int): Cổng SSH (mặc định là 22).
-        timeout (int): Thời gian chờ kết nối (mặc định là 10 giây).
+        commands (list): Danh sách {'key', 'command', 'textfsm_template'} (xem command_batch.load_command_specs).
 
     Returns:
-        dict: Một từ điển chứa kết quả (output, parsed_output), lỗi (error) và trạng thái.
+        dict: {key: {'success', 'output', 'parsed_output', 'error'}} theo thứ tự câu lệnh.
     """
-    device_params = {
+    results = {}
+    for spec in commands:
+        try:
+            output = net_connect.send_command(spec['command'], read_timeout=read_timeout)
+        except Exception as e:
+            # Lệnh lỗi (ví dụ: quá thời gian chờ) không làm dừng các lệnh còn lại
+            results[spec['key']] = {'success': False, 'output': None, 'parsed_output': None, 'error': f"Đã xảy ra lỗi không mong muốn: {e}"}
+            continue
+
+        parsed_output, error_message = None, None
+        if use_textfsm:
+            parsed_output, error_message = parse_command_output(output, device_type, spec['command'], spec.get('textfsm_template'))
+        results[spec['key']] = {
+            'success': True,
+            'output': output.strip() if output else None,
+            'parsed_output': parsed_output,
+            'error': error_message
+        }
+    return results
+
+def describe_connection_error(error):
+    """Thông báo lỗi cho các lỗi khi kết nối/xác thực SSH."""
+    if isinstance(error, NetmikoAuthenticationException):
+        return "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
+    if isinstance(error, NetmikoTimeoutException):
+        return "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi."
+    # Các lỗi chung khác (ví dụ: lỗi kết nối...)
+    return f"Đã xảy ra lỗi không mong muốn: {error}"
+
+def device_params_for(device_type, hostname, username, password, port=22, timeout=10):
+    """Tham số ConnectHandler dùng chung cho mọi kết nối của ssh.py."""
+    return {
         'device_type': device_type,
         'host': hostname,
         'username': username,
         'password': password,
         'port': port,
-        'timeout': timeout,      
+        'timeout': timeout,
+        'conn_timeout': timeout,
+        'auth_timeout': timeout,
+        'banner_timeout': timeout,
         'global_delay_factor': 2 # Tăng độ trễ giữa các lệnh nếu thiết bị chậm phản hồi
     }
 
-    output = None
-    parsed_output = None
+def ssh_run_commands(device_type, hostname, username, password, commands, use_textfsm=False, port=22, timeout=10, read_timeout=120):
+    """
+    Kết nối SSH một lần và chạy nhiều câu lệnh trên cùng phiên (chỉ tốn một lần kết nối, xác thực và tắt phân trang).
+
+    Args:
+        commands (list): Danh sách {'key', 'command', 'textfsm_template'} (xem command_batch.load_command_specs).
+        Các tham số khác giống ssh_to_router_with_netmiko.
+
+    Returns:
+        dict: {'success': True nếu mọi lệnh chạy được, 'results': {key: kết quả từng lệnh}, 'error': lỗi kết nối (nếu có)}.
+    """
+    device_params = device_params_for(device_type, hostname, username, password, port, timeout)
+
+    results = {}
     error_message = None
-    success = False
 
     try:
         # Sử dụng 'with' để đảm bảo kết nối được đóng tự động
         with ConnectHandler(**device_params) as net_connect:
-            
-            # 1. Luôn chạy lệnh để lấy output thô
-            output = net_connect.send_command(command, read_timeout=120)
-            success = True # Nếu lệnh thất bại, Netmiko sẽ ném ra exception
-
-            # 2. Nếu yêu cầu, phân tích output thô bằng TextFSM
-            if use_textfsm:
-                try:
-                    if textfsm_template:
-                        # Sử dụng template tùy chỉnh do người dùng cung cấp
-                        with open(textfsm_template) as template_file:
-                            fsm = textfsm.TextFSM(template_file)
-                            parsed_output = fsm.ParseTextToDicts(output)
-                    else:
-                        # Sử dụng thư viện ntc-templates tích hợp của Netmiko
-                        parsed_output = get_structured_data(output, platform=device_type, command=command)
-
-                    # Kiểm tra nếu parsing không trả về kết quả nào
-                    if not parsed_output:
-                        error_message = "Phân tích TextFSM không tìm thấy dữ liệu khớp. Output có thể không đúng định dạng hoặc template không phù hợp."
-
-                except FileNotFoundError:
-                    error_message = f"Lỗi phân tích TextFSM: File template '{textfsm_template}' không tồn tại."
-                except Exception as e:
-                    # Bắt các lỗi parsing khác (ví dụ: ntc-templates chưa cài, lỗi cú pháp template)
-                    error_message = f"Lỗi trong quá trình phân tích TextFSM: {e}"
-
-    except NetmikoAuthenticationException:
-        error_message = "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
-        success = False
-    except NetmikoTimeoutException:
-        error_message = "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi."
-        success = False
+            results = run_commands_on_connection(net_connect, device_type, commands, use_textfsm, read_timeout)
+
     except Exception as e:
-        # Bắt các lỗi chung khác (ví dụ: lỗi kết nối, lệnh không hợp lệ...)
-        error_message = f"Đã xảy ra lỗi không mong muốn: {e}"
-        success = False
+        error_message = describe_connection_error(e)
 
     return {
-        'success': success,
-        'output': output.strip() if output else None,
-        'parsed_output': parsed_output,
+        'success': error_message is None and all(result['success'] for result in results.values()),
+        'results': results,
         'error': error_message
     }
 
+def ssh_to_router_with_netmiko(device_type, hostname, username, password, command, use_textfsm=False, textfsm_template=None, port=22, timeout=10, read_timeout=120):
+    """
+    Kết nối SSH tới một thiết bị router bằng Netmiko và thực hiện một câu lệnh.
+    Trả về cả output thô và output đã được phân tích (nếu có).
+
+    Args:
+        device_type (str): Kiểu thiết bị (ví dụ: 'juniper', 'cisco_ios', 'arista_eos', v.v.).
+                           Tham khảo tài liệu Netmiko để biết danh sách đầy đủ.
+        hostname (str): Địa chỉ IP hoặc hostname của router.
+        username (str): Tên người dùng SSH.
+        password (str): Mật khẩu SSH.
+        command (str): Câu lệnh CLI cần thực hiện.
+        use_textfsm (bool): True nếu muốn parse output bằng TextFSM.
+        textfsm_template (str, optional): Đường dẫn đến file template TextFSM tùy chỉnh.
+                                           Nếu không cung cấp, sẽ sử dụng ntc-templates.
+        port (int): Cổng SSH (mặc định là 22).
+        timeout (int): Thời gian chờ kết nối (mặc định là 10 giây).
+        read_timeout (int): Thời gian chờ tối đa output của câu lệnh (mặc định là 120 giây).
+
+    Returns:
+        dict: Một từ điển chứa kết quả (output, parsed_output), lỗi (error) và trạng thái.
+    """
+    commands = [{'key': command, 'command': command, 'textfsm_template': textfsm_template}]
+    batch_result = ssh_run_commands(device_type, hostname, username, password, commands, use_textfsm, port, timeout, read_timeout)
+    return single_command_result(batch_result, command)
+
+def run_host_commands(host, commands, use_textfsm=False, timeout=10, read_timeout=120, cache=None):
+    """
+    Chạy các câu lệnh trên một thiết bị (dict với 'hostname', 'device_type', 'username', 'password', 'port'),
+    qua cache kết quả nếu có (xem result_cache.run_commands_cached).
+    """
+    def run(specs):
+        return ssh_run_commands(
+            device_type=host['device_type'],
+            hostname=host['hostname'],
+            username=host['username'],
+            password=host['password'],
+            commands=specs,
+            use_textfsm=use_textfsm,
+            port=host.get('port', 22),
+            timeout=timeout,
+            read_timeout=read_timeout
+        )
+
+    if cache is None:
+        return run(commands)
+    return run_commands_cached(cache, host, commands, 'textfsm' if use_textfsm else 'raw', run)
+
+def run_on_hosts(hosts, commands, use_textfsm=False, timeout=10, read_timeout=120, workers=16, cache=None):
+    """
+    Chạy cùng các câu lệnh trên nhiều thiết bị song song bằng một nhóm thread có giới hạn.
+    Mỗi thiết bị bị giới hạn bởi timeout kết nối/xác thực và read_timeout của từng câu lệnh.
+
+    Args:
+        commands (list): Danh sách {'key', 'command', 'textfsm_template'}. Với một câu lệnh, kết quả mỗi thiết bị
+                         có dạng của ssh_to_router_with_netmiko; với nhiều câu lệnh, có dạng của ssh_run_commands.
+
+    Yields:
+        dict: Kết quả của từng thiết bị (thêm key 'host') ngay khi thiết bị đó xử lý xong.
+    """
+    def run_one(host):
+        batch_result = run_host_commands(host, commands, use_textfsm, timeout, read_timeout, cache)
+        return single_command_result(batch_result, commands[0]['key']) if len(commands) == 1 else batch_result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as pool:
+        futures = {pool.submit(run_one, host): host for host in hosts}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'success': False, 'output': None, 'parsed_output': None, 'error': f"Đã xảy ra lỗi không mong muốn: {e}"}
+            yield {'host': host['hostname'], **result}
+
+def stream_on_hosts(hosts, commands, emit, use_textfsm=False, timeout=10, read_timeout=120, workers=16):
+    """
+    Chế độ stream: đọc output từng phần và gọi emit(sự kiện) cho từng dòng/bản ghi ngay khi có (xem stream_exec.stream_command).
+    Mỗi sự kiện có thêm key 'host'; lỗi kết nối được báo bằng sự kiện {'host', 'command': None, 'done': True, 'success': False, 'error'}.
+    emit được gọi từ nhiều thread (một thread mỗi thiết bị) nhưng không bao giờ đồng thời.
+    """
+    emit_lock = threading.Lock()
+
+    def send(event):
+        with emit_lock:
+            emit(event)
+
+    def run_one(host):
+        device_params = device_params_for(host['device_type'], host['hostname'], host['username'], host['password'], host.get('port', 22), timeout)
+        try:
+            with ConnectHandler(**device_params) as net_connect:
+                for spec in commands:
+                    for event in stream_command(net_connect, host['device_type'], spec, use_textfsm, read_timeout):
+                        send({'host': host['hostname'], **event})
+        except Exception as e:
+            send({'host': host['hostname'], 'command': None, 'done': True, 'success': False, 'error': describe_connection_error(e)})
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts)))) as pool:
+        for future in [pool.submit(run_one, host) for host in hosts]:
+            future.result()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ứng dụng Python SSH dùng Netmiko để chạy lệnh trên thiết bị router.")
-    parser.add_argument('--device_type', required=True, help='Kiểu thiết bị Netmiko (ví dụ: juniper, cisco_ios).')
-    parser.add_argument('--ip', required=True, help='Địa chỉ IP hoặc hostname của router.')
-    parser.add_argument('--user', required=True, help='Tên người dùng SSH.')
-    parser.add_argument('--password', required=True, help='Mật khẩu SSH.')
-    parser.add_argument('--command', required=True, help='Câu lệnh CLI cần thực hiện trên router (đặt trong dấu ngoặc kép nếu có khoảng trắng).')
-    parser.add_argument('--use-textfsm', action='store_true', help='Sử dụng TextFSM để phân tích output.')
-    parser.add_argument('--textfsm-template', type=str, default=None, help='Đường dẫn đến file template TextFSM tùy chỉnh.')
-    parser.add_argument('--port', type=int, default=22, help='Cổng SSH (mặc định: 22).')
-    parser.add_argument('--timeout', type=int, default=10, help='Thời gian chờ kết nối SSH (mặc định: 10 giây).')
+    add_ssh_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('--stream', action='store_true', help='Đọc output từng phần và in từng dòng/bản ghi TextFSM dạng NDJSON ngay khi nhận được (cho output rất lớn).')
+    parser.add_argument('--engine', choices=['netmiko', 'async'], default='netmiko', help='Engine SSH: netmiko (mỗi phiên một thread) hoặc async (asyncssh, hàng trăm phiên trong một tiến trình; nên tăng --workers).')
 
     args = parser.parse_args()
+    hosts, commands = resolve_ssh_targets(parser, args)
+    cache = cache_from_args(args)
+    if args.engine == 'async' and cache is not None:
+        parser.error("--cache/--max-age chưa hỗ trợ với --engine async.")
+    if args.stream and (cache is not None or args.engine == 'async'):
+        parser.error("--stream không dùng cùng --cache/--max-age hoặc --engine async.")
+
+    if args.stream:
+        # Mỗi dòng là một sự kiện JSON: {'host', 'command', 'record'|'line'} hoặc {'host', 'command', 'done', ...}
+        stream_on_hosts(
+            hosts, commands, lambda event: print(json.dumps(event, ensure_ascii=False), flush=True),
+            use_textfsm=args.use_textfsm, timeout=args.timeout, read_timeout=args.read_timeout, workers=args.workers
+        )
+    elif args.engine == 'async':
+        # Chỉ nạp asyncssh khi cần
+        import asyncio
+        from async_engine import ssh_run_commands_async, run_on_hosts_async
+
+        if len(hosts) == 1 and not args.hosts_file:
+            host = hosts[0]
+            result = asyncio.run(ssh_run_commands_async(
+                host['device_type'], host['hostname'], host['username'], host['password'], commands,
+                use_textfsm=args.use_textfsm, port=host['port'], timeout=args.timeout, read_timeout=args.read_timeout
+            ))
+            if len(commands) == 1:
+                result = single_command_result(result, commands[0]['key'])
+            print(json.dumps(result, indent=2))
+        else:
+            asyncio.run(run_on_hosts_async(
+                hosts, commands, lambda result: print(json.dumps(result, ensure_ascii=False), flush=True),
+                use_textfsm=args.use_textfsm, timeout=args.timeout, read_timeout=args.read_timeout, workers=args.workers
+            ))
+    elif len(hosts) == 1 and not args.hosts_file:
+        # Một thiết bị: một lệnh giữ nguyên định dạng kết quả như trước, nhiều lệnh trả về {'success', 'results', 'error'}
+        result = run_host_commands(hosts[0], commands, args.use_textfsm, args.timeout, args.read_timeout, cache)
+        if len(commands) == 1:
+            result = single_command_result(result, commands[0]['key'])
 
-    # Gọi hàm Netmiko chính
-    result = ssh_to_router_with_netmiko(
-        device_type=args.device_type,
-        hostname=args.ip,
-        username=args.user,
-        password=args.password,
-        command=args.command,
-        use_textfsm=args.use_textfsm,
-        textfsm_template=args.textfsm_template,
-        port=args.port,
-        timeout=args.timeout
-    )
-
-    # In kết quả ra console dưới dạng JSON
-    print(json.dumps(result, indent=2))
+        # In kết quả ra console dưới dạng JSON
+        print(json.dumps(result, indent=2))
+    else:
+        # Nhiều thiết bị: mỗi dòng là kết quả JSON của một thiết bị (NDJSON), in ra ngay khi thiết bị đó xong
+        for result in run_on_hosts(
+            hosts, commands, use_textfsm=args.use_textfsm,
+            timeout=args.timeout, read_timeout=args.read_timeout, workers=args.workers, cache=cache
+        ):
+            print(json.dumps(result, ensure_ascii=False), flush=True)
 
     # Nếu có lỗi, thoát với mã lỗi khác 0
     # if not result.get('success'):
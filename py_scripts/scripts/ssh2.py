@@ -1,20 +1,20 @@
+from netmiko import ConnectHandler
 from netmiko.exceptions import NetmikoAuthenticationException, NetmikoTimeoutException
 import sys
 import json
 import argparse
-from netmiko_wrapper import smart_send_command  # Wrapper bạn đã tạo để fallback
-
-def ssh_to_router_with_wrapper(device_type, hostname, username, password, command, use_textfsm=False, textfsm_template=None, prefer_custom=False, port=22, timeout=10):
-    device_params = {
-        'device_type': device_type,
-        'host': hostname,
-        'username': username,
-        'password': password,
-        'port': port,
-        'timeout': timeout,
-        'global_delay_factor': 2
-    }
+from netmiko_wrapper import smart_send_on_connection, parse_custom_template  # Wrapper bạn đã tạo để fallback
+from command_batch import load_command_specs
+from textfsm_registry import default_registry
+from result_cache import add_cache_arguments, cache_from_args, run_commands_cached
 
+def run_command_with_wrapper(conn, device_type, spec, use_textfsm=False, prefer_custom=False):
+    """
+    Chạy một lệnh trên kết nối đã mở và trả về kết quả {'success', 'output', 'parsed_output', 'error'}.
+    Lệnh có template riêng (spec['textfsm_template']) được phân tích bằng template đó, các lệnh khác đi qua smart_send_on_connection.
+    """
+    command = spec['command']
+    textfsm_template = spec.get('textfsm_template')
     output = None
     parsed_output = None
     error_message = None
@@ -23,16 +23,12 @@ def ssh_to_router_with_wrapper(device_type, hostname, username, password, comman
     try:
         # Nếu dùng template tùy chỉnh, ép luôn dùng textfsm
         if use_textfsm and textfsm_template:
-            from textfsm import TextFSM
-            with open(textfsm_template) as tf:
-                fsm = TextFSM(tf)
-                raw_output = smart_send_command(device_params, command)
-                output = raw_output if isinstance(raw_output, str) else None
-                parsed_output = fsm.ParseTextToDicts(output)
+            # Biên dịch (hoặc lấy từ cache) template trước khi gửi lệnh để báo lỗi template ngay
+            default_registry.compiled(textfsm_template)
+            output = conn.send_command(command, use_textfsm=False)
+            parsed_output = parse_custom_template(output, textfsm_template)
         else:
-            # print("Sử dụng Netmiko để gửi lệnh...")
-            result = smart_send_command(device_params, command, prefer_custom=prefer_custom)
-            # print("Kết quả từ Netmiko:", result)
+            result = smart_send_on_connection(conn, device_type, command, prefer_custom=prefer_custom)
             if isinstance(result, str):
                 output = result
                 parsed_output = None
@@ -42,10 +38,6 @@ def ssh_to_router_with_wrapper(device_type, hostname, username, password, comman
 
         success = True
 
-    except NetmikoAuthenticationException:
-        error_message = "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
-    except NetmikoTimeoutException:
-        error_message = "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi."
     except FileNotFoundError:
         error_message = f"Template không tồn tại: {textfsm_template}"
     except Exception as e:
@@ -58,33 +50,104 @@ def ssh_to_router_with_wrapper(device_type, hostname, username, password, comman
         'error': error_message
     }
 
+def ssh_run_commands_with_wrapper(device_type, hostname, username, password, commands, use_textfsm=False, prefer_custom=False, port=22, timeout=10):
+    """
+    Chạy nhiều lệnh trên cùng một phiên SSH (một lần kết nối/xác thực cho cả lô lệnh).
+
+    Args:
+        commands (list): Danh sách {'key', 'command', 'textfsm_template'} (xem command_batch.load_command_specs).
+
+    Returns:
+        dict: {'success': True nếu mọi lệnh thành công, 'results': {key: kết quả từng lệnh}, 'error': lỗi kết nối (nếu có)}.
+    """
+    device_params = {
+        'device_type': device_type,
+        'host': hostname,
+        'username': username,
+        'password': password,
+        'port': port,
+        'timeout': timeout,
+        'global_delay_factor': 2
+    }
+
+    results = {}
+    error_message = None
+
+    try:
+        with ConnectHandler(**device_params) as conn:
+            for spec in commands:
+                results[spec['key']] = run_command_with_wrapper(conn, device_type, spec, use_textfsm, prefer_custom)
+
+    except NetmikoAuthenticationException:
+        error_message = "Lỗi xác thực: Tên người dùng hoặc mật khẩu không đúng."
+    except NetmikoTimeoutException:
+        error_message = "Lỗi timeout: Không thể kết nối hoặc thiết bị không phản hồi."
+    except Exception as e:
+        error_message = f"Đã xảy ra lỗi không mong muốn: {e}"
+
+    return {
+        'success': error_message is None and all(result['success'] for result in results.values()),
+        'results': results,
+        'error': error_message
+    }
+
+def ssh_to_router_with_wrapper(device_type, hostname, username, password, command, use_textfsm=False, textfsm_template=None, prefer_custom=False, port=22, timeout=10):
+    commands = [{'key': command, 'command': command, 'textfsm_template': textfsm_template}]
+    batch_result = ssh_run_commands_with_wrapper(device_type, hostname, username, password, commands, use_textfsm, prefer_custom, port, timeout)
+    if batch_result['error'] or command not in batch_result['results']:
+        return {'success': False, 'output': None, 'parsed_output': None, 'error': batch_result['error']}
+    return batch_result['results'][command]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ứng dụng Python SSH dùng Netmiko Wrapper để fallback NTC + custom TextFSM.")
     parser.add_argument('--device_type', required=True)
     parser.add_argument('--ip', required=True)
     parser.add_argument('--user', required=True)
     parser.add_argument('--password', required=True)
-    parser.add_argument('--command', required=True)
+    parser.add_argument('--command', action='append', help='Lặp lại --command để chạy nhiều lệnh trên cùng một phiên SSH.')
+    parser.add_argument('--commands-json', type=str, default=None, help='Chuỗi JSON hoặc file JSON: mảng câu lệnh hoặc {"command", "textfsm_template", "key"}.')
     parser.add_argument('--use-textfsm', action='store_true')
     parser.add_argument('--textfsm-template', type=str, default=None)
     parser.add_argument('--prefer-custom', action='store_true', help='Ưu tiên sử dụng template tùy chỉnh trước khi dùng NTC-Templates.')
     parser.add_argument('--port', type=int, default=22)
     parser.add_argument('--timeout', type=int, default=10)
+    add_cache_arguments(parser)
 
     args = parser.parse_args()
+    cache = cache_from_args(args)
+
+    try:
+        commands = load_command_specs(args.command, args.commands_json, args.textfsm_template)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
 
-    result = ssh_to_router_with_wrapper(
-        device_type=args.device_type,
-        hostname=args.ip,
-        username=args.user,
-        password=args.password,
-        command=args.command,
-        use_textfsm=args.use_textfsm,
-        textfsm_template=args.textfsm_template,
-        prefer_custom=args.prefer_custom,
-        port=args.port,
-        timeout=args.timeout
-    )
+    def run(specs):
+        return ssh_run_commands_with_wrapper(
+            device_type=args.device_type,
+            hostname=args.ip,
+            username=args.user,
+            password=args.password,
+            commands=specs,
+            use_textfsm=args.use_textfsm,
+            prefer_custom=args.prefer_custom,
+            port=args.port,
+            timeout=args.timeout
+        )
+
+    if cache is None:
+        result = run(commands)
+    else:
+        host = {'hostname': args.ip, 'device_type': args.device_type, 'port': args.port, 'username': args.user, 'password': args.password}
+        parser_variant = f"wrapper:{'custom' if args.prefer_custom else 'ntc'}:{'textfsm' if args.use_textfsm else 'auto'}"
+        result = run_commands_cached(cache, host, commands, parser_variant, run)
+
+    if len(commands) == 1:
+        # Một lệnh: giữ nguyên định dạng kết quả như trước; nhiều lệnh: kết quả theo key của từng lệnh
+        key = commands[0]['key']
+        if result['error'] or key not in result['results']:
+            result = {'success': False, 'output': None, 'parsed_output': None, 'error': result['error']}
+        else:
+            result = result['results'][key]
 
     print(json.dumps(result, indent=2))
 
@@ -0,0 +1,103 @@
+import os
+import sys
+import csv
+import json
+from command_batch import load_command_specs
+
+# Tên cột/trường được chấp nhận trong file danh sách thiết bị (JSON hoặc CSV)
+HOST_FIELD_ALIASES = {
+    'hostname': ('ip', 'host', 'hostname'),
+    'device_type': ('device_type', 'device-type'),
+    'username': ('user', 'username'),
+    'password': ('password',),
+    'port': ('port',),
+}
+
+def load_hosts_file(path):
+    """
+    Đọc danh sách thiết bị từ file JSON hoặc CSV.
+    - JSON: mảng các địa chỉ IP (chuỗi) hoặc các đối tượng {"ip", "device_type", "user", "password", "port"}.
+    - CSV: dòng tiêu đề với các cột ip (hoặc host), device_type, user, password, port; chỉ cột ip là bắt buộc.
+    Các trường không có sẽ lấy theo tham số dòng lệnh.
+
+    Returns:
+        list: Danh sách dictionary với các key của ssh_to_router_with_netmiko (hostname, device_type, username, password, port).
+    """
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            entries = list(csv.DictReader(file))
+        else:
+            entries = json.load(file)
+            if not isinstance(entries, list):
+                raise ValueError("File JSON phải là một mảng các thiết bị.")
+
+    hosts = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'ip': entry}
+        host = {}
+        for field, aliases in HOST_FIELD_ALIASES.items():
+            for alias in aliases:
+                value = entry.get(alias)
+                if value not in (None, ''):
+                    host[field] = value.strip() if isinstance(value, str) else value
+                    break
+        if 'hostname' not in host:
+            raise ValueError(f"Thiếu địa chỉ IP/host trong mục: {entry}")
+        if 'port' in host:
+            host['port'] = int(host['port'])
+        hosts.append(host)
+    return hosts
+
+def add_ssh_arguments(parser):
+    """Thêm các tham số dòng lệnh của ssh.py (dùng chung cho ssh.py và ssh_client.py)."""
+    parser.add_argument('--device_type', help='Kiểu thiết bị Netmiko (ví dụ: juniper, cisco_ios). Bắt buộc trừ khi mọi thiết bị trong --hosts-file đã có device_type.')
+    parser.add_argument('--ip', nargs='+', help='Địa chỉ IP hoặc hostname của router. Có thể truyền nhiều địa chỉ.')
+    parser.add_argument('--hosts-file', type=str, default=None, help='File JSON hoặc CSV chứa danh sách thiết bị (ip, device_type, user, password, port).')
+    parser.add_argument('--user', help='Tên người dùng SSH.')
+    parser.add_argument('--password', help='Mật khẩu SSH.')
+    parser.add_argument('--command', action='append', help='Câu lệnh CLI cần thực hiện trên router (đặt trong dấu ngoặc kép nếu có khoảng trắng).\nLặp lại --command để chạy nhiều lệnh trên cùng một phiên SSH.')
+    parser.add_argument('--commands-json', type=str, default=None, help='Chuỗi JSON hoặc file JSON: mảng câu lệnh hoặc {"command", "textfsm_template", "key"} chạy trên cùng một phiên SSH.')
+    parser.add_argument('--use-textfsm', action='store_true', help='Sử dụng TextFSM để phân tích output.')
+    parser.add_argument('--textfsm-template', type=str, default=None, help='Đường dẫn đến file template TextFSM tùy chỉnh (khi chỉ chạy một lệnh).')
+    parser.add_argument('--port', type=int, default=22, help='Cổng SSH (mặc định: 22).')
+    parser.add_argument('--timeout', type=int, default=10, help='Thời gian chờ kết nối/xác thực SSH cho mỗi thiết bị (mặc định: 10 giây).')
+    parser.add_argument('--read-timeout', type=int, default=120, help='Thời gian chờ output của câu lệnh cho mỗi thiết bị (mặc định: 120 giây).')
+    parser.add_argument('--workers', type=int, default=16, help='Số thiết bị được kết nối đồng thời khi chạy trên nhiều thiết bị (mặc định: 16).')
+
+def resolve_ssh_targets(parser, args):
+    """
+    Lấy danh sách câu lệnh và thiết bị từ tham số dòng lệnh.
+    Lỗi tham số được báo qua parser.error; lỗi đọc file thiết bị được in ra dạng JSON và thoát với mã 1.
+
+    Returns:
+        tuple: (hosts, commands) - hosts đã được bổ sung các trường mặc định từ dòng lệnh.
+    """
+    try:
+        commands = load_command_specs(args.command, args.commands_json, args.textfsm_template)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    hosts = [{'hostname': ip} for ip in (args.ip or [])]
+    if args.hosts_file:
+        try:
+            hosts.extend(load_hosts_file(args.hosts_file))
+        except (OSError, ValueError) as e:
+            print(json.dumps({'success': False, 'output': None, 'parsed_output': None, 'error': f"Lỗi đọc file danh sách thiết bị: {e}"}, indent=2))
+            sys.exit(1)
+    if not hosts:
+        parser.error("Cần ít nhất một thiết bị: dùng --ip hoặc --hosts-file.")
+
+    # Các trường không có trong file danh sách thiết bị lấy theo tham số dòng lệnh
+    defaults = {'device_type': args.device_type, 'username': args.user, 'password': args.password, 'port': args.port}
+    hosts = [{**defaults, **host} for host in hosts]
+    missing = sorted({field for host in hosts for field in ('device_type', 'username', 'password') if not host.get(field)})
+    if missing:
+        parser.error(f"Thiếu thông tin cho một số thiết bị: {', '.join(missing)} (truyền qua tham số dòng lệnh hoặc --hosts-file).")
+    return hosts, commands
+
+def single_command_result(batch_result, key):
+    """Chuyển kết quả nhiều lệnh {'success', 'results', 'error'} của một lệnh về định dạng kết quả một lệnh."""
+    if batch_result['error'] or key not in batch_result['results']:
+        return {'success': False, 'output': None, 'parsed_output': None, 'error': batch_result['error']}
+    return batch_result['results'][key]
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import socket
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ssh_cli import add_ssh_arguments, resolve_ssh_targets, single_command_result
+
+# Trùng với ssh_pool_daemon.DEFAULT_SOCKET_PATH; không import daemon để client không phải nạp Netmiko
+DEFAULT_SOCKET_PATH = os.environ.get('NETMIKO_POOL_SOCKET', '/tmp/netmiko_pool.sock')
+
+
+def send_request(socket_path, request, timeout=None):
+    """Gửi một request JSON tới daemon pool SSH và nhận về một dòng JSON kết quả."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Daemon pool SSH đóng kết nối mà không trả kết quả.")
+    return json.loads(line)
+
+
+def daemon_available(socket_path):
+    try:
+        return send_request(socket_path, {'action': 'ping'}, timeout=2).get('success', False)
+    except (OSError, ValueError):
+        return False
+
+
+def run_via_daemon(socket_path, host, commands, use_textfsm, timeout, read_timeout):
+    """Chạy các câu lệnh trên một thiết bị qua daemon; kết quả có dạng giống ssh.py."""
+    request = {
+        'action': 'run',
+        'host': host,
+        'commands': commands,
+        'use_textfsm': use_textfsm,
+        'timeout': timeout,
+        'read_timeout': read_timeout,
+        'single': len(commands) == 1,
+    }
+    # Thời gian chờ socket đủ cho kết nối, xác thực và toàn bộ các lệnh
+    socket_timeout = timeout * 3 + read_timeout * len(commands) + 10
+    try:
+        return send_request(socket_path, request, timeout=socket_timeout)
+    except (OSError, ValueError) as e:
+        error = f"Lỗi khi gọi daemon pool SSH: {e}"
+        if len(commands) == 1:
+            return {'success': False, 'output': None, 'parsed_output': None, 'error': error}
+        return {'success': False, 'results': {}, 'error': error}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client gọn nhẹ của ssh.py: chuyển request tới daemon pool SSH (ssh_pool_daemon.py) để dùng lại kết nối đã xác thực.")
+    add_ssh_arguments(parser)
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help=f'Đường dẫn Unix socket của daemon (mặc định: {DEFAULT_SOCKET_PATH}).')
+    parser.add_argument('--no-fallback', action='store_true', help='Báo lỗi thay vì tự kết nối trực tiếp khi daemon không chạy.')
+
+    args = parser.parse_args()
+    hosts, commands = resolve_ssh_targets(parser, args)
+    single_host = len(hosts) == 1 and not args.hosts_file
+
+    if not daemon_available(args.socket):
+        if args.no_fallback:
+            print(json.dumps({'success': False, 'output': None, 'parsed_output': None, 'error': f"Không kết nối được daemon pool SSH tại {args.socket}."}, indent=2))
+            sys.exit(1)
+        # Daemon không chạy: kết nối trực tiếp như ssh.py (chỉ lúc này mới nạp Netmiko)
+        print(f"Daemon pool SSH không chạy tại {args.socket}, kết nối trực tiếp.", file=sys.stderr)
+        from ssh import ssh_run_commands, run_on_hosts
+        if single_host:
+            host = hosts[0]
+            result = ssh_run_commands(
+                device_type=host['device_type'],
+                hostname=host['hostname'],
+                username=host['username'],
+                password=host['password'],
+                commands=commands,
+                use_textfsm=args.use_textfsm,
+                port=host['port'],
+                timeout=args.timeout,
+                read_timeout=args.read_timeout
+            )
+            if len(commands) == 1:
+                result = single_command_result(result, commands[0]['key'])
+            print(json.dumps(result, indent=2))
+        else:
+            for result in run_on_hosts(
+                hosts, commands, use_textfsm=args.use_textfsm,
+                timeout=args.timeout, read_timeout=args.read_timeout, workers=args.workers
+            ):
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+        sys.exit(0)
+
+    if single_host:
+        result = run_via_daemon(args.socket, hosts[0], commands, args.use_textfsm, args.timeout, args.read_timeout)
+        print(json.dumps(result, indent=2))
+    else:
+        # Nhiều thiết bị: mỗi dòng là kết quả JSON của một thiết bị (NDJSON), giống ssh.py
+        with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(hosts)))) as pool:
+            futures = {
+                pool.submit(run_via_daemon, args.socket, host, commands, args.use_textfsm, args.timeout, args.read_timeout): host
+                for host in hosts
+            }
+            for future in as_completed(futures):
+                print(json.dumps({'host': futures[future]['hostname'], **future.result()}, ensure_ascii=False), flush=True)
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import signal
+import logging
+import argparse
+import threading
+import socketserver
+from netmiko import ConnectHandler
+from ssh import run_commands_on_connection, describe_connection_error, device_params_for
+from ssh_cli import single_command_result
+
+# Đường dẫn Unix socket mặc định, có thể đổi bằng biến môi trường NETMIKO_POOL_SOCKET
+DEFAULT_SOCKET_PATH = os.environ.get('NETMIKO_POOL_SOCKET', '/tmp/netmiko_pool.sock')
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+
+
+class PooledConnection:
+    """Một kết nối Netmiko đã xác thực cùng thời điểm sử dụng gần nhất."""
+
+    def __init__(self, net_connect):
+        self.net_connect = net_connect
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        try:
+            return bool(self.net_connect.is_alive())
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.net_connect.disconnect()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Pool các kết nối Netmiko theo key (host, port, device_type, username, mật khẩu đã băm).
+    Mỗi key giữ tối đa max_per_key kết nối; một kết nối chỉ được một request dùng tại một thời điểm.
+    Kết nối rảnh quá idle_timeout giây bị đóng; kết nối chết bị loại khi lấy ra hoặc khi kiểm tra định kỳ.
+    """
+
+    def __init__(self, idle_timeout=300, max_per_key=2, connect_timeout=10):
+        self.idle_timeout = idle_timeout
+        self.max_per_key = max_per_key
+        self.connect_timeout = connect_timeout
+        self._idle = {}    # key -> list PooledConnection đang rảnh
+        self._in_use = {}  # key -> số kết nối đang được dùng
+        self._cond = threading.Condition()
+        self.stats = {'connects': 0, 'reuses': 0, 'evicted': 0, 'dead': 0}
+
+    @staticmethod
+    def pool_key(host):
+        password_digest = hashlib.sha256(str(host['password']).encode('utf-8')).hexdigest()[:16]
+        return (host['hostname'], int(host.get('port', 22)), host['device_type'], host['username'], password_digest)
+
+    def _count(self, key):
+        return len(self._idle.get(key, [])) + self._in_use.get(key, 0)
+
+    def acquire(self, host, connect_timeout=None):
+        """
+        Lấy một kết nối cho thiết bị: dùng lại kết nối rảnh còn sống, nếu không thì mở kết nối mới.
+        Returns:
+            tuple: (key, PooledConnection, True nếu là kết nối dùng lại)
+        """
+        key = self.pool_key(host)
+        connect_timeout = connect_timeout or self.connect_timeout
+        wait_until = time.monotonic() + connect_timeout * 3
+        with self._cond:
+            while True:
+                while self._idle.get(key):
+                    conn = self._idle[key].pop()
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    # Kiểm tra kết nối ngoài khóa để không chặn các thiết bị khác
+                    self._cond.release()
+                    try:
+                        alive = conn.is_alive()
+                    finally:
+                        self._cond.acquire()
+                    if alive:
+                        self.stats['reuses'] += 1
+                        return key, conn, True
+                    self._in_use[key] -= 1
+                    self.stats['dead'] += 1
+                    conn.close()
+                if self._count(key) < self.max_per_key:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    break
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Hết thời gian chờ kết nối rảnh trong pool.")
+                self._cond.wait(remaining)
+
+        try:
+            params = device_params_for(host['device_type'], host['hostname'], host['username'], host['password'],
+                                       int(host.get('port', 22)), connect_timeout)
+            conn = PooledConnection(ConnectHandler(**params))
+        except Exception:
+            with self._cond:
+                self._in_use[key] -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.stats['connects'] += 1
+        return key, conn, False
+
+    def release(self, key, conn, broken=False):
+        """Trả kết nối về pool; kết nối lỗi (broken) bị đóng thay vì dùng lại."""
+        with self._cond:
+            self._in_use[key] -= 1
+            if broken:
+                self.stats['dead'] += 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.setdefault(key, []).append(conn)
+            self._cond.notify_all()
+        if broken:
+            conn.close()
+
+    def sweep(self, check_health=False):
+        """Đóng các kết nối rảnh quá idle_timeout; check_health=True thì kiểm tra luôn các kết nối rảnh còn lại."""
+        now = time.monotonic()
+        expired, to_check = [], []
+        with self._cond:
+            for key, conns in self._idle.items():
+                keep = []
+                for conn in conns:
+                    if now - conn.last_used > self.idle_timeout:
+                        expired.append(conn)
+                    elif check_health:
+                        # Tạm tính là đang dùng để acquire không mở thêm kết nối vượt giới hạn
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                        to_check.append((key, conn))
+                    else:
+                        keep.append(conn)
+                self._idle[key] = keep
+            self.stats['evicted'] += len(expired)
+            self._cond.notify_all()
+
+        for conn in expired:
+            conn.close()
+        for key, conn in to_check:
+            alive = conn.is_alive()
+            with self._cond:
+                self._in_use[key] -= 1
+                if alive:
+                    self._idle.setdefault(key, []).append(conn)
+                else:
+                    self.stats['dead'] += 1
+                self._cond.notify_all()
+            if not alive:
+                conn.close()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                **self.stats,
+                'idle': sum(len(conns) for conns in self._idle.values()),
+                'in_use': sum(self._in_use.values()),
+                'keys': len([key for key in set(self._idle) | set(self._in_use) if self._count(key)]),
+            }
+
+    def close_all(self):
+        with self._cond:
+            conns = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+def run_pooled(pool, host, commands, use_textfsm=False, timeout=None, read_timeout=120):
+    """
+    Chạy các câu lệnh trên một thiết bị bằng kết nối lấy từ pool.
+    Returns:
+        dict: Giống ssh.ssh_run_commands, thêm key 'reused' cho biết có dùng lại kết nối hay không.
+    """
+    try:
+        key, conn, reused = pool.acquire(host, timeout)
+    except Exception as e:
+        return {'success': False, 'results': {}, 'error': describe_connection_error(e), 'reused': False}
+
+    try:
+        results = run_commands_on_connection(conn.net_connect, host['device_type'], commands, use_textfsm, read_timeout)
+    except Exception as e:
+        # Kết nối có thể đã hỏng giữa chừng: đóng lại để request sau mở kết nối mới
+        pool.release(key, conn, broken=True)
+        return {'success': False, 'results': {}, 'error': describe_connection_error(e), 'reused': reused}
+    success = all(result['success'] for result in results.values())
+    # Lệnh lỗi khi gửi/đọc (ví dụ: timeout) có thể để lại output dở trong kênh: không dùng lại kết nối này
+    pool.release(key, conn, broken=not success)
+    return {
+        'success': success,
+        'results': results,
+        'error': None,
+        'reused': reused
+    }
+
+
+class PoolRequestHandler(socketserver.StreamRequestHandler):
+    """Mỗi dòng JSON gửi tới là một request, mỗi request nhận về đúng một dòng JSON."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)
+            except Exception as e:
+                response = {'success': False, 'error': f"Request không hợp lệ: {e}"}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class PoolServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        self.pool = pool
+        super().__init__(socket_path, PoolRequestHandler)
+
+    def dispatch(self, request):
+        action = request.get('action', 'run')
+        if action == 'ping':
+            return {'success': True}
+        if action == 'stats':
+            return {'success': True, 'stats': self.pool.snapshot()}
+        if action != 'run':
+            return {'success': False, 'error': f"Action không hỗ trợ: {action}"}
+
+        host, commands = request['host'], request['commands']
+        result = run_pooled(self.pool, host, commands, request.get('use_textfsm', False),
+                            request.get('timeout'), request.get('read_timeout', 120))
+        logging.info(f"{host['hostname']}: {len(commands)} lệnh, {'dùng lại' if result['reused'] else 'kết nối mới'}, "
+                     f"{'thành công' if result['success'] else 'lỗi'}")
+        if request.get('single') and len(commands) == 1:
+            return {**single_command_result(result, commands[0]['key']), 'reused': result['reused']}
+        return result
+
+
+def start_maintenance(pool, stop_event, health_interval):
+    """Thread nền: định kỳ loại kết nối rảnh quá hạn và kiểm tra sức khỏe các kết nối còn lại."""
+    def loop():
+        last_health = time.monotonic()
+        while not stop_event.wait(min(15, health_interval)):
+            check_health = time.monotonic() - last_health >= health_interval
+            if check_health:
+                last_health = time.monotonic()
+            pool.sweep(check_health=check_health)
+
+    thread = threading.Thread(target=loop, name='pool-maintenance', daemon=True)
+    thread.start()
+    return thread
+
+
+def serve(socket_path, idle_timeout=300, max_per_key=2, connect_timeout=10, health_interval=60):
+    if os.path.exists(socket_path):
+        # Xóa socket cũ của lần chạy trước (tiến trình đã dừng)
+        os.remove(socket_path)
+    pool = ConnectionPool(idle_timeout=idle_timeout, max_per_key=max_per_key, connect_timeout=connect_timeout)
+    stop_event = threading.Event()
+    server = PoolServer(socket_path, pool)
+    # Chỉ người dùng chạy daemon được gửi request (request chứa mật khẩu thiết bị)
+    os.chmod(socket_path, 0o600)
+    start_maintenance(pool, stop_event, health_interval)
+    # Dừng bằng SIGTERM (systemd, docker stop) cũng dọn dẹp kết nối và socket như Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info(f"Daemon pool SSH đang lắng nghe tại {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        pool.close_all()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        logging.info("Đã dừng daemon pool SSH.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daemon giữ pool kết nối SSH (Netmiko) đã xác thực, phục vụ ssh_client.py qua Unix socket.")
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help=f'Đường dẫn Unix socket (mặc định: {DEFAULT_SOCKET_PATH}).')
+    parser.add_argument('--idle-timeout', type=int, default=300, help='Đóng kết nối rảnh sau số giây này (mặc định: 300).')
+    parser.add_argument('--max-connections-per-key', type=int, default=2, help='Số kết nối tối đa cho mỗi thiết bị/tài khoản (mặc định: 2).')
+    parser.add_argument('--timeout', type=int, default=10, help='Thời gian chờ kết nối/xác thực SSH khi request không chỉ định (mặc định: 10 giây).')
+    parser.add_argument('--health-interval', type=int, default=60, help='Chu kỳ kiểm tra sức khỏe các kết nối rảnh (mặc định: 60 giây).')
+    args = parser.parse_args()
+
+    serve(args.socket, args.idle_timeout, args.max_connections_per_key, args.timeout, args.health_interval)
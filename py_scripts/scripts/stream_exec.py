@@ -0,0 +1,156 @@
+import time
+from netmiko.exceptions import ReadTimeout
+from textfsm_registry import default_registry, clone_fsm
+from ntc_parser import default_index
+
+# Nghỉ ngắn giữa các lần đọc kênh khi thiết bị chưa gửi thêm dữ liệu
+POLL_INTERVAL = 0.05
+
+
+def iter_command_lines(net_connect, command, read_timeout=120):
+    """
+    Gửi lệnh trên kết nối Netmiko đã mở và yield từng dòng output ngay khi nhận được,
+    thay vì chờ toàn bộ output như send_command. Dòng lặp lại lệnh và dòng prompt cuối được bỏ.
+
+    Raises:
+        ReadTimeout: Nếu không thấy prompt sau read_timeout giây.
+    """
+    prompt = net_connect.find_prompt().strip()
+    net_connect.write_channel(command + net_connect.RETURN)
+    deadline = time.monotonic() + read_timeout
+    pending = ''
+    echo_checked = False
+
+    while True:
+        chunk = net_connect.read_channel()
+        if not chunk:
+            if time.monotonic() > deadline:
+                raise ReadTimeout(f"Không thấy prompt '{prompt}' sau {read_timeout} giây khi chạy lệnh '{command}'.")
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        pending += chunk.replace('\r\n', '\n').replace('\r', '')
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            if not echo_checked:
+                echo_checked = True
+                if line.strip().endswith(command.strip()):
+                    continue
+            yield line
+        # Dòng chưa kết thúc chính là prompt: lệnh đã chạy xong
+        if pending.strip() == prompt:
+            return
+
+
+class StreamingTextFSM:
+    """
+    Chạy TextFSM theo từng lô dòng (ParseText với eof=False) và trả về các bản ghi vừa hoàn tất,
+    để không phải giữ toàn bộ output hay toàn bộ kết quả trong bộ nhớ.
+    Template có Value 'Fillup' (sửa ngược các bản ghi trước) thì chỉ trả bản ghi khi kết thúc.
+    """
+
+    def __init__(self, fsm, lowercase_keys=False):
+        self.fsm = clone_fsm(fsm)
+        self.header = [name.lower() for name in self.fsm.header] if lowercase_keys else list(self.fsm.header)
+        self.hold_records = any(option.name == 'Fillup' for value in self.fsm.values for option in value.options)
+        self.finished = False
+
+    def _take_records(self, rows):
+        if self.hold_records:
+            return []
+        records = [dict(zip(self.header, row)) for row in rows]
+        # rows là danh sách kết quả bên trong FSM: xóa các bản ghi đã trả để giải phóng bộ nhớ
+        rows.clear()
+        return records
+
+    def feed(self, lines):
+        """Đưa thêm các dòng output vào FSM, trả về list bản ghi (dict) vừa hoàn tất."""
+        if self.finished or not lines:
+            return []
+        # Mỗi dòng đều đã kết thúc bằng xuống dòng: thêm '\n' cuối để ParseText (splitlines) không bỏ dòng trống cuối lô
+        rows = self.fsm.ParseText('\n'.join(lines) + '\n', eof=False)
+        # FSM chuyển sang trạng thái End thì bỏ qua phần output còn lại (giống ParseText trên toàn bộ output)
+        self.finished = self.fsm._cur_state_name in ('End', 'EOF')
+        return self._take_records(rows)
+
+    def close(self):
+        """Kết thúc output (xử lý EOF của template), trả về các bản ghi còn lại."""
+        rows = self.fsm.ParseText('', eof=not self.finished)
+        self.hold_records = False
+        return self._take_records(rows)
+
+
+def streaming_parser_for(device_type, command, textfsm_template=None):
+    """
+    Chọn template cho chế độ stream: template truyền vào, nếu không có thì template ntc-templates của lệnh.
+    Returns:
+        StreamingTextFSM hoặc None nếu không có template phù hợp.
+    """
+    if textfsm_template:
+        return StreamingTextFSM(default_registry.compiled(textfsm_template))
+    template_path = default_index().template_path(device_type, command)
+    if template_path is None:
+        return None
+    # Tên cột viết thường giống kết quả get_structured_data
+    return StreamingTextFSM(default_registry.compiled(template_path), lowercase_keys=True)
+
+
+def stream_command(net_connect, device_type, spec, use_textfsm=False, read_timeout=120, batch_lines=200):
+    """
+    Chạy một lệnh ở chế độ stream và yield các sự kiện:
+    - {'command', 'record': {...}}: bản ghi TextFSM (khi use_textfsm và có template),
+    - {'command', 'line': '...'}: dòng output thô (khi không parse),
+    - {'command', 'done': True, 'success', 'records', 'error'}: kết thúc lệnh.
+    """
+    key = spec['key']
+    parser = None
+    error_message = None
+    records = 0
+
+    if use_textfsm:
+        try:
+            parser = streaming_parser_for(device_type, spec['command'], spec.get('textfsm_template'))
+            if parser is None:
+                error_message = "Không tìm thấy template TextFSM cho lệnh, trả về output thô."
+        except FileNotFoundError:
+            yield {'command': key, 'done': True, 'success': False, 'records': 0,
+                   'error': f"Lỗi phân tích TextFSM: File template '{spec.get('textfsm_template')}' không tồn tại."}
+            return
+
+    raw_mode = parser is None
+    batch = []
+
+    def parse(lines, final=False):
+        nonlocal parser, error_message
+        if parser is None:
+            return []
+        try:
+            return parser.feed(lines) + (parser.close() if final else [])
+        except Exception as e:
+            # Lỗi phân tích giữa chừng (ví dụ: TextFSMError): các bản ghi đã gửi vẫn giữ nguyên,
+            # phần output còn lại vẫn được đọc hết để kênh sạch cho lệnh sau
+            parser = None
+            error_message = f"Lỗi trong quá trình phân tích TextFSM: {e}"
+            return []
+
+    try:
+        for line in iter_command_lines(net_connect, spec['command'], read_timeout):
+            if raw_mode:
+                yield {'command': key, 'line': line}
+                continue
+            batch.append(line)
+            if len(batch) >= batch_lines:
+                for record in parse(batch):
+                    records += 1
+                    yield {'command': key, 'record': record}
+                batch = []
+        for record in parse(batch, final=True):
+            records += 1
+            yield {'command': key, 'record': record}
+    except ReadTimeout as e:
+        yield {'command': key, 'done': True, 'success': False, 'records': records, 'error': f"Đã xảy ra lỗi không mong muốn: {e}"}
+        return
+
+    if not raw_mode and records == 0 and error_message is None:
+        error_message = "Phân tích TextFSM không tìm thấy dữ liệu khớp. Output có thể không đúng định dạng hoặc template không phù hợp."
+    yield {'command': key, 'done': True, 'success': True, 'records': records, 'error': error_message}
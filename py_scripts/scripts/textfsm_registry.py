@@ -0,0 +1,124 @@
+import os
+import copy
+import threading
+import textfsm
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Thư mục template tùy chỉnh: 'templates' đặt tên theo {device_type}_{lệnh}.textfsm, 'textfsm_template' dùng qua đường dẫn
+DEFAULT_TEMPLATE_DIRS = (os.path.join(SCRIPT_DIR, "templates"), os.path.join(SCRIPT_DIR, "textfsm_template"))
+TEMPLATE_EXTENSION = ".textfsm"
+
+
+def normalize_command(command):
+    """Chuẩn hóa tên lệnh giống quy ước đặt tên file template (chữ thường, '_' thay cho khoảng trắng và '/')."""
+    return command.lower().strip().replace(" ", "_").replace("/", "_")
+
+
+def clone_fsm(fsm):
+    """
+    Tạo bản sao FSM để parse mà không biên dịch lại template.
+    Các state/rule (chứa regex đã biên dịch) chỉ đọc nên được dùng chung; chỉ các Value và option
+    (giữ giá trị của bản ghi đang parse) được sao chép, nên FSM gốc an toàn khi nhiều thread cùng parse.
+    """
+    clone = copy.copy(fsm)
+    clone.values = []
+    for value in fsm.values:
+        new_value = copy.copy(value)
+        new_value.fsm = clone
+        new_value.options = []
+        for option in value.options:
+            new_option = copy.copy(option)
+            new_option.value = new_value
+            new_value.options.append(new_option)
+        clone.values.append(new_value)
+    clone.Reset()
+    return clone
+
+
+class TemplateRegistry:
+    """
+    Chỉ mục các template TextFSM tùy chỉnh và cache bản đã biên dịch.
+    - Thư mục template chỉ được quét lại khi mtime của thư mục thay đổi (thêm/xóa/đổi tên file).
+    - Mỗi file template được biên dịch một lần và chỉ biên dịch lại khi mtime của file thay đổi;
+      mỗi lần parse dùng một bản sao nhẹ của FSM đã biên dịch (xem clone_fsm).
+    """
+
+    def __init__(self, template_dirs=DEFAULT_TEMPLATE_DIRS):
+        self.template_dirs = tuple(template_dirs)
+        self._lock = threading.Lock()
+        self._dir_mtimes = None
+        self._index = {}     # tên file không có đuôi -> đường dẫn
+        self._compiled = {}  # đường dẫn tuyệt đối -> (mtime_ns, TextFSM đã biên dịch)
+
+    def _dir_state(self):
+        state = []
+        for directory in self.template_dirs:
+            try:
+                state.append(os.stat(directory).st_mtime_ns)
+            except OSError:
+                state.append(None)
+        return tuple(state)
+
+    def _ensure_index(self):
+        state = self._dir_state()
+        if state == self._dir_mtimes:
+            return
+        index = {}
+        for directory in self.template_dirs:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                stem, extension = os.path.splitext(name)
+                # Thư mục đứng trước được ưu tiên khi trùng tên
+                if extension == TEMPLATE_EXTENSION and stem not in index:
+                    index[stem] = os.path.join(directory, name)
+        self._index, self._dir_mtimes = index, state
+
+    def find(self, device_type, command):
+        """Tìm template tùy chỉnh {device_type}_{lệnh}.textfsm; trả về đường dẫn hoặc None."""
+        with self._lock:
+            self._ensure_index()
+            return self._index.get(f"{device_type}_{normalize_command(command)}")
+
+    def compiled(self, template_path):
+        """
+        Trả về FSM đã biên dịch của file template (biên dịch lại nếu file đã thay đổi).
+        Raises:
+            FileNotFoundError: Nếu file template không tồn tại.
+            textfsm.TextFSMTemplateError: Nếu template sai cú pháp.
+        """
+        path = os.path.abspath(template_path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._compiled.get(path)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+
+        with open(path) as template_file:
+            fsm = textfsm.TextFSM(template_file)
+        with self._lock:
+            self._compiled[path] = (mtime_ns, fsm)
+        return fsm
+
+    def parse(self, template_path, output):
+        """Phân tích output với template, trả về list dictionary giống TextFSM.ParseTextToDicts."""
+        return clone_fsm(self.compiled(template_path)).ParseTextToDicts(output)
+
+    def clear(self):
+        with self._lock:
+            self._dir_mtimes = None
+            self._index = {}
+            self._compiled = {}
+
+
+default_registry = TemplateRegistry()
+
+
+def find_custom_template(device_type, command):
+    """Tìm template tùy chỉnh trong registry mặc định (xem TemplateRegistry.find)."""
+    return default_registry.find(device_type, command)
+
+
+def parse_with_template(output, template_path):
+    """Phân tích output với file template, dùng bản đã biên dịch trong registry mặc định."""
+    return default_registry.parse(template_path, output)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from log_index import LogIndex
+
+
+def test_build_after_touch_with_empty_index(tmp_path):
+    # Index của file log rỗng (0 dòng) rồi file bị tải lại (mtime đổi) không được làm build lỗi
+    log_path = tmp_path / "messages"
+    log_path.write_bytes(b"")
+    index = LogIndex(str(log_path))
+    assert index.build()
+
+    stat = os.stat(log_path)
+    os.utime(log_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert index.build()
+    assert index._read_header()['lines'] == 0
+
+
+def test_build_after_partial_line_completed(tmp_path):
+    # Dòng đầu chưa kết thúc: index 0 dòng, lần sau chỉ đọc tiếp phần đã hoàn chỉnh
+    log_path = tmp_path / "messages"
+    log_path.write_bytes(b"Oct 19 10:00:00 r1 %LINK-3-UPDOWN: Interface Gi0/1, changed state to down")
+    index = LogIndex(str(log_path))
+    index.build()
+    assert index._read_header()['lines'] == 0
+
+    with open(log_path, 'ab') as file:
+        file.write(b"\nOct 19 10:00:05 r1 %LINK-3-UPDOWN: Interface Gi0/1, changed state to up\n")
+    assert index.build()
+    with index:
+        assert [index.line_text(number) for number in index.query()] == [
+            "Oct 19 10:00:00 r1 %LINK-3-UPDOWN: Interface Gi0/1, changed state to down",
+            "Oct 19 10:00:05 r1 %LINK-3-UPDOWN: Interface Gi0/1, changed state to up",
+        ]
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+
+import pytest
+import textfsm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from ntc_parser import default_index
+from stream_exec import StreamingTextFSM
+
+BATCH_SIZES = (1, 2, 3, 7, 200)
+
+# Dòng trống kết thúc bản ghi: kết quả phụ thuộc vào việc giữ đúng các dòng trống
+BLANK_RECORD_TEMPLATE = """Value NAME (\\S+)
+Value EXTRA (\\S+)
+
+Start
+  ^name\\s+${NAME}
+  ^extra\\s+${EXTRA}
+  ^\\s*$$ -> Record
+"""
+BLANK_RECORD_OUTPUT = "name a\n\nname b\nextra y\n\nname c\n\n"
+
+CHASSIS_HARDWARE_OUTPUT = """Hardware inventory:
+Item             Version  Part number  Serial number     Description
+Chassis                                AB1234            MX480
+
+Midplane         REV 07   750-047862   ACRB1234          Enhanced MX480 Midplane
+FPM Board        REV 03   710-017254   KD1234            Front Panel Display
+
+PEM 0            Rev 10   740-029970   QCS1234           PS 1.4-2.52kW; 90-264V AC in
+PEM 1            Rev 10   740-029970   QCS1235           PS 1.4-2.52kW; 90-264V AC in
+
+Routing Engine 0 REV 10   740-051822   9009123456        RE-S-1800x4
+CB 0             REV 22   750-031391   CAJC1234          Enhanced MX SCB
+FPC 0            REV 43   750-045372   CAJD1234          MPCE Type 3 3D
+  CPU            REV 12   711-045719   CAJE1234          RMPC PMB
+"""
+
+
+def stream_records(fsm, output, batch_size):
+    # Các dòng giống iter_command_lines: mỗi dòng đã kết thúc bằng xuống dòng
+    lines = output.split('\n')[:-1]
+    parser = StreamingTextFSM(fsm)
+    records = []
+    for start in range(0, len(lines), batch_size):
+        records += parser.feed(lines[start:start + batch_size])
+    return records + parser.close()
+
+
+def full_records(fsm, output):
+    return [dict(zip(fsm.header, row)) for row in fsm.ParseText(output)]
+
+
+@pytest.mark.parametrize('batch_size', BATCH_SIZES)
+def test_blank_line_records_match_full_parse(batch_size):
+    fsm = textfsm.TextFSM(io.StringIO(BLANK_RECORD_TEMPLATE))
+    expected = full_records(textfsm.TextFSM(io.StringIO(BLANK_RECORD_TEMPLATE)), BLANK_RECORD_OUTPUT)
+    assert expected == [{'NAME': 'a', 'EXTRA': ''}, {'NAME': 'b', 'EXTRA': 'y'}, {'NAME': 'c', 'EXTRA': ''}]
+    assert stream_records(fsm, BLANK_RECORD_OUTPUT, batch_size) == expected
+
+
+@pytest.mark.parametrize('batch_size', BATCH_SIZES)
+def test_chassis_hardware_matches_full_parse(batch_size):
+    template_path = default_index().template_path('juniper_junos', 'show chassis hardware')
+    with open(template_path) as template_file:
+        fsm = textfsm.TextFSM(template_file)
+    with open(template_path) as template_file:
+        expected = full_records(textfsm.TextFSM(template_file), CHASSIS_HARDWARE_OUTPUT)
+    assert expected
+    assert stream_records(fsm, CHASSIS_HARDWARE_OUTPUT, batch_size) == expected